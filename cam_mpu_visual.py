@@ -5,6 +5,7 @@ from mpl_toolkits.mplot3d import Axes3D
 import math
 import time
 import cv2
+from cansat_protocol import SerialPacketReader, PKT_IMU, PKT_IMAGE
 
 ser = serial.Serial('COM11', 115200, timeout=2)
 
@@ -43,11 +44,26 @@ def show_image(ax, img):
     ax.axis('off')
     ax.imshow(img)
 
+reader = SerialPacketReader(ser)
+
 while True:
-    # Lee línea de datos del MPU6050
-    line = ser.readline().decode(errors='ignore').strip()
-    if not line.startswith('ACC:'):
+    # Lee el siguiente paquete: línea del MPU6050 o imagen validada (CRC y JPEG)
+    packet = reader.read_packet()
+    if packet is None:
+        continue
+    kind, data = packet
+    if kind == PKT_IMAGE:
+        img_array = np.frombuffer(data, dtype=np.uint8)
+        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        if img is not None:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            show_image(ax2, img)
+        draw_cube(ax1, pitch, roll)
+        plt.pause(0.001)
+        continue
+    if kind != PKT_IMU:
         continue
+    line = data
     try:
         acc = line.split('ACC:')[1].split(';')[0]
         gyro = line.split('GYRO:')[1].split(';')[0]
@@ -72,18 +88,3 @@ while True:
     except Exception as e:
         print('Error parsing line:', line, e)
         continue
-    # Lee imagen
-    while ser.read(1) != b'\xAA':
-        pass
-    size_bytes = ser.read(2)
-    img_size = (size_bytes[0] << 8) | size_bytes[1]
-    img_data = b''
-    while len(img_data) < img_size:
-        img_data += ser.read(img_size - len(img_data))
-    img_array = np.frombuffer(img_data, dtype=np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-    if img is not None:
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        show_image(ax2, img)
-    draw_cube(ax1, pitch, roll)
-    plt.pause(0.001) 
\ No newline at end of file
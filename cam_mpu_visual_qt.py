@@ -10,9 +10,11 @@ from PyQt5.QtCore import QTimer
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
+from cansat_protocol import StreamDecoder, PKT_IMU, PKT_IMAGE
 
 # Configura el puerto serial
 ser = serial.Serial('COM11', 115200, timeout=2)
+decoder = StreamDecoder()
 
 # Filtro complementario
 alpha = 0.98
@@ -80,11 +82,14 @@ class MainWindow(QWidget):
         self.init_cube()
 
     def update_data(self):
-        global pitch, roll, last_time
-        # Lee línea de datos del MPU6050
-        line = ser.readline().decode(errors='ignore').strip()
-        if not line.startswith('ACC:'):
-            return
+        # Procesa lo que haya llegado (líneas del MPU6050 e imágenes validadas) sin bloquear
+        for kind, data in decoder.feed(ser.read(ser.in_waiting)):
+            if kind == PKT_IMU:
+                self.handle_mpu_line(data)
+            elif kind == PKT_IMAGE:
+                self.handle_image(data)
+
+    def handle_mpu_line(self, line):
         try:
             acc = line.split('ACC:')[1].split(';')[0]
             gyro = line.split('GYRO:')[1].split(';')[0]
@@ -109,31 +114,9 @@ class MainWindow(QWidget):
             self.mpu_label.setText(f"MPU6050: pitch={self.pitch:.1f} roll={self.roll:.1f}")
         except Exception as e:
             self.mpu_label.setText(f"Error parsing: {e}")
-            return
-        # Lee imagen
-        # Sincroniza con el byte de inicio
-        while True:
-            byte = ser.read(1)
-            if byte == b'':
-                print("Timeout esperando imagen")
-                return
-            if byte == b'\xAA':
-                break
-
-        size_bytes = ser.read(2)
-        if len(size_bytes) < 2:
-            print("No se pudo leer el tamaño de la imagen")
-            return
-        img_size = (size_bytes[0] << 8) | size_bytes[1]
-        img_data = b''
-        while len(img_data) < img_size:
-            chunk = ser.read(img_size - len(img_data))
-            if not chunk:
-                print("Timeout leyendo imagen")
-                return
-            img_data += chunk
 
-        # Intenta decodificar la imagen
+    def handle_image(self, img_data):
+        # Intenta decodificar la imagen (el CRC ya se verificó en el decodificador)
         img_array = np.frombuffer(img_data, dtype=np.uint8)
         img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
         if img is not None:
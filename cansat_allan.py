@@ -0,0 +1,229 @@
+"""Varianza de Allan y parámetros de ruido del IMU a partir de capturas estáticas.
+
+Uso:
+    python cansat_allan.py log1.csv --rate 50
+    python cansat_allan.py grabaciones/cansat_20240101_120000.cnr -o ruido.json
+
+Con el CanSat quieto, calcula la desviación de Allan solapada de los seis
+ejes y de ella el ruido blanco (random walk de ángulo/velocidad, N), la
+inestabilidad de bias (B, en el mínimo de la curva) y el random walk de
+tasa (K). Cada tau sale de la suma acumulada de las muestras: una pasada
+vectorizada O(n) por tau, con taus espaciados en escala logarítmica.
+
+Además sugiere parámetros para el resto de la estación: el ruido por
+muestra de cada eje a la tasa de muestreo, en g y °/s, y el alpha del
+filtro complementario, cuya constante de tiempo se toma donde el
+giroscopio deja de mejorar al promediar (el tau del mínimo de su curva).
+Si el mínimo cae en un extremo de los taus (captura corta o no estática)
+no hay B ni constante de tiempo confiables y se informan vacíos.
+
+La hora de cada muestra sale del campo T: del firmware si lo trae; si no
+(log1.csv) se usa --rate. También lee registros compactos (.cimu) de
+cansat_imulog, que cargan mucho más rápido que el texto en capturas
+largas. La varianza de Allan supone muestreo uniforme: si faltan muestras
+se avisa, y conviene descartar capturas con huecos.
+"""
+import argparse
+import json
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from cansat_imu import PHYSICAL_SCALE, decode_imu_lines
+from cansat_imulog import is_imu_log, read_imu_log
+from cansat_protocol import parse_device_time
+from cansat_recorder import REC_IMU, REC_MAGIC, read_recording
+
+AXES = ['ax', 'ay', 'az', 'gx', 'gy', 'gz']
+UNITS = ['g'] * 3 + ['°/s'] * 3
+DEFAULT_RATE = 50.0
+TAUS_PER_DECADE = 10
+# B = mínimo de la ADEV / sqrt(2 ln 2 / pi) para ruido de parpadeo (1/f)
+FLICKER_FACTOR = math.sqrt(2 * math.log(2) / math.pi)
+
+# random_walk: N (unidad/√Hz, el valor de la recta -1/2 en tau = 1 s)
+# bias_instability: B (unidad) y bias_tau: el tau de su mínimo (s); None si el
+#   mínimo cae en un extremo de la curva
+# rate_random_walk: K (unidad·√Hz, la recta +1/2 en tau = 3 s); None si la captura es corta
+NoiseParams = namedtuple('NoiseParams', 'random_walk bias_instability bias_tau rate_random_walk')
+
+
+def load_samples(path):
+    """(samples (n, 6) en g y °/s, horas en s o None) de un CSV/texto, una grabación o un .cimu."""
+    if is_imu_log(path):
+        rows = read_imu_log(path)
+        # Hora -1: la línea no traía T:, como en el texto se usa --rate
+        t = None if (rows[:, 0] < 0).any() else rows[:, 0] / 1000.0
+        return rows[:, 2:] * PHYSICAL_SCALE, t
+    with open(path, 'rb') as f:
+        recording = f.read(len(REC_MAGIC)) == REC_MAGIC
+    if recording:
+        lines = [rec.data for rec in read_recording(path) if rec.kind == REC_IMU]
+    else:
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            lines = [line.strip() for line in f if line.startswith('ACC:')]
+    raw, valid = decode_imu_lines(lines)
+    times = [parse_device_time(line) for line in lines]
+    if any(t is None for t in times):
+        t = None
+    else:
+        t = np.asarray(times, dtype=float)[valid] / 1000.0
+    return raw[valid] * PHYSICAL_SCALE, t
+
+
+def sample_rate(t):
+    """Tasa de muestreo (Hz) y fracción de muestras faltantes según las horas."""
+    dt = np.diff(t)
+    dt = dt[dt > 0]
+    step = float(np.median(dt))
+    expected = (t[-1] - t[0]) / step + 1
+    return 1.0 / step, max(0.0, 1 - len(t) / expected)
+
+
+def cluster_sizes(n, points=TAUS_PER_DECADE):
+    """Tamaños de grupo m (en muestras) espaciados en escala logarítmica hasta (n - 1) / 2."""
+    top = (n - 1) // 2
+    if top < 1:
+        return np.zeros(0, dtype=int)
+    count = max(2, int(math.log10(top) * points) + 1)
+    return np.unique(np.logspace(0, math.log10(top), count).astype(int))
+
+
+def allan_deviation(samples, rate, m=None):
+    """Desviación de Allan solapada de cada canal.
+
+    samples es (n, canales) a `rate` Hz. Devuelve (taus (k,), adev (k, canales)).
+    """
+    y = np.asarray(samples, dtype=float)
+    if y.ndim == 1:
+        y = y[:, None]
+    n = len(y)
+    m = cluster_sizes(n) if m is None else np.asarray(m, dtype=int)
+    tau0 = 1.0 / rate
+    # theta = integral de la señal; cada tau es una segunda diferencia de theta
+    theta = np.zeros((n + 1, y.shape[1]))
+    np.cumsum(y - y.mean(axis=0), axis=0, out=theta[1:])
+    theta *= tau0
+    adev = np.empty((len(m), y.shape[1]))
+    for i, k in enumerate(m):
+        d = theta[2 * k:] - 2 * theta[k:n + 1 - k] + theta[:n + 1 - 2 * k]
+        tau = k * tau0
+        adev[i] = np.sqrt((d * d).sum(axis=0) / (2 * tau * tau * len(d)))
+    return m * tau0, adev
+
+
+def _line_at(taus, adev, slope, tau_eval, lo=0, hi=None):
+    """Valor en tau_eval de la recta de pendiente `slope` que mejor toca la curva log-log.
+
+    Solo se buscan los puntos taus[lo:hi] (de un lado del mínimo).
+    """
+    if len(taus) < 3 or not (adev > 0).all():
+        return None  # captura corta o canal constante
+    logt = np.log10(taus)
+    loga = np.log10(adev)
+    local = np.gradient(loga, logt)[lo:hi]
+    if not len(local):
+        return None
+    i = int(np.argmin(np.abs(local - slope)))
+    if abs(local[i] - slope) > 0.25:
+        return None  # la curva no tiene un tramo con esa pendiente
+    i += lo
+    return float(10 ** (loga[i] - slope * logt[i] + slope * math.log10(tau_eval)))
+
+
+def noise_parameters(taus, adev):
+    """NoiseParams de una curva de Allan (un canal)."""
+    i = int(np.argmin(adev))
+    # El ruido blanco domina desde tau0 mientras la curva baja, antes del
+    # mínimo; sin tramo -1/2 se toma el primer punto (sigma(tau0) = N / sqrt(tau0))
+    rises = np.flatnonzero(np.diff(adev) >= 0)
+    first_rise = int(rises[0]) if len(rises) else len(adev) - 1
+    random_walk = _line_at(taus, adev, -0.5, 1.0, hi=min(i, first_rise) + 1)
+    if random_walk is None and len(taus) and adev[0] > 0:
+        random_walk = float(adev[0] * math.sqrt(taus[0]))
+    if 0 < i < len(taus) - 1:
+        bias, bias_tau = float(adev[i] / FLICKER_FACTOR), float(taus[i])
+    else:
+        bias = bias_tau = None
+    return NoiseParams(random_walk, bias, bias_tau, _line_at(taus, adev, 0.5, 3.0, lo=i))
+
+
+def suggest_filter(params, rate):
+    """Parámetros sugeridos: ruido por eje a la tasa de muestreo y alpha del filtro complementario."""
+    noise = [p.random_walk * math.sqrt(rate) if p.random_walk is not None else None for p in params]
+    # El giroscopio integrado es confiable hasta el mínimo de su curva
+    taus = [p.bias_tau for p in params[3:] if p.bias_tau is not None]
+    time_constant = min(taus) if taus else None
+    dt = 1.0 / rate
+    return {
+        'noise': noise,
+        'time_constant_s': time_constant,
+        'alpha': time_constant / (time_constant + dt) if time_constant is not None else None,
+    }
+
+
+def characterize(samples, rate):
+    taus, adev = allan_deviation(samples, rate)
+    params = [noise_parameters(taus, adev[:, c]) for c in range(adev.shape[1])]
+    return taus, adev, params
+
+
+def _fmt(value):
+    return f"{value:10.3g}" if value is not None else f"{'-':>10s}"
+
+
+def format_report(params, suggestion, std):
+    lines = [f"{'eje':4s} {'unidad':6s} {'N (/√Hz)':>10s} {'B':>10s} {'tau B (s)':>10s} "
+             f"{'K (·√Hz)':>10s} {'desv. est.':>10s}"]
+    for axis, unit, p, s in zip(AXES, UNITS, params, std):
+        lines.append(f"{axis:4s} {unit:6s} {_fmt(p.random_walk)} {_fmt(p.bias_instability)} "
+                     f"{_fmt(p.bias_tau)} {_fmt(p.rate_random_walk)} {s:10.3g}")
+    lines.append('')
+    lines.append(f"Ruido por muestra: "
+                 + ', '.join(f"{a}={_fmt(v).strip()}" for a, v in zip(AXES, suggestion['noise'])))
+    if suggestion['time_constant_s'] is None:
+        lines.append("Filtro complementario: la curva del giroscopio no tiene mínimo interior "
+                     "(captura corta o no estática)")
+    else:
+        lines.append(f"Filtro complementario: constante de tiempo {suggestion['time_constant_s']:.3g} s "
+                     f"-> alpha = {suggestion['alpha']:.4f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Varianza de Allan y ruido del IMU en una captura estática.')
+    parser.add_argument('path', help='log CSV/texto con líneas ACC:...;GYRO:..., grabación .cnr o registro .cimu')
+    parser.add_argument('--rate', type=float, help=f'tasa de muestreo en Hz (por defecto, de T: o {DEFAULT_RATE:g})')
+    parser.add_argument('-o', '--output', help='guarda curvas, parámetros y sugerencias en JSON')
+    args = parser.parse_args()
+
+    samples, t = load_samples(args.path)
+    if len(samples) < 3:
+        parser.error(f"{args.path}: no hay suficientes muestras IMU")
+    rate = args.rate
+    if rate is None and t is not None and len(t) > 1:
+        rate, missing = sample_rate(t)
+        if missing > 0.01:
+            print(f"Aviso: faltan ~{missing:.1%} de las muestras; la varianza de Allan supone muestreo uniforme")
+    rate = rate or DEFAULT_RATE
+    print(f"{args.path}: {len(samples)} muestras a {rate:.3g} Hz ({len(samples) / rate:.1f} s)")
+
+    taus, adev, params = characterize(samples, rate)
+    suggestion = suggest_filter(params, rate)
+    print(format_report(params, suggestion, samples.std(axis=0)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'rate_hz': rate,
+                'samples': len(samples),
+                'axes': AXES,
+                'taus': taus.tolist(),
+                'adev': adev.T.tolist(),
+                'params': {a: p._asdict() for a, p in zip(AXES, params)},
+                'suggested': suggestion,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
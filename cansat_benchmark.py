@@ -0,0 +1,448 @@
+"""Benchmarks de la estación terrena: parseo, registro compacto, resincronización, lotes grandes,
+filtros, remuestreo, espectro, render y JPEG.
+
+Uso:
+    python cansat_benchmark.py                       # corre todo e imprime resultados
+    python cansat_benchmark.py --only parse,jpeg     # solo algunos benchmarks
+    python cansat_benchmark.py --output base.json    # guarda resultados en JSON
+    python cansat_benchmark.py --compare base.json   # compara contra una corrida previa
+    python cansat_benchmark.py --only startup        # arranque hasta el primer cuadro pintado
+
+Los datos de entrada son log1.csv, captura.jpg/captura1.jpg y flujos sintéticos.
+Con --compare el script sale con código 1 si algún benchmark empeora más que --tolerance,
+y también si el arranque (mediana hasta el primer cuadro, en un proceso nuevo) pasa de
+--startup-budget. Las propiedades del decodificador están en tests/ (python -m pytest).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+import cv2
+
+from cansat_protocol import StreamDecoder, build_fragments, build_frame, parse_imu_line
+from cansat_imu import PHYSICAL_SCALE, ComplementaryFilter, decode_imu_lines, to_physical
+from cansat_imulog import decode_log, encode_log, rows_from_lines
+from cansat_resample import UniformResampler
+from cansat_spectrum import WelchSpectrum
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, 'log1.csv')
+IMAGES = [os.path.join(BASE_DIR, 'captura.jpg'), os.path.join(BASE_DIR, 'captura1.jpg')]
+STARTUP_BUDGET_S = 1.0
+
+
+# --------- Utilidades ---------
+def load_log_lines(path=LOG_FILE):
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        return [line.strip() for line in f if line.startswith('ACC:')]
+
+
+def load_images():
+    images = []
+    for path in IMAGES:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def measure(func, items, repeat=5):
+    """Corre func() `repeat` veces; func procesa `items` elementos por corrida.
+
+    Devuelve el mejor tiempo y la mediana en microsegundos por elemento.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    median = sorted(times)[len(times) // 2]
+    return {
+        'items': items,
+        'best_us': best / items * 1e6,
+        'median_us': median / items * 1e6,
+        'rate_per_s': items / best if best > 0 else float('inf'),
+    }
+
+
+def synthetic_stream(images, frames=200, noise=64, corrupt=0.0, seed=0, fragment=0):
+    """Construye un flujo como el del firmware: línea IMU, ruido y una trama JPEG.
+
+    `corrupt` es la fracción de tramas con un byte alterado (fallan el CRC).
+    Con `fragment` > 0 cada imagen va en fragmentos de ese tamaño con una
+    línea IMU entre fragmentos, como el firmware unificado.
+    """
+    rng = random.Random(seed)
+    lines = load_log_lines()
+    out = bytearray()
+    n = 0
+    for i in range(frames):
+        out += (lines[n % len(lines)] + '\r\n').encode()
+        n += 1
+        out += bytes(rng.randrange(256) for _ in range(noise))
+        image = images[i % len(images)]
+        if fragment:
+            pieces = build_fragments(image, i & 0xFFFF, fragment)
+        else:
+            pieces = [build_frame(image)]
+        for j, piece in enumerate(pieces):
+            if j:
+                out += (lines[n % len(lines)] + '\r\n').encode()
+                n += 1
+            frame = bytearray(piece)
+            if rng.random() < corrupt:
+                frame[rng.randrange(8, len(frame) - 4)] ^= 0xFF
+            out += frame
+    return bytes(out)
+
+
+# --------- Benchmarks ---------
+def bench_parse(repeat):
+    lines = load_log_lines() * 32
+
+    def run():
+        for line in lines:
+            to_physical(*parse_imu_line(line))
+    return measure(run, len(lines), repeat)
+
+
+def bench_parse_bulk(repeat):
+    lines = load_log_lines() * 32
+
+    def run():
+        raw, valid = decode_imu_lines(lines)
+        raw * PHYSICAL_SCALE
+    return measure(run, len(lines), repeat)
+
+
+def bench_imulog(repeat):
+    rows = rows_from_lines(load_log_lines() * 32)
+    data = encode_log(rows)
+
+    def run():
+        decode_log(data)
+    result = measure(run, len(rows), repeat)
+    result['bytes_per_sample'] = len(data) / len(rows)
+    return result
+
+
+def bench_resync(repeat):
+    images = load_images()
+    frames = 200
+    stream = synthetic_stream(images, frames, corrupt=0.1)
+    chunk = 256  # lectura típica de in_waiting
+
+    def run():
+        decoder = StreamDecoder()
+        for i in range(0, len(stream), chunk):
+            decoder.feed(stream[i:i + chunk])
+        run.stats = decoder.stats.counters
+    result = measure(run, frames, repeat)
+    result['stream_bytes'] = len(stream)
+    result['counters'] = run.stats
+    return result
+
+
+def bench_backlog(repeat):
+    # Un lote grande de una sola vez, como al vaciar un atraso de la ingesta o
+    # reproducir un archivo: el costo por línea no debe crecer con el lote
+    images = load_images()
+    lines = load_log_lines() * 32
+    text = b''.join(line.encode('ascii') + b'\r\n' for line in lines)
+    half = len(text) // 2
+    half = text.index(b'\n', half) + 1
+    stream = text[:half] + b''.join(build_fragments(images[0], 1)) + text[half:]
+
+    def run():
+        decoder = StreamDecoder()
+        decoder.feed(stream)
+    result = measure(run, len(lines), repeat)
+    result['stream_bytes'] = len(stream)
+    return result
+
+
+def bench_fragments(repeat):
+    images = load_images()
+    frames = 200
+    stream = synthetic_stream(images, frames, fragment=1024)
+    chunk = 256
+
+    def run():
+        decoder = StreamDecoder()
+        for i in range(0, len(stream), chunk):
+            decoder.feed(stream[i:i + chunk])
+        run.stats = decoder.stats.counters
+    result = measure(run, frames, repeat)
+    result['stream_bytes'] = len(stream)
+    result['counters'] = run.stats
+    return result
+
+
+def bench_filter(repeat):
+    samples = [to_physical(*parse_imu_line(line)) for line in load_log_lines()] * 32
+
+    def run():
+        filt = ComplementaryFilter()
+        for s in samples:
+            filt.update(*s, 0.03)
+    return measure(run, len(samples), repeat)
+
+
+def bench_resample(repeat):
+    raw, valid = decode_imu_lines(load_log_lines() * 32)
+    samples = raw[valid] * PHYSICAL_SCALE
+    # Horas de llegada: 50 Hz con jitter y alguna línea perdida
+    rng = np.random.default_rng(0)
+    t = np.cumsum(0.02 + rng.normal(0, 0.002, len(samples)))
+    t[rng.random(len(t)) < 0.01] += 0.02
+    t = np.maximum.accumulate(t)
+    batch = 25
+
+    def run():
+        resampler = UniformResampler(6, 50.0, 'cubic')
+        for i in range(0, len(samples), batch):
+            resampler.update(t[i:i + batch], samples[i:i + batch])
+    return measure(run, len(samples), repeat)
+
+
+def bench_spectrum(repeat):
+    raw, valid = decode_imu_lines(load_log_lines() * 32)
+    samples = raw[valid] * PHYSICAL_SCALE
+    batch = 25  # ~medio segundo a 50 Hz, lo que llega entre refrescos del espectro
+
+    def run():
+        spectrum = WelchSpectrum(6)
+        for i in range(0, len(samples), batch):
+            spectrum.update(samples[i:i + batch])
+        spectrum.density(50.0)
+    return measure(run, len(samples), repeat)
+
+
+def bench_jpeg(repeat):
+    images = load_images() * 25
+
+    def run():
+        for data in images:
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return measure(run, len(images), repeat)
+
+
+def make_window():
+    """Crea la ventana principal sin pantalla para medir el render real."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance()
+    if app is None:
+        QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+        app = QApplication(sys.argv)
+    from cansat_groundstation import MainWindow
+    window = MainWindow()
+    window.finish_startup()
+    return app, window
+
+
+def startup_child():
+    """Proceso hijo de bench_startup: arranca la estación como main() e imprime
+    (JSON, time.time()) cuándo terminó los imports, creó la ventana, pintó el
+    primer cuadro y terminó los paneles diferidos."""
+    stamps = {}
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtCore import QEvent, QObject, QTimer, Qt
+    from PyQt5.QtWidgets import QApplication
+    import qdarkstyle
+    from cansat_groundstation import MainWindow
+    stamps['imports'] = time.time()
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+    app = QApplication(sys.argv[:1])
+    app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
+    window = MainWindow()
+    stamps['window'] = time.time()
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and 'paint' not in stamps:
+                stamps['paint'] = time.time()
+            return False
+
+    def check_ready():
+        if 'paint' in stamps and not window.pending_panels:
+            stamps['ready'] = time.time()
+            app.quit()
+
+    first_paint = FirstPaint()
+    window.installEventFilter(first_paint)
+    poll = QTimer()
+    poll.timeout.connect(check_ready)
+    poll.start(5)
+    window.show()
+    app.exec_()
+    print(json.dumps(stamps))
+
+
+def bench_startup(repeat):
+    """Arranque en frío: cada corrida es un intérprete nuevo (sin imports en caché)."""
+    paint = []
+    phases = []
+    for _ in range(repeat):
+        start = time.time()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-child'],
+                             capture_output=True, text=True, timeout=120, cwd=BASE_DIR)
+        stamps = json.loads(out.stdout.strip().splitlines()[-1])
+        paint.append(stamps['paint'] - start)
+        phases.append({k: round((v - start) * 1e3, 1) for k, v in stamps.items()})
+    best = min(paint)
+    median = sorted(paint)[len(paint) // 2]
+    print('startup (ms desde el lanzamiento):', phases[paint.index(median)])
+    return {
+        'items': 1,
+        'best_us': best * 1e6,
+        'median_us': median * 1e6,
+        'rate_per_s': 1 / best,
+        'phases_ms': phases,
+    }
+
+
+def bench_cube(repeat):
+    app, window = make_window()
+    # Los paneles ocultos no dibujan: se mide con el dashboard a la vista
+    window.show()
+    window.tab_widget.setCurrentIndex(0)
+    app.processEvents()
+    n = 20
+
+    def run():
+        for i in range(n):
+            window.update_cube(i * 2.0, i * 1.0, i * 3.0)
+            window.scheduler.tick()
+            app.processEvents()
+    return measure(run, n, repeat)
+
+
+def bench_graphs(repeat):
+    app, window = make_window()
+    window.show()
+    window.tab_widget.setCurrentIndex(1)
+    app.processEvents()
+    samples = [to_physical(*parse_imu_line(line)) for line in load_log_lines()]
+    # Llena el búfer para medir el redibujado con la ventana completa
+    for s in samples[:window.max_points]:
+        window.update_graphs(*s)
+    n = 20
+
+    def run():
+        for i in range(n):
+            window.update_graphs(*samples[i % len(samples)])
+            window.scheduler.mark('graphs')
+            window.scheduler.tick()
+            app.processEvents()
+    return measure(run, n, repeat)
+
+
+def bench_video(repeat):
+    app, window = make_window()
+    window.resize(1280, 960)
+    window.show()
+    app.processEvents()
+    frames = [cv2.cvtColor(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR),
+                           cv2.COLOR_BGR2RGB) for data in load_images()]
+    n = 20
+
+    def run():
+        for i in range(n):
+            window.video_view.set_frame(frames[i % len(frames)])
+            window.video_view.repaint()
+    return measure(run, n, repeat)
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'parse_bulk': bench_parse_bulk,
+    'imulog': bench_imulog,
+    'resync': bench_resync,
+    'backlog': bench_backlog,
+    'fragments': bench_fragments,
+    'filter': bench_filter,
+    'resample': bench_resample,
+    'spectrum': bench_spectrum,
+    'jpeg': bench_jpeg,
+    'cube': bench_cube,
+    'graphs': bench_graphs,
+    'video': bench_video,
+    'startup': bench_startup,
+}
+
+
+def compare(results, baseline, tolerance):
+    """Imprime la diferencia contra una corrida previa; devuelve True si hay regresión."""
+    regression = False
+    for name, res in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        change = (res['best_us'] - base['best_us']) / base['best_us']
+        flag = ''
+        if change > tolerance:
+            flag = '  <-- REGRESIÓN'
+            regression = True
+        print(f"{name:10s} {base['best_us']:12.2f} -> {res['best_us']:12.2f} us  ({change:+.1%}){flag}")
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', help='lista separada por comas de: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='archivo JSON donde guardar resultados')
+    parser.add_argument('--compare', help='JSON de una corrida previa para comparar')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='empeoramiento permitido (0.2 = 20%%)')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_S,
+                        help='segundos máximos hasta el primer cuadro (benchmark startup)')
+    parser.add_argument('--startup-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        startup_child()
+        return
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = {}
+    for name in names:
+        res = BENCHMARKS[name](args.repeat)
+        results[name] = res
+        print(f"{name:10s} {res['best_us']:12.2f} us/elem  (mediana {res['median_us']:.2f})  {res['rate_per_s']:12.1f} /s")
+
+    report = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if 'startup' in results:
+        median_s = results['startup']['median_us'] / 1e6
+        if median_s > args.startup_budget:
+            print(f"Arranque {median_s:.2f} s > presupuesto {args.startup_budget:.2f} s")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Reparte la telemetría en vivo a varios procesos locales.
+
+Solo un proceso puede abrir el puerto serie. El broker lo abre (con
+IngestEngine) y reenvía cada paquete ya validado y sin duplicados a los
+clientes TCP conectados y, si se pide, por UDP. El formato es el mismo del
+puerto serie (líneas IMU y tramas con CRC), así que un cliente lee con
+StreamDecoder o abre 'socket://127.0.0.1:5760' con pyserial
+(serial.serial_for_url) como si fuera el CanSat; la estación terrena acepta
+esa URL como puerto. Las imágenes viajan en FRAME_JPEG_FRAG para conservar
+la hora de captura y el id del firmware, al que se refieren las repeticiones.
+
+Cada cliente TCP tiene su propia cola acotada (paquetes y bytes): si un
+cliente lento la llena se descartan sus paquetes más viejos sin frenar al
+resto. Por UDP no hay control de flujo: cada línea IMU o de texto y cada
+fragmento de imagen (FRAGMENT_SIZE bytes) va en su propio datagrama, así
+ninguno pasa de MAX_DATAGRAM; un datagrama más grande no se manda y se cuenta
+en 'udp_oversize'. Las líneas 'CMD:' que envían los clientes se reenvían al
+CanSat.
+
+Uso:
+    python cansat_broker.py COM11 --baud 921600 --tcp 5760 --udp 127.0.0.1:5761
+"""
+import argparse
+import asyncio
+import time
+from collections import deque
+
+from cansat_ingest import DEFAULT_STREAM, IngestEngine
+from cansat_protocol import (PKT_IMAGE, PKT_IMU, PKT_REPEAT, PKT_TEXT, PKT_THUMB, build_fragments,
+                             build_frame, build_repeat, build_thumb)
+
+TCP_PORT = 5760
+MAX_PACKETS = 1024          # por cliente
+MAX_BYTES = 4 * 1024 * 1024
+MAX_DATAGRAM = 65000
+
+
+def encode_frames(kind, data):
+    """Paquete de StreamDecoder -> lista de líneas/tramas del puerto serie (None si no se reenvía)."""
+    if kind == PKT_IMU or kind == PKT_TEXT:
+        return [data.encode('ascii') + b'\r\n']
+    if kind == PKT_IMAGE:
+        capture_ms = getattr(data, 'capture_ms', None)
+        if capture_ms is None:
+            return [build_frame(data)]
+        frame_id = getattr(data, 'frame_id', None) or 0
+        return build_fragments(data, frame_id, capture_ms=capture_ms)
+    if kind == PKT_REPEAT:
+        return [build_repeat(data.frame_id, data.capture_ms)]
+    if kind == PKT_THUMB:
+        return [build_thumb(data, data.capture_ms or 0)]
+    return None
+
+
+def encode_packet(kind, data):
+    """Paquete de StreamDecoder -> bytes en el formato del puerto serie (None si no se reenvía)."""
+    frames = encode_frames(kind, data)
+    return b''.join(frames) if frames is not None else None
+
+
+class Subscriber:
+    """Un cliente TCP con su cola de salida (se descarta lo más viejo)."""
+
+    def __init__(self, writer, max_packets=MAX_PACKETS, max_bytes=MAX_BYTES):
+        self.writer = writer
+        self.name = '%s:%s' % writer.get_extra_info('peername')[:2]
+        self.queue = deque()
+        self.bytes = 0
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.event = asyncio.Event()
+        self.sent = 0
+        self.drops = 0
+
+    def push(self, data):
+        self.queue.append(data)
+        self.bytes += len(data)
+        while len(self.queue) > 1 and (len(self.queue) > self.max_packets or self.bytes > self.max_bytes):
+            self.bytes -= len(self.queue.popleft())
+            self.drops += 1
+        self.event.set()
+
+
+class TelemetryBroker:
+    """Servidor TCP/UDP que corre en el event loop de un IngestEngine ya iniciado."""
+
+    def __init__(self, engine, stream=DEFAULT_STREAM, host='127.0.0.1', tcp_port=TCP_PORT,
+                 udp=None, max_packets=MAX_PACKETS, max_bytes=MAX_BYTES):
+        self.engine = engine
+        self.stream = stream
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp = udp                  # (host, puerto) o None
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.subscribers = []
+        self.server = None
+        self.udp_transport = None
+        self.stats = engine.stats
+
+    # --------- Ciclo de vida (desde cualquier hilo) ---------
+    def start(self):
+        asyncio.run_coroutine_threadsafe(self._start(), self.engine.loop).result(5)
+        self.engine.listeners.append(self._on_packet)
+
+    def stop(self):
+        if self._on_packet in self.engine.listeners:
+            self.engine.listeners.remove(self._on_packet)
+        if self.engine.loop is not None and self.engine.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._stop(), self.engine.loop).result(5)
+
+    async def _start(self):
+        self.server = await asyncio.start_server(self._client, self.host, self.tcp_port)
+        if self.udp:
+            loop = asyncio.get_running_loop()
+            self.udp_transport, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=self.udp)
+
+    async def _stop(self):
+        self.server.close()
+        for sub in list(self.subscribers):
+            sub.writer.close()
+        await self.server.wait_closed()
+        if self.udp_transport:
+            self.udp_transport.close()
+
+    # --------- En el hilo de ingesta ---------
+    def _on_packet(self, packet):
+        if packet.stream != self.stream:
+            return
+        frames = encode_frames(packet.kind, packet.data)
+        if frames is None:
+            return
+        data = frames[0] if len(frames) == 1 else b''.join(frames)
+        for sub in tuple(self.subscribers):
+            sub.push(data)
+        if self.udp_transport is not None:
+            for frame in frames:
+                if len(frame) <= MAX_DATAGRAM:
+                    self.udp_transport.sendto(frame)
+                else:
+                    self.stats.count('udp_oversize')
+        self.stats.count('broker_packets')
+
+    async def _client(self, reader, writer):
+        sub = Subscriber(writer, self.max_packets, self.max_bytes)
+        self.subscribers.append(sub)
+        self.stats.count('broker_clients')
+        sender = asyncio.ensure_future(self._send_loop(sub))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(b'CMD:'):
+                    self.engine.send(self.stream, line.rstrip(b'\r\n') + b'\n')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            sender.cancel()
+            self.subscribers.remove(sub)
+            self.stats.count('broker_drops', sub.drops)
+            writer.close()
+
+    async def _send_loop(self, sub):
+        try:
+            while True:
+                await sub.event.wait()
+                sub.event.clear()
+                while sub.queue:
+                    data = sub.queue.popleft()
+                    sub.bytes -= len(data)
+                    sub.writer.write(data)
+                    await sub.writer.drain()
+                    sub.sent += 1
+        except ConnectionError:
+            sub.writer.close()
+
+    def format_clients(self):
+        lines = [f"{'cliente':22s} {'enviados':>9s} {'descart.':>9s} {'en cola':>8s}"]
+        for sub in list(self.subscribers):
+            lines.append(f"{sub.name:22s} {sub.sent:9d} {sub.drops:9d} {len(sub.queue):8d}")
+        return '\n'.join(lines)
+
+
+def _host_port(text):
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reparte la telemetría del CanSat a varios clientes locales.')
+    parser.add_argument('port', help='puerto serie del CanSat')
+    parser.add_argument('--port2', help='segundo puerto (radio de respaldo del mismo CanSat)')
+    parser.add_argument('--baud', type=int, default=921600, help='velocidad USB a negociar')
+    parser.add_argument('--host', default='127.0.0.1', help='interfaz de escucha (0.0.0.0 = red local)')
+    parser.add_argument('--tcp', type=int, default=TCP_PORT, help='puerto TCP')
+    parser.add_argument('--udp', type=_host_port, help='destino UDP host:puerto (unicast o multicast)')
+    parser.add_argument('--max-packets', type=int, default=MAX_PACKETS, help='cola por cliente')
+    args = parser.parse_args()
+
+    engine = IngestEngine(queue_size=0)
+    source = engine.add_source(args.port, target_baud=args.baud)
+    if args.port2:
+        engine.add_source(args.port2)
+    engine.start()
+    broker = TelemetryBroker(engine, host=args.host, tcp_port=args.tcp, udp=args.udp,
+                             max_packets=args.max_packets)
+    broker.start()
+    print(f"{args.port} a {source.baudrate or 'USB-CDC'} baud; escuchando en {args.host}:{args.tcp}")
+    try:
+        while True:
+            time.sleep(5)
+            print(engine.format_sources())
+            print(broker.format_clients())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+        engine.stop()
+
+
+if __name__ == '__main__':
+    main()
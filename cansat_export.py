@@ -0,0 +1,278 @@
+"""Exporta el video de una grabación a AVI MJPEG sin recomprimir y el IMU a CSV.
+
+Uso:
+    python cansat_export.py grabaciones/cansat_20240101_120000.cnr -o vuelo.avi --fps 20
+    python cansat_export.py vuelo.cnr --imu vuelo_imu.csv --imu-rate 50 --imu-method cubic
+
+Cada JPEG recibido se copia tal cual como un cuadro '00dc'. El AVI tiene
+cuadros/s fijos, así que cada imagen se ubica en la ranura de su hora de
+captura (la del CanSat si la trae, si no la de llegada) y los huecos se
+rellenan con cuadros vacíos, que los reproductores muestran repitiendo el
+anterior. Si llegan más imágenes que cuadros/s, las que caen en una ranura
+ya escrita se descartan; la grilla solo se reancla si el reloj retrocede
+más de CLOCK_JUMP_S (reinicio del CanSat) o salta más de MAX_GAP_S. Las
+repeticiones y miniaturas de la grabación quedan como repeticiones de la
+última imagen completa (mezclar tamaños en un MJPEG no lo soportan todos los
+reproductores).
+
+Se lee la grabación una vez y en memoria constante: el índice se escribe a un
+archivo temporal y se agrega al final. Límite del formato AVI 1.0: ~2 GB.
+
+Con --imu las muestras se exportan en una grilla uniforme (UniformResampler,
+por lotes y también en memoria constante) con horas en s, g y °/s y una
+columna `filled` que vale 1 en los puntos rellenados dentro de un hueco.
+"""
+import argparse
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from cansat_imu import PHYSICAL_SCALE, decode_imu_lines
+from cansat_protocol import sample_time
+from cansat_recorder import REC_IMAGE, REC_IMU, REC_REPEAT, REC_THUMB, read_recording
+from cansat_resample import UniformResampler
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+AVI_MAX_BYTES = 2 ** 31 - 1
+MAX_GAP_S = 600          # un hueco más largo se acorta (reconexión tras horas)
+CLOCK_JUMP_S = 1.0       # retroceso del reloj que se toma como reinicio
+
+AVIH = struct.Struct('<10I16x')
+STRH = struct.Struct('<4s4sIHHIIIIIIiI4h')
+STRF = struct.Struct('<IiiHH4sIiiII')
+CHUNK = struct.Struct('<4sI')
+INDEX = struct.Struct('<4sIII')
+
+IMU_RATE_HZ = 50.0
+IMU_BATCH = 4096         # líneas por lote al remuestrear
+IMU_HEADER = 't,ax,ay,az,gx,gy,gz,filled'
+
+
+def jpeg_size(data):
+    """(ancho, alto) leído del marcador SOF de un JPEG, o None."""
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            i += 2
+            continue
+        length = (data[i + 2] << 8) | data[i + 3]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + length
+    return None
+
+
+class AviMjpegWriter:
+    """Escribe un AVI MJPEG de un solo stream; las cabeceras se completan al cerrar."""
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.f = open(path, 'wb')
+        self.index = tempfile.TemporaryFile()
+        self.frames = 0           # ranuras escritas (imágenes + repeticiones)
+        self.images = 0
+        self.max_chunk = 0
+        self.width = 0
+        self.height = 0
+        self._write_headers()
+        self.movi_start = self.f.tell()
+        self.f.write(b'LIST\0\0\0\0movi')
+
+    def _write_headers(self):
+        # Se reescriben en close() con los valores finales; aquí solo reservan lugar
+        f = self.f
+        f.seek(0)
+        rate = int(round(self.fps * 1000))
+        usec = int(round(1e6 / self.fps))
+        f.write(CHUNK.pack(b'RIFF', 0) + b'AVI ')
+        hdrl = (CHUNK.pack(b'avih', AVIH.size)
+                + AVIH.pack(usec, 0, 0, AVIF_HASINDEX, self.frames, 0, 1, self.max_chunk,
+                            self.width, self.height))
+        strl = (CHUNK.pack(b'strh', STRH.size)
+                + STRH.pack(b'vids', b'MJPG', 0, 0, 0, 0, 1000, rate, 0, self.frames,
+                            self.max_chunk, -1, 0, 0, 0, self.width, self.height)
+                + CHUNK.pack(b'strf', STRF.size)
+                + STRF.pack(STRF.size, self.width, self.height, 1, 24, b'MJPG',
+                            self.width * self.height * 3, 0, 0, 0, 0))
+        strl = b'LIST' + struct.pack('<I', 4 + len(strl)) + b'strl' + strl
+        hdrl += strl
+        f.write(b'LIST' + struct.pack('<I', 4 + len(hdrl)) + b'hdrl' + hdrl)
+
+    def _chunk(self, data):
+        offset = self.f.tell() - (self.movi_start + 8)
+        self.f.write(CHUNK.pack(b'00dc', len(data)))
+        self.f.write(data)
+        if len(data) & 1:
+            self.f.write(b'\0')
+        flags = AVIIF_KEYFRAME if data else 0
+        self.index.write(INDEX.pack(b'00dc', flags, offset, len(data)))
+        self.frames += 1
+
+    def write_frame(self, jpeg):
+        size = jpeg_size(jpeg)
+        if size is not None:
+            self.width = max(self.width, size[0])
+            self.height = max(self.height, size[1])
+        self.max_chunk = max(self.max_chunk, len(jpeg))
+        self._chunk(jpeg)
+        self.images += 1
+
+    def write_repeat(self):
+        """Cuadro vacío: el reproductor mantiene el anterior."""
+        self._chunk(b'')
+
+    @property
+    def size(self):
+        return self.f.tell()
+
+    def close(self):
+        f = self.f
+        movi_end = f.tell()
+        f.write(CHUNK.pack(b'idx1', self.index.tell()))
+        self.index.seek(0)
+        shutil.copyfileobj(self.index, f)
+        self.index.close()
+        end = f.tell()
+        self._write_headers()
+        f.seek(4)
+        f.write(struct.pack('<I', end - 8))
+        f.seek(self.movi_start + 4)
+        f.write(struct.pack('<I', movi_end - self.movi_start - 8))
+        f.close()
+
+
+def export_avi(recording, output, fps=20.0, clock='device'):
+    """Convierte una grabación a AVI; devuelve un resumen (dict).
+
+    clock='device' usa la hora de captura del CanSat cuando existe; 'host'
+    usa siempre la hora de llegada.
+    """
+    writer = AviMjpegWriter(output, fps)
+    t0 = None
+    next_slot = 0
+    end_slot = 0
+    dropped = 0
+    truncated = False
+    try:
+        for rec in read_recording(recording):
+            if rec.kind not in (REC_IMAGE, REC_REPEAT, REC_THUMB):
+                continue
+            capture_ms = getattr(rec.data, 'capture_ms', None)
+            t = capture_ms / 1000.0 if clock == 'device' and capture_ms is not None else rec.t
+            if t0 is None:
+                if rec.kind != REC_IMAGE:
+                    continue  # sin imagen de referencia todavía
+                t0 = t
+            slot = int(round((t - t0) * fps))
+            if slot < next_slot - CLOCK_JUMP_S * fps or slot - next_slot > MAX_GAP_S * fps:
+                # El reloj saltó (reinicio del CanSat o hueco enorme): se reancla
+                t0 = t - next_slot / fps
+                slot = next_slot
+            if rec.kind != REC_IMAGE:
+                end_slot = max(end_slot, slot)
+                continue
+            if slot < next_slot:
+                dropped += 1  # su ranura ya está escrita: más imágenes que cuadros/s
+                continue
+            while next_slot < slot:
+                writer.write_repeat()
+                next_slot += 1
+            if writer.size + len(rec.data) > AVI_MAX_BYTES:
+                truncated = True
+                break
+            writer.write_frame(rec.data)
+            next_slot += 1
+            end_slot = max(end_slot, next_slot - 1)
+        while next_slot <= end_slot and writer.images:
+            writer.write_repeat()
+            next_slot += 1
+    finally:
+        writer.close()
+    return {
+        'output': output,
+        'images': writer.images,
+        'dropped': dropped,
+        'frames': writer.frames,
+        'duration_s': writer.frames / fps,
+        'width': writer.width,
+        'height': writer.height,
+        'bytes': os.path.getsize(output),
+        'truncated': truncated,
+    }
+
+
+def export_imu_csv(recording, output, rate=IMU_RATE_HZ, method='linear'):
+    """Escribe las muestras IMU de la grabación remuestreadas a `rate` Hz; devuelve un resumen."""
+    resampler = UniformResampler(6, rate, method)
+    lines = []
+    arrival = []
+    info = {'output': output, 'lines': 0, 'samples': 0, 'filled': 0}
+
+    def flush(f):
+        raw, valid = decode_imu_lines(lines)
+        times = [sample_time(line, t) for line, t, ok in zip(lines, arrival, valid.tolist()) if ok]
+        grid, values, filled = resampler.update(times, raw[valid] * PHYSICAL_SCALE)
+        if len(grid):
+            np.savetxt(f, np.column_stack([grid, values, filled]), fmt=['%.3f'] + ['%.5f'] * 6 + ['%d'],
+                       delimiter=',')
+        info['lines'] += len(lines)
+        info['samples'] += len(grid)
+        info['filled'] += int(filled.sum())
+        lines.clear()
+        arrival.clear()
+
+    with open(output, 'w') as f:
+        f.write(IMU_HEADER + '\n')
+        for rec in read_recording(recording):
+            if rec.kind != REC_IMU:
+                continue
+            lines.append(rec.data)
+            arrival.append(rec.t)
+            if len(lines) >= IMU_BATCH:
+                flush(f)
+        flush(f)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta el video de una grabación a AVI MJPEG y el IMU a CSV.')
+    parser.add_argument('recording')
+    parser.add_argument('-o', '--output', help='archivo AVI (por defecto, junto a la grabación)')
+    parser.add_argument('--fps', type=float, default=20.0, help='cuadros/s del AVI (resolución temporal)')
+    parser.add_argument('--clock', choices=['device', 'host'], default='device',
+                        help='hora de captura del CanSat o de llegada a tierra')
+    parser.add_argument('--imu', metavar='CSV', help='exporta el IMU en una grilla uniforme (en vez del video)')
+    parser.add_argument('--imu-rate', type=float, default=IMU_RATE_HZ, help='Hz de la grilla del IMU')
+    parser.add_argument('--imu-method', choices=['linear', 'cubic'], default='linear',
+                        help='interpolación del IMU')
+    args = parser.parse_args()
+    if args.imu:
+        info = export_imu_csv(args.recording, args.imu, args.imu_rate, args.imu_method)
+        print(f"{info['output']}: {info['lines']} líneas -> {info['samples']} muestras a {args.imu_rate:g} Hz "
+              f"({info['filled']} rellenadas)")
+        return
+    output = args.output or os.path.splitext(args.recording)[0] + '.avi'
+    info = export_avi(args.recording, output, args.fps, args.clock)
+    print(f"{info['output']}: {info['images']} imágenes ({info['dropped']} descartadas), {info['frames']} cuadros, "
+          f"{info['duration_s']:.1f} s, {info['width']}x{info['height']}, {info['bytes'] / 1e6:.1f} MB")
+    if info['truncated']:
+        print("Aviso: se alcanzó el límite de 2 GB del AVI; el video está cortado")
+
+
+if __name__ == '__main__':
+    main()
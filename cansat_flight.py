@@ -0,0 +1,183 @@
+"""Detección de la fase de vuelo a partir de lotes de muestras IMU.
+
+Fases: en plataforma -> ascenso -> apogeo (caída libre) -> descenso (con
+paracaídas) -> aterrizado. Cada cambio es un evento con la hora de la
+muestra que lo disparó: 'launch', 'apogee', 'deploy', 'landed'.
+
+Solo con el IMU, el "apogeo" es el inicio de la caída libre tras el ascenso
+(|a| ~ 0 g): para un CanSat que sale del cohete en el apogeo coincide; si se
+suelta desde un dron o globo se pasa directo de plataforma a apogeo. Si hay
+altitud (presión), el apogeo también se detecta cuando la altitud baja
+APOGEE_DROP_M desde el máximo.
+
+Las condiciones se evalúan con estadísticas móviles vectorizadas de |a| y
+|w| y deben sostenerse un tiempo mínimo (histéresis). Las ventanas y las
+rachas continúan entre lotes, así que procesar un lote cuesta lo mismo sin
+importar cuánto lleve el vuelo.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+PHASE_PAD = 'pad'
+PHASE_ASCENT = 'ascent'
+PHASE_APOGEE = 'apogee'
+PHASE_DESCENT = 'descent'
+PHASE_LANDED = 'landed'
+
+PHASE_NAMES = {
+    PHASE_PAD: 'En plataforma',
+    PHASE_ASCENT: 'Ascenso',
+    PHASE_APOGEE: 'Apogeo / caída libre',
+    PHASE_DESCENT: 'Descenso',
+    PHASE_LANDED: 'Aterrizado',
+}
+
+# Umbrales (g, °/s, s y m). El MPU6050 a ±2 g satura: cada eje llega a 2 g
+# como máximo, así que empuje y golpe de paracaídas se detectan por debajo.
+SHORT_WINDOW = 5            # muestras (~0.1 s a 50 Hz) para |a| suavizada
+LONG_WINDOW = 50            # muestras (~1 s) para quietud
+LAUNCH_G = 1.6
+LAUNCH_HOLD = 0.2
+FREEFALL_G = 0.4
+FREEFALL_HOLD = 0.15
+MIN_ASCENT_S = 0.5          # el empuje no se confunde con caída libre
+DEPLOY_G = 1.8              # golpe al abrir el paracaídas (|a| sin suavizar)
+SETTLED_G = 0.3             # |a| vuelve a ~1 g si el paracaídas abrió suave
+SETTLED_HOLD = 1.0
+STILL_STD_G = 0.03
+STILL_DPS = 5.0
+LANDED_HOLD = 2.0
+APOGEE_DROP_M = 3.0
+
+# t: hora de la muestra (s); name: evento; phase: fase a la que se pasó
+FlightEvent = namedtuple('FlightEvent', 't name phase')
+
+
+class RollingStats:
+    """Media y varianza móviles de `window` muestras que continúan entre lotes."""
+
+    def __init__(self, window):
+        self.window = window
+        self.tail = np.zeros(0)
+
+    def reset(self):
+        self.tail = np.zeros(0)
+
+    def update(self, x):
+        w = self.window
+        ext = np.concatenate([self.tail, x])
+        if len(ext) < w - 1 + len(x):
+            # Al comienzo no hay historia: se repite la primera muestra
+            ext = np.concatenate([np.full(w - 1 + len(x) - len(ext), ext[0]), ext])
+        cs = np.concatenate([[0.0], np.cumsum(ext)])
+        cs2 = np.concatenate([[0.0], np.cumsum(ext * ext)])
+        mean = (cs[w:] - cs[:-w]) / w
+        var = np.maximum((cs2[w:] - cs2[:-w]) / w - mean * mean, 0.0)
+        self.tail = ext[len(ext) - (w - 1):] if w > 1 else ext[:0]
+        return mean, var
+
+
+class FlightPhaseDetector:
+    """Máquina de estados de la fase de vuelo alimentada por lotes."""
+
+    def __init__(self):
+        self.short = RollingStats(SHORT_WINDOW)
+        self.acc_long = RollingStats(LONG_WINDOW)
+        self.gyro_long = RollingStats(LONG_WINDOW)
+        self.reset()
+
+    def reset(self):
+        self.phase = PHASE_PAD
+        self.events = []
+        self.t_launch = None
+        self.max_altitude = -np.inf
+        self.runs = {}          # condición -> hora de inicio de la racha en curso
+        self.short.reset()
+        self.acc_long.reset()
+        self.gyro_long.reset()
+
+    def _first_held(self, name, t, cond, hold):
+        """Índice de la primera muestra donde `cond` lleva `hold` s seguidos, o None.
+
+        La racha que queda abierta al final del lote se guarda para el siguiente.
+        """
+        n = len(cond)
+        if n == 0:
+            return None
+        idx = np.arange(n)
+        last_false = np.maximum.accumulate(np.where(cond, -1, idx))
+        start_t = t[np.minimum(last_false + 1, n - 1)]
+        carry = self.runs.get(name)
+        if carry is not None:
+            start_t = np.where(last_false < 0, carry, start_t)
+        held = cond & (t - start_t >= hold)
+        self.runs[name] = start_t[-1] if cond[-1] else None
+        if not held.any():
+            return None
+        return int(np.argmax(held))
+
+    def _candidates(self, t, acc, mean_a, still, altitude):
+        """(evento, fase siguiente, condición, tiempo sostenido) posibles desde la fase actual."""
+        freefall = mean_a <= FREEFALL_G
+        if self.phase == PHASE_PAD:
+            return [('launch', PHASE_ASCENT, mean_a >= LAUNCH_G, LAUNCH_HOLD),
+                    ('apogee', PHASE_APOGEE, freefall, FREEFALL_HOLD)]
+        if self.phase == PHASE_ASCENT:
+            coast = freefall & (t - self.t_launch >= MIN_ASCENT_S)
+            candidates = [('apogee', PHASE_APOGEE, coast, FREEFALL_HOLD)]
+            if altitude is not None:
+                peak = np.maximum.accumulate(np.maximum(altitude, self.max_altitude))
+                candidates.append(('apogee', PHASE_APOGEE, altitude <= peak - APOGEE_DROP_M, FREEFALL_HOLD))
+            return candidates
+        if self.phase == PHASE_APOGEE:
+            return [('deploy', PHASE_DESCENT, acc >= DEPLOY_G, 0.0),
+                    ('deploy', PHASE_DESCENT, np.abs(mean_a - 1.0) <= SETTLED_G, SETTLED_HOLD),
+                    ('landed', PHASE_LANDED, still, LANDED_HOLD)]
+        if self.phase == PHASE_DESCENT:
+            return [('landed', PHASE_LANDED, still, LANDED_HOLD)]
+        return []
+
+    def feed(self, t, samples, altitude=None):
+        """Procesa un lote: t (n,) en s y samples (n, 6) en g y °/s.
+
+        altitude (n,) en m es opcional. Devuelve los eventos nuevos (FlightEvent).
+        """
+        t = np.asarray(t, dtype=float)
+        if len(t) == 0:
+            return []
+        samples = np.asarray(samples, dtype=float)
+        acc = np.sqrt((samples[:, :3] ** 2).sum(axis=1))
+        gyro = np.sqrt((samples[:, 3:6] ** 2).sum(axis=1))
+        mean_a, _ = self.short.update(acc)
+        _, var_a = self.acc_long.update(acc)
+        mean_w, _ = self.gyro_long.update(gyro)
+        still = (var_a <= STILL_STD_G ** 2) & (mean_w <= STILL_DPS)
+        if altitude is not None:
+            altitude = np.asarray(altitude, dtype=float)
+
+        events = []
+        start = 0
+        while start < len(t):
+            sl = slice(start, None)
+            alt = altitude[sl] if altitude is not None else None
+            best = None
+            for i, (name, phase, cond, hold) in enumerate(
+                    self._candidates(t[sl], acc[sl], mean_a[sl], still[sl], alt)):
+                first = self._first_held((self.phase, i), t[sl], cond, hold)
+                if first is not None and (best is None or first < best[0]):
+                    best = (first, name, phase)
+            if best is None:
+                break
+            at = start + best[0]
+            self.phase = best[2]
+            self.runs.clear()
+            if self.phase == PHASE_ASCENT:
+                self.t_launch = t[at]
+            event = FlightEvent(float(t[at]), best[1], self.phase)
+            events.append(event)
+            start = at + 1
+        if altitude is not None:
+            self.max_altitude = max(self.max_altitude, float(altitude.max()))
+        self.events.extend(events)
+        return events
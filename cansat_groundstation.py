@@ -1,68 +1,190 @@
 import sys
-import serial
-import serial.tools.list_ports
 import numpy as np
 import cv2
 import math
 import time
+from time import perf_counter_ns
 from PyQt5.QtWidgets import (
     QApplication, QLabel, QVBoxLayout, QWidget, QHBoxLayout, QPushButton,
-    QComboBox, QGroupBox, QGridLayout, QLineEdit, QTabWidget, QProgressBar, QFileDialog, QSpacerItem, QSizePolicy
+    QComboBox, QGroupBox, QGridLayout, QLineEdit, QTabWidget, QProgressBar, QFileDialog, QSpacerItem, QSizePolicy,
+    QPlainTextEdit, QCheckBox, QSpinBox
 )
-from PyQt5.QtGui import QImage, QPixmap, QColor  
-
-from PyQt5.QtCore import QTimer, Qt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from matplotlib.figure import Figure
+from PyQt5.QtGui import QImage, QPixmap, QColor, QFont, QPainter
+
+from PyQt5.QtCore import QEvent, QTimer, Qt, QRect
 import qdarkstyle
 import os
-from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtCore import QUrl
-import folium
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+# matplotlib, folium y QtWebEngine se importan al crear sus paneles, después
+# del primer cuadro de la ventana (ver MainWindow.setup_next_panel)
+from cansat_protocol import sample_time, PKT_GAP, PKT_IMU, PKT_TEXT, VIDEO_PACKETS
+from cansat_ingest import (IngestEngine, DEFAULT_STREAM, STATE_CONNECTING, STATE_FAILED, STATE_OPEN,
+                           STATE_RECONNECTING)
+from cansat_link import BAUD_RATES, BOOT_BAUD, LinkController, PortScanner, link_bytes_per_s
+from cansat_imu import PHYSICAL_SCALE, AttitudeHistory, ComplementaryFilter, SampleBuffer, decode_imu_lines
+from cansat_stats import PerfStats
+from cansat_video import FrameTagger, VideoWorker
+from cansat_recorder import RECORDINGS_DIR, Recorder, new_recording_path
+from cansat_export import export_avi
+from cansat_flight import PHASE_NAMES, FlightPhaseDetector
+from cansat_render import DEFAULT_FPS, RenderScheduler
+from cansat_spectrum import WelchSpectrum
+from cansat_resample import UniformResampler
+from cansat_pipeline import ProcessPipeline
 
 # --------- Utilidades ---------
-def list_serial_ports():
-    return [port.device for port in serial.tools.list_ports.comports()]
+NO_PORT = "(ninguno)"
+BAUDRATE = 921600   # velocidad USB a negociar con el CanSat (la radio queda en BOOT_BAUD)
+IMU_RATE_HZ = 50    # tasa nominal del IMU: grilla uniforme de gráficas y espectro
+SPECTRUM_HZ = 2     # refresco del espectro: bajo para no competir con la ingesta
+PORTS_POLL_MS = 500 # revisión de la lista de puertos (la enumeración va en otro hilo)
+LINK_TEXT = {STATE_CONNECTING: "Conectando…", STATE_RECONNECTING: "Reconectando…", STATE_FAILED: "Error"}
 
 def get_status_color(connected):
     return "background-color: #4CAF50;" if connected else "background-color: #F44336;"
 
+def figure_canvas(figsize):
+    """Figura de matplotlib y su canvas Qt (matplotlib se importa recién aquí)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+    fig = Figure(figsize=figsize)
+    return fig, FigureCanvas(fig)
+
+# --------- Panel de video ---------
+class VideoWidget(QWidget):
+    """Muestra cuadros RGB escalados dentro del widget conservando la proporción.
+
+    Un cuadro nuevo se pinta directo con drawImage (Qt escala una sola vez al
+    pintar). Los repintados sin cuadro nuevo (ventanas encima, overlay) usan un
+    QPixmap ya escalado que se guarda hasta el próximo cuadro o cambio de tamaño.
+    """
+
+    def __init__(self, stats=None, parent=None):
+        super().__init__(parent)
+        self.stats = stats
+        self.frame = None       # arreglo RGB que respalda a self.image
+        self.image = None
+        self.cached = None      # QPixmap escalado de self.image
+        self.new_frame = False
+        self.target = None
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+
+    def set_frame(self, rgb):
+        if rgb is self.frame:
+            return  # el mismo cuadro: no hay nada que repintar
+        h, w, ch = rgb.shape
+        if self.image is None or (self.image.width(), self.image.height()) != (w, h):
+            self.target = None
+        self.frame = rgb
+        self.image = QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
+        self.cached = None
+        self.new_frame = True
+        self.update()
+
+    def _fit(self):
+        scaled = self.image.size().scaled(self.size(), Qt.KeepAspectRatio)
+        x = (self.width() - scaled.width()) // 2
+        y = (self.height() - scaled.height()) // 2
+        return QRect(x, y, scaled.width(), scaled.height())
+
+    def resizeEvent(self, event):
+        self.cached = None
+        self.target = None
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        t0 = perf_counter_ns()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if self.image is not None:
+            if self.target is None:
+                self.target = self._fit()
+            if self.new_frame:
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+                painter.drawImage(self.target, self.image)
+                self.new_frame = False
+            else:
+                if self.cached is None:
+                    self.cached = QPixmap.fromImage(self.image.scaled(
+                        self.target.size(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+                painter.drawPixmap(self.target.topLeft(), self.cached)
+        painter.end()
+        if self.stats is not None:
+            self.stats.record('paint', perf_counter_ns() - t0)
+
 # --------- Main Window ---------
 class MainWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("CanSat Ground Station")
-        self.serial = None
+        self.engine = None
+        # Modo multiproceso (ingesta y decodificación en otros procesos)
+        self.pipeline = None
+        self.link_controller = None
         self.connected = False
+        # Estado del puerto del stream mostrado (STATE_* de cansat_ingest)
+        self.link_state = None
         self.ser_port = None
         self.log_file = None
-        # En __init__(), junto a los demás:
-        self.mini_time = []
-        self.mini_accel = []
+        self.recorder = None
+        # Stream (CanSat) que muestra el dashboard
+        self.current_stream = DEFAULT_STREAM
+        # Instrumentación de tiempos por etapa y contadores
+        self.stats = PerfStats()
+        # Video: imágenes completas, repeticiones y miniaturas; con hilos se
+        # decodifican y enderezan en su propio hilo (ver refresh_video)
+        self.video = VideoWorker(self.stats)
+        self.video.start()
+        # Actitud reciente con la hora del CanSat: cada cuadro se etiqueta con la
+        # de su hora de captura (a la grabación) y el video se puede enderezar
+        self.attitude_history = AttitudeHistory()
+        self.tagger = FrameTagger()
+        self.frame_tag = None
+        # Puntos de la mini-gráfica del dashboard (últimos del búfer IMU)
         self.mini_max_pts = 50
 
         # --------- Barra superior: Puerto COM y conexión ---------
         self.port_combo = QComboBox()
+        # Editable: también acepta la URL del broker (socket://127.0.0.1:5760)
+        self.port_combo.setEditable(True)
+        # Segundo puerto opcional: radio de respaldo o un segundo CanSat
+        self.port2_combo = QComboBox()
+        self.port2_mode_combo = QComboBox()
+        self.port2_mode_combo.addItems(["Respaldo (mismo CanSat)", "Segundo CanSat"])
+        # Los puertos se enumeran en otro hilo; las listas se actualizan al cambiar
+        self.port_scanner = PortScanner()
+        self.ports_version = None
+        self.port_scanner.start()
         self.refresh_ports()
+        self.baud_combo = QComboBox()
+        self.baud_combo.addItems([str(b) for b in BAUD_RATES])
+        self.baud_combo.setCurrentText(str(BAUDRATE))
+        self.stream_combo = QComboBox()
+        self.stream_combo.currentTextChanged.connect(self.select_stream)
         self.connect_btn = QPushButton("Conectar")
         self.connect_btn.clicked.connect(self.toggle_connection)
         self.status_label = QLabel("Desconectado")
         self.status_label.setStyleSheet(get_status_color(False))
         self.refresh_btn = QPushButton("⟳")
         self.refresh_btn.setFixedWidth(30)
-        self.refresh_btn.clicked.connect(self.refresh_ports)
+        self.refresh_btn.clicked.connect(self.port_scanner.scan_now)
+        # Ingesta y decodificación en procesos aparte (se elige antes de conectar)
+        self.process_check = QCheckBox("Multiproceso")
 
         top_hbox = QHBoxLayout()
         top_hbox.addWidget(QLabel("Puerto:"))
         top_hbox.addWidget(self.port_combo)
         top_hbox.addWidget(self.refresh_btn)
+        top_hbox.addWidget(QLabel("Baudios:"))
+        top_hbox.addWidget(self.baud_combo)
+        top_hbox.addWidget(QLabel("Puerto 2:"))
+        top_hbox.addWidget(self.port2_combo)
+        top_hbox.addWidget(self.port2_mode_combo)
+        top_hbox.addWidget(self.process_check)
         top_hbox.addWidget(self.connect_btn)
         top_hbox.addWidget(self.status_label)
+        top_hbox.addWidget(QLabel("Ver:"))
+        top_hbox.addWidget(self.stream_combo)
         top_hbox.addStretch()
 
         # --------- Crear pestañas ---------
@@ -72,12 +194,22 @@ class MainWindow(QWidget):
         self.dashboard_tab = QWidget()
         self.setup_dashboard_tab()
         
-        # Pestaña 2: Gráficas IMU en tiempo real
+        # Pestaña 2: Gráficas IMU en tiempo real (se arma la primera vez que se abre)
         self.graphs_tab = QWidget()
-        self.setup_graphs_tab()
+        self.graph_canvas = None
         
+        # Pestaña 3: Espectro de vibración (también se arma al abrirla)
+        self.spectrum_tab = QWidget()
+        self.spectrum_canvas = None
+
+        # Pestaña 4: Rendimiento (tiempos por etapa y contadores)
+        self.perf_tab = QWidget()
+        self.setup_perf_tab()
+
         self.tab_widget.addTab(self.dashboard_tab, "Dashboard")
         self.tab_widget.addTab(self.graphs_tab, "Gráficas IMU")
+        self.tab_widget.addTab(self.spectrum_tab, "Espectro")
+        self.tab_widget.addTab(self.perf_tab, "Rendimiento")
         
         # Conectar el cambio de pestaña para actualizar gráficas
         self.tab_widget.currentChanged.connect(self.on_tab_changed)
@@ -93,23 +225,60 @@ class MainWindow(QWidget):
         self.timer.timeout.connect(self.update_data)
         self.timer.start(30)
 
+        # Dibujo: los datos marcan paneles sucios y se repintan a lo sumo una vez por cuadro
+        self.scheduler = RenderScheduler(DEFAULT_FPS, self.stats)
+        self.scheduler.add('labels', self.refresh_labels)
+        self.scheduler.add('video', self.refresh_video)
+        self.scheduler.add('cube', self.refresh_cube)
+        self.scheduler.add('mini_plot', self.refresh_mini_plot)
+        self.scheduler.add('graphs', self.refresh_graphs)
+        self.scheduler.add('spectrum', self.refresh_spectrum)
+        self.scheduler.start()
+
+        # El espectro se recalcula a tasa baja y fija, no con cada muestra
+        self.spectrum_timer = QTimer()
+        self.spectrum_timer.timeout.connect(lambda: self.scheduler.mark('spectrum'))
+        self.spectrum_timer.start(1000 // SPECTRUM_HZ)
+
+        # Paneles pesados: se crean de a uno después del primer cuadro (paintEvent)
+        self.pending_panels = [self.setup_cube_panel, self.setup_mini_plot, self.setup_map_panel]
+        self.panel_timer = QTimer()
+        self.panel_timer.setSingleShot(True)
+        self.panel_timer.timeout.connect(self.setup_next_panel)
+
+        self.ports_timer = QTimer()
+        self.ports_timer.timeout.connect(self.refresh_ports)
+        self.ports_timer.start(PORTS_POLL_MS)
+
+        # Refresco de estadísticas (1 Hz)
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.refresh_stats)
+        self.stats_timer.start(1000)
+
         # --------- Estado ---------
-        self.last_time = time.time()
+        self.last_time = None  # Hora de la última muestra IMU (s)
         self.alpha = 0.98
+        self.attitude = ComplementaryFilter(self.alpha)
+        # Fase de vuelo (plataforma, ascenso, apogeo, descenso, aterrizado)
+        self.flight = FlightPhaseDetector()
         self.pitch = 0.0
         self.roll = 0.0
         self.last_img = None
+        self.last_sample = None
+        self.pending_video = 0
         self.log_lines = []
         
         # --------- Datos para gráficas ---------
-        self.time_data = []
-        self.accel_x_data = []
-        self.accel_y_data = []
-        self.accel_z_data = []
-        self.gyro_x_data = []
-        self.gyro_y_data = []
-        self.gyro_z_data = []
-        self.max_points = 100  # Número máximo de puntos en las gráficas
+        # Todas las muestras van al búfer aunque ningún panel se vea; cada panel
+        # dibuja desde el búfer solo cuando está visible y hay datos nuevos.
+        # Al búfer llegan ya remuestreadas a IMU_RATE_HZ (horas con jitter y huecos)
+        self.max_points = 500  # Número máximo de puntos en las gráficas (~10 s a 50 Hz)
+        self.imu_buffer = SampleBuffer(6, self.max_points)
+        self.resampler = UniformResampler(6, IMU_RATE_HZ)
+        self.drawn_versions = {}
+        # PSD de Welch de los 6 ejes; spectrum_total = muestras del búfer ya consumidas
+        self.spectrum = WelchSpectrum(6)
+        self.spectrum_total = 0
         
         self.setStyleSheet("""
             QWidget {
@@ -166,35 +335,39 @@ class MainWindow(QWidget):
     def setup_dashboard_tab(self):
         """Configura la pestaña del dashboard principal"""
         # --------- Panel de video ---------
-        self.video_label = QLabel()
-        self.video_label.setMinimumSize(640, 480)
-        self.video_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.video_view = VideoWidget(self.stats)
+        self.video_view.setMinimumSize(320, 240)
+        self.video_view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         video_box = QGroupBox("Video")
         vbox_video = QVBoxLayout()
-        vbox_video.addWidget(self.video_label)
+        vbox_video.addWidget(self.video_view)
         self.save_img_btn = QPushButton("Guardar Imagen")
         self.save_img_btn.clicked.connect(self.save_image)
-        vbox_video.addWidget(self.save_img_btn)
+        self.export_video_btn = QPushButton("Exportar video")
+        self.export_video_btn.clicked.connect(self.export_video)
+        hbox_video_btns = QHBoxLayout()
+        hbox_video_btns.addWidget(self.save_img_btn)
+        hbox_video_btns.addWidget(self.export_video_btn)
+        vbox_video.addLayout(hbox_video_btns)
         video_box.setLayout(vbox_video)
 
-        # --------- Panel de cubo 3D ---------
-        self.fig = plt.figure(figsize=(5,5))
-        self.ax = self.fig.add_subplot(111, projection='3d')
-        self.canvas = FigureCanvas(self.fig)
+        # --------- Panel de cubo 3D (la figura se crea en setup_cube_panel) ---------
+        self.fig = None
+        self.ax = None
+        self.canvas = None
         self.pitch = 0.0
         self.roll = 0.0
         self.yaw = 0.0
-        self.init_cube()
         self.pitch_label = QLabel("Pitch: 0.0°")
         self.roll_label = QLabel("Roll: 0.0°")
         self.yaw_label = QLabel("Yaw: 0.0°")
         vbox_cubo = QVBoxLayout()
-        vbox_cubo.addWidget(self.canvas)
         vbox_cubo.addWidget(self.pitch_label)
         vbox_cubo.addWidget(self.roll_label)
         vbox_cubo.addWidget(self.yaw_label)
         cubo_box = QGroupBox("Actitud (IMU)")
         cubo_box.setLayout(vbox_cubo)
+        self.cube_layout = vbox_cubo
         cubo_box.setMinimumSize(350, 350)
 
         # --------- Panel de telemetría ---------
@@ -210,6 +383,8 @@ class MainWindow(QWidget):
         grid_tele.addWidget(self.temp_label, 1, 0)
         grid_tele.addWidget(self.alt_label, 1, 1)
         grid_tele.addWidget(self.state_label, 2, 0, 1, 2)
+        self.link_label = QLabel("Cámara: --")
+        grid_tele.addWidget(self.link_label, 3, 0, 1, 2)
         tele_box = QGroupBox("Telemetría")
         tele_box.setLayout(grid_tele)
 
@@ -220,17 +395,11 @@ class MainWindow(QWidget):
         sensors_title.setStyleSheet("font-size: 22px; color: #7fd6ff; font-weight: bold; margin-bottom: 10px;")
         sensors_layout.addWidget(sensors_title)
 
-        # --------- Panel de gráficas IMU en tiempo real (mini) ---------
-        self.mini_fig = Figure(figsize=(4,3))
-        self.mini_ax = self.mini_fig.add_subplot(111)
-        self.mini_ax.set_facecolor('#1b3957')
-        self.mini_ax.set_title('IMU (g)', color='#7fd6ff', fontsize=12)
-        self.mini_ax.tick_params(colors='#7fd6ff')
-        self.mini_canvas = FigureCanvas(self.mini_fig)
+        # --------- Panel de gráficas IMU en tiempo real (mini, en setup_mini_plot) ---------
+        self.mini_canvas = None
         mini_box = QGroupBox("Gráficas IMU")
-        vbox_mini = QVBoxLayout()
-        vbox_mini.addWidget(self.mini_canvas)
-        mini_box.setLayout(vbox_mini)
+        self.mini_layout = QVBoxLayout()
+        mini_box.setLayout(self.mini_layout)
         mini_box.setMinimumSize(500,
                                 400)
         mini_box.setStyleSheet("padding: 12px; border-radius: 18px; background-color: #1b3957;")
@@ -277,27 +446,34 @@ class MainWindow(QWidget):
         self.save_log_btn.clicked.connect(self.save_log)
         self.calib_btn = QPushButton("Calibrar IMU")
         self.reset_btn = QPushButton("Reset")
+        self.perf_btn = QPushButton("Rendimiento")
+        self.perf_btn.setCheckable(True)
+        self.perf_btn.toggled.connect(self.toggle_perf_overlay)
         hbox_ctrl = QHBoxLayout()
         hbox_ctrl.addWidget(self.pause_btn)
         hbox_ctrl.addWidget(self.save_log_btn)
         hbox_ctrl.addWidget(self.calib_btn)
         hbox_ctrl.addWidget(self.reset_btn)
+        hbox_ctrl.addWidget(self.perf_btn)
+        self.adaptive_check = QCheckBox("Control adaptativo de imagen")
+        self.adaptive_check.setChecked(True)
+        self.adaptive_check.toggled.connect(self.toggle_adaptive)
+        hbox_ctrl.addWidget(self.adaptive_check)
+        self.stabilize_check = QCheckBox("Video estabilizado")
+        self.stabilize_check.toggled.connect(self.toggle_stabilized)
+        hbox_ctrl.addWidget(self.stabilize_check)
         hbox_ctrl.addStretch()
 
-        # --------- Panel de mapa (folium + QWebEngineView) ---------
-        # Ubicación predeterminada: Ciudad de México
-        lat, lon = 19.4326, -99.1332
-        m = folium.Map(location=[lat, lon], zoom_start=15)
-        map_path = os.path.abspath('map.html')
-        m.save(map_path)
-        self.map_view = QWebEngineView()
-        self.map_view.setMinimumSize(400, 300)
-        self.map_view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.map_view.load(QUrl.fromLocalFile(map_path))
+        # Overlay de rendimiento (oculto por defecto)
+        self.perf_overlay = QLabel()
+        self.perf_overlay.setStyleSheet("font-family: monospace; font-size: 13px; color: #ffd166;")
+        self.perf_overlay.hide()
+
+        # --------- Panel de mapa (folium + QWebEngineView, en setup_map_panel) ---------
+        self.map_view = None
         map_box = QGroupBox("Mapa")
-        vbox_map = QVBoxLayout()
-        vbox_map.addWidget(self.map_view)
-        map_box.setLayout(vbox_map)
+        self.map_layout = QVBoxLayout()
+        map_box.setLayout(self.map_layout)
         map_box.setMinimumSize(400, 300)
         map_box.setStyleSheet("padding: 18px; border-radius: 18px; background-color: #1b3957;")
 
@@ -332,6 +508,7 @@ class MainWindow(QWidget):
         dashboard_vbox.addLayout(center_panels, stretch=1)
         dashboard_vbox.addSpacing(10)
         dashboard_vbox.addLayout(bottom_panels)
+        dashboard_vbox.addWidget(self.perf_overlay)
         dashboard_vbox.addStretch()
         self.dashboard_tab.setLayout(dashboard_vbox)
 
@@ -342,10 +519,77 @@ class MainWindow(QWidget):
         tele_box.setStyleSheet(tele_box.styleSheet() + "padding: 12px; border-radius: 18px; background-color: #1b3957;")
         map_box.setStyleSheet(map_box.styleSheet() + "padding: 18px; border-radius: 18px; background-color: #1b3957;")
 
+    def setup_cube_panel(self):
+        """Figura del cubo 3D; se dibuja una sola vez (init_cube)"""
+        self.fig, self.canvas = figure_canvas((5, 5))
+        self.ax = self.fig.add_subplot(111, projection='3d')
+        self.cube_layout.insertWidget(0, self.canvas)
+        self.init_cube()
+
+    def setup_mini_plot(self):
+        self.mini_fig, self.mini_canvas = figure_canvas((4, 3))
+        self.mini_ax = self.mini_fig.add_subplot(111)
+        self.mini_ax.set_facecolor('#1b3957')
+        self.mini_ax.set_title('IMU (g)', color='#7fd6ff', fontsize=12)
+        self.mini_ax.tick_params(colors='#7fd6ff')
+        self.mini_line, = self.mini_ax.plot([], [], linewidth=1, label='|a| (g)')
+        self.mini_ax.set_xticks([])
+        self.mini_ax.set_yticks([])
+        self.mini_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c', fontsize=8)
+        self.mini_fig.tight_layout()
+        self.mini_layout.addWidget(self.mini_canvas)
+
+    def setup_map_panel(self):
+        """Mapa con folium y QtWebEngine (un Chromium completo): lo más caro del arranque"""
+        try:
+            import folium
+            from PyQt5.QtWebEngineWidgets import QWebEngineView
+        except ImportError as e:
+            self.map_layout.addWidget(QLabel(f"Mapa no disponible: {e}"))
+            return
+        # Ubicación predeterminada: Ciudad de México
+        lat, lon = 19.4326, -99.1332
+        m = folium.Map(location=[lat, lon], zoom_start=15)
+        map_path = os.path.abspath('map.html')
+        m.save(map_path)
+        self.map_view = QWebEngineView()
+        self.map_view.setMinimumSize(400, 300)
+        self.map_view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.map_view.load(QUrl.fromLocalFile(map_path))
+        self.map_layout.addWidget(self.map_view)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        # Con la ventana ya pintada se crea el siguiente panel pesado
+        if self.pending_panels and not self.panel_timer.isActive():
+            self.panel_timer.start(0)
+
+    def setup_next_panel(self):
+        """Crea un panel pesado pendiente y agenda el siguiente (la UI responde entre uno y otro)"""
+        if not self.pending_panels:
+            return
+        setup = self.pending_panels.pop(0)
+        with self.stats.span('startup_panel'):
+            setup()
+        self.scheduler.mark_all()
+        if self.pending_panels:
+            self.panel_timer.start(0)
+
+    def finish_startup(self):
+        """Crea ya todos los paneles diferidos (scripts y benchmarks sin event loop)."""
+        while self.pending_panels:
+            self.pending_panels.pop(0)()
+        if self.graph_canvas is None:
+            self.setup_graphs_tab()
+        if self.spectrum_canvas is None:
+            self.setup_spectrum_tab()
+        self.scheduler.mark_all()
+
     def setup_graphs_tab(self):
         """Configura la pestaña de gráficas IMU en tiempo real"""
+        from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
         # Crear figura con subplots para acelerómetro y giroscopio
-        self.graph_fig = Figure(figsize=(12, 8))
+        self.graph_fig, self.graph_canvas = figure_canvas((12, 8))
         self.graph_fig.patch.set_facecolor('#1b3957')
         
         # Subplot para acelerómetro
@@ -365,13 +609,19 @@ class MainWindow(QWidget):
         self.gyro_ax.set_ylabel('Velocidad Angular (°/s)', color='#7fd6ff')
         self.gyro_ax.tick_params(colors='#7fd6ff')
         self.gyro_ax.grid(True, alpha=0.3, color='#2a4d6c')
+
+        # Líneas persistentes: con datos nuevos solo cambia su contenido (set_data)
+        colors = ['#ff6b6b', '#4ecdc4', '#45b7d1']
+        self.accel_lines = [self.accel_ax.plot([], [], color=c, label=axis, linewidth=2)[0]
+                            for c, axis in zip(colors, 'XYZ')]
+        self.gyro_lines = [self.gyro_ax.plot([], [], color=c, label=axis, linewidth=2)[0]
+                           for c, axis in zip(colors, 'XYZ')]
+        self.accel_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
+        self.gyro_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
         
         # Ajustar espaciado entre subplots
         self.graph_fig.tight_layout()
         
-        # Canvas para las gráficas
-        self.graph_canvas = FigureCanvas(self.graph_fig)
-        
         # Toolbar para navegación
         self.graph_toolbar = NavigationToolbar(self.graph_canvas, self.graphs_tab)
         
@@ -395,143 +645,220 @@ class MainWindow(QWidget):
         graphs_layout.addLayout(graphs_buttons_layout)
         self.graphs_tab.setLayout(graphs_layout)
 
+    def setup_spectrum_tab(self):
+        """Pestaña con la densidad espectral (PSD de Welch) de cada eje"""
+        self.spectrum_fig, self.spectrum_canvas = figure_canvas((12, 8))
+        self.spectrum_fig.patch.set_facecolor('#1b3957')
+        colors = ['#ff6b6b', '#4ecdc4', '#45b7d1']
+        self.spectrum_lines = []
+        self.spectrum_axes = []
+        for row, (title, unit) in enumerate([('Acelerómetro', 'g²/Hz'), ('Giroscopio', '(°/s)²/Hz')]):
+            ax = self.spectrum_fig.add_subplot(2, 1, row + 1)
+            ax.set_facecolor('#1b3957')
+            ax.set_title(f'Espectro {title}', color='#7fd6ff', fontsize=14, fontweight='bold')
+            ax.set_xlabel('Frecuencia (Hz)', color='#7fd6ff')
+            ax.set_ylabel(f'PSD ({unit})', color='#7fd6ff')
+            ax.set_yscale('log')
+            ax.tick_params(colors='#7fd6ff')
+            ax.grid(True, alpha=0.3, color='#2a4d6c')
+            # Líneas persistentes: cada refresco solo cambia sus datos
+            self.spectrum_lines += [ax.plot([], [], color=c, label=axis, linewidth=1.5)[0]
+                                    for c, axis in zip(colors, 'XYZ')]
+            ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
+            self.spectrum_axes.append(ax)
+        self.spectrum_fig.tight_layout()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.spectrum_canvas)
+        self.spectrum_tab.setLayout(layout)
+
+    def setup_perf_tab(self):
+        """Configura la pestaña de rendimiento (tiempos por etapa y contadores)"""
+        self.perf_text = QPlainTextEdit()
+        self.perf_text.setReadOnly(True)
+        font = QFont("Monospace")
+        font.setStyleHint(QFont.TypeWriter)
+        self.perf_text.setFont(font)
+        self.export_stats_btn = QPushButton("Exportar Stats (JSON)")
+        self.export_stats_btn.clicked.connect(self.export_stats)
+        self.reset_stats_btn = QPushButton("Reiniciar Stats")
+        self.reset_stats_btn.clicked.connect(self.stats.reset)
+        # Cuadros/s máximos de dibujo (el scheduler se crea después de las pestañas)
+        self.fps_spin = QSpinBox()
+        self.fps_spin.setRange(1, 120)
+        self.fps_spin.setValue(DEFAULT_FPS)
+        self.fps_spin.setSuffix(" fps")
+        self.fps_spin.valueChanged.connect(lambda fps: self.scheduler.set_fps(fps))
+
+        perf_buttons = QHBoxLayout()
+        perf_buttons.addWidget(self.export_stats_btn)
+        perf_buttons.addWidget(self.reset_stats_btn)
+        perf_buttons.addWidget(QLabel("Dibujo máx.:"))
+        perf_buttons.addWidget(self.fps_spin)
+        perf_buttons.addStretch()
+
+        perf_layout = QVBoxLayout()
+        perf_layout.addWidget(self.perf_text)
+        perf_layout.addLayout(perf_buttons)
+        self.perf_tab.setLayout(perf_layout)
+
+    def refresh_stats(self):
+        """Calcula tasas y refresca la pestaña/overlay de rendimiento si están visibles"""
+        self.stats.update_rates()
+        if self.link_controller:
+            self.link_label.setText(self.link_controller.describe())
+        elif self.pipeline:
+            self.link_label.setText(self.pipeline.link_text)
+        if self.tab_widget.currentWidget() is self.perf_tab:
+            text = self.stats.format_table()
+            if self.engine:
+                text += "\n\n" + self.engine.format_sources()
+            elif self.pipeline:
+                text += "\n\n" + self.pipeline.sources_text
+            self.perf_text.setPlainText(text)
+        if self.perf_overlay.isVisible():
+            self.perf_overlay.setText(self.stats.format_overlay())
+
+    def toggle_adaptive(self, checked):
+        if self.link_controller:
+            self.link_controller.enabled = checked
+        elif self.pipeline:
+            self.pipeline.set_adaptive(checked)
+
+    def toggle_stabilized(self, checked):
+        if self.pipeline:
+            self.pipeline.frames.request_stabilized(checked)
+
+    def toggle_perf_overlay(self, checked):
+        self.perf_overlay.setVisible(checked)
+        if checked:
+            self.perf_overlay.setText(self.stats.format_overlay())
+
+    def export_stats(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Exportar Stats", "", "JSON (*.json)")
+        if filename:
+            self.stats.dump(filename)
+
     def clear_graphs(self):
         """Limpia todas las gráficas"""
-        self.time_data.clear()
-        self.accel_x_data.clear()
-        self.accel_y_data.clear()
-        self.accel_z_data.clear()
-        self.gyro_x_data.clear()
-        self.gyro_y_data.clear()
-        self.gyro_z_data.clear()
-        
-        self.accel_ax.clear()
-        self.gyro_ax.clear()
-        
-        # Reconfigurar los ejes
-        self.accel_ax.set_facecolor('#1b3957')
-        self.accel_ax.set_title('Acelerómetro (g)', color='#7fd6ff', fontsize=14, fontweight='bold')
-        self.accel_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-        self.accel_ax.set_ylabel('Aceleración (g)', color='#7fd6ff')
-        self.accel_ax.tick_params(colors='#7fd6ff')
-        self.accel_ax.grid(True, alpha=0.3, color='#2a4d6c')
-        
-        self.gyro_ax.set_facecolor('#1b3957')
-        self.gyro_ax.set_title('Giroscopio (°/s)', color='#7fd6ff', fontsize=14, fontweight='bold')
-        self.gyro_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-        self.gyro_ax.set_ylabel('Velocidad Angular (°/s)', color='#7fd6ff')
-        self.gyro_ax.tick_params(colors='#7fd6ff')
-        self.gyro_ax.grid(True, alpha=0.3, color='#2a4d6c')
-        
-        self.graph_canvas.draw()
+        self.imu_buffer.clear()
+        self.spectrum.reset()
+        self.scheduler.mark('mini_plot', 'graphs', 'spectrum')
 
     def save_graphs(self):
         """Guarda las gráficas como imagen"""
         filename, _ = QFileDialog.getSaveFileName(self, "Guardar Gráficas", "", "PNG (*.png);;JPEG (*.jpg);;PDF (*.pdf)")
         if filename:
+            if self.graph_canvas is None:
+                self.setup_graphs_tab()
+            self.update_graph_lines()
             self.graph_fig.savefig(filename, dpi=300, bbox_inches='tight', facecolor='#1b3957')
 
     def on_tab_changed(self, index):
-        """Se llama cuando el usuario cambia de pestaña"""
-        if index == 1 and len(self.time_data) > 0:  # Pestaña de gráficas y hay datos
-            # Actualizar las gráficas con todos los datos acumulados
-            if len(self.accel_x_data) > 0:
-                time_relative = [t - self.time_data[0] for t in self.time_data]
-                
-                # Actualizar gráfica del acelerómetro
-                self.accel_ax.clear()
-                self.accel_ax.set_facecolor('#1b3957')
-                self.accel_ax.set_title('Acelerómetro (g)', color='#7fd6ff', fontsize=14, fontweight='bold')
-                self.accel_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-                self.accel_ax.set_ylabel('Aceleración (g)', color='#7fd6ff')
-                self.accel_ax.tick_params(colors='#7fd6ff')
-                self.accel_ax.grid(True, alpha=0.3, color='#2a4d6c')
-                
-                self.accel_ax.plot(time_relative, self.accel_x_data, color='#ff6b6b', label='X', linewidth=2)
-                self.accel_ax.plot(time_relative, self.accel_y_data, color='#4ecdc4', label='Y', linewidth=2)
-                self.accel_ax.plot(time_relative, self.accel_z_data, color='#45b7d1', label='Z', linewidth=2)
-                self.accel_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
-                
-                # Actualizar gráfica del giroscopio
-                self.gyro_ax.clear()
-                self.gyro_ax.set_facecolor('#1b3957')
-                self.gyro_ax.set_title('Giroscopio (°/s)', color='#7fd6ff', fontsize=14, fontweight='bold')
-                self.gyro_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-                self.gyro_ax.set_ylabel('Velocidad Angular (°/s)', color='#7fd6ff')
-                self.gyro_ax.tick_params(colors='#7fd6ff')
-                self.gyro_ax.grid(True, alpha=0.3, color='#2a4d6c')
-                
-                self.gyro_ax.plot(time_relative, self.gyro_x_data, color='#ff6b6b', label='X', linewidth=2)
-                self.gyro_ax.plot(time_relative, self.gyro_y_data, color='#4ecdc4', label='Y', linewidth=2)
-                self.gyro_ax.plot(time_relative, self.gyro_z_data, color='#45b7d1', label='Z', linewidth=2)
-                self.gyro_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
-                
-                self.graph_fig.tight_layout()
-                self.graph_canvas.draw()
-
-    def update_graphs(self, ax_val, ay_val, az_val, gx_val, gy_val, gz_val):
-        """Actualiza las gráficas con nuevos datos del IMU"""
-        current_time = time.time()
-        
-        # Agregar nuevos datos
-        self.time_data.append(current_time)
-        self.accel_x_data.append(ax_val)
-        self.accel_y_data.append(ay_val)
-        self.accel_z_data.append(az_val)
-        self.gyro_x_data.append(gx_val)
-        self.gyro_y_data.append(gy_val)
-        self.gyro_z_data.append(gz_val)
-        
-        # Limitar el número de puntos para evitar problemas de memoria
-        if len(self.time_data) > self.max_points:
-            self.time_data.pop(0)
-            self.accel_x_data.pop(0)
-            self.accel_y_data.pop(0)
-            self.accel_z_data.pop(0)
-            self.gyro_x_data.pop(0)
-            self.gyro_y_data.pop(0)
-            self.gyro_z_data.pop(0)
-        
-        # Convertir tiempo relativo (empezando desde 0)
-        time_relative = [t - self.time_data[0] for t in self.time_data]
-        
-        # Actualizar gráfica del acelerómetro
-        self.accel_ax.clear()
-        self.accel_ax.set_facecolor('#1b3957')
-        self.accel_ax.set_title('Acelerómetro (g)', color='#7fd6ff', fontsize=14, fontweight='bold')
-        self.accel_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-        self.accel_ax.set_ylabel('Aceleración (g)', color='#7fd6ff')
-        self.accel_ax.tick_params(colors='#7fd6ff')
-        self.accel_ax.grid(True, alpha=0.3, color='#2a4d6c')
-        
-        if len(time_relative) > 0:
-            self.accel_ax.plot(time_relative, self.accel_x_data, color='#ff6b6b', label='X', linewidth=2)
-            self.accel_ax.plot(time_relative, self.accel_y_data, color='#4ecdc4', label='Y', linewidth=2)
-            self.accel_ax.plot(time_relative, self.accel_z_data, color='#45b7d1', label='Z', linewidth=2)
-            self.accel_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
-        
-        # Actualizar gráfica del giroscopio
-        self.gyro_ax.clear()
-        self.gyro_ax.set_facecolor('#1b3957')
-        self.gyro_ax.set_title('Giroscopio (°/s)', color='#7fd6ff', fontsize=14, fontweight='bold')
-        self.gyro_ax.set_xlabel('Tiempo (s)', color='#7fd6ff')
-        self.gyro_ax.set_ylabel('Velocidad Angular (°/s)', color='#7fd6ff')
-        self.gyro_ax.tick_params(colors='#7fd6ff')
-        self.gyro_ax.grid(True, alpha=0.3, color='#2a4d6c')
-        
-        if len(time_relative) > 0:
-            self.gyro_ax.plot(time_relative, self.gyro_x_data, color='#ff6b6b', label='X', linewidth=2)
-            self.gyro_ax.plot(time_relative, self.gyro_y_data, color='#4ecdc4', label='Y', linewidth=2)
-            self.gyro_ax.plot(time_relative, self.gyro_z_data, color='#45b7d1', label='Z', linewidth=2)
-            self.gyro_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c')
-        
-        # Ajustar layout y redibujar
-        self.graph_fig.tight_layout()
+        """Al mostrarse una pestaña se dibuja lo acumulado mientras estaba oculta"""
+        if self.tab_widget.widget(index) is self.graphs_tab and self.graph_canvas is None:
+            self.setup_graphs_tab()
+        if self.tab_widget.widget(index) is self.spectrum_tab and self.spectrum_canvas is None:
+            self.setup_spectrum_tab()
+        self.scheduler.mark_all()
+
+    def changeEvent(self, event):
+        # Al restaurar la ventana minimizada se repinta lo acumulado
+        if event.type() == QEvent.WindowStateChange:
+            self.scheduler.mark_all()
+        super().changeEvent(event)
+
+    def panel_visible(self, widget):
+        """True si el widget se ve (pestaña activa y ventana no minimizada)."""
+        return widget is not None and widget.isVisible() and not self.isMinimized()
+
+    def _needs_draw(self, name, widget):
+        """True si el panel se ve y el búfer cambió desde su último dibujo."""
+        if not self.panel_visible(widget):
+            return False
+        version = self.imu_buffer.version
+        if self.drawn_versions.get(name) == version:
+            return False
+        self.drawn_versions[name] = version
+        return True
+
+    def update_graphs(self, ax_val, ay_val, az_val, gx_val, gy_val, gz_val, t=None):
+        """Agrega una muestra IMU a los búferes de las gráficas (no dibuja)"""
+        self.imu_buffer.append(time.time() if t is None else t,
+                               (ax_val, ay_val, az_val, gx_val, gy_val, gz_val))
+
+    def refresh_graphs(self):
+        """Redibuja la pestaña de gráficas desde el búfer si está visible"""
+        if not self._needs_draw('graphs', self.graph_canvas):
+            return
+        self.update_graph_lines()
         self.graph_canvas.draw()
 
+    def update_graph_lines(self):
+        t, data = self.imu_buffer.latest()
+        t = t - t[0] if len(t) else t
+        for i, line in enumerate(self.accel_lines):
+            line.set_data(t, data[:, i])
+        for i, line in enumerate(self.gyro_lines):
+            line.set_data(t, data[:, 3 + i])
+        for ax in (self.accel_ax, self.gyro_ax):
+            ax.relim()
+            ax.autoscale_view()
+
+    def refresh_spectrum(self):
+        """Agrega al espectro las muestras nuevas del búfer y lo dibuja (solo si se ve)"""
+        if not self.panel_visible(self.spectrum_canvas):
+            return
+        if self.imu_buffer.total - self.spectrum_total > len(self.imu_buffer):
+            # Mientras estaba oculto el búfer pisó muestras: no se empalman tramos separados
+            self.spectrum.reset()
+        t, data, self.spectrum_total = self.imu_buffer.since(self.spectrum_total)
+        if not self.spectrum.update(data):
+            return
+        # El búfer ya está en la grilla uniforme: la tasa es exacta
+        fs = self.resampler.rate
+        freqs = self.spectrum.frequencies(fs)
+        psd = self.spectrum.density(fs)
+        for i, line in enumerate(self.spectrum_lines):
+            line.set_data(freqs[1:], psd[i, 1:])   # sin la componente continua
+        for ax in self.spectrum_axes:
+            ax.relim()
+            ax.autoscale_view()
+        self.spectrum_canvas.draw()
+
+    def refresh_mini_plot(self):
+        if not self._needs_draw('mini', self.mini_canvas):
+            return
+        t, data = self.imu_buffer.latest(self.mini_max_pts)
+        t = t - t[0] if len(t) else t
+        self.mini_line.set_data(t, np.sqrt((data[:, :3] ** 2).sum(axis=1)))
+        self.mini_ax.relim()
+        self.mini_ax.autoscale_view()
+        self.mini_canvas.draw()
+
     def refresh_ports(self):
+        """Pasa a los combos la última enumeración de puertos, conservando lo elegido"""
+        scanner = self.port_scanner
+        if scanner.version == self.ports_version:
+            return
+        self.ports_version = scanner.version
+        ports = scanner.ports
+        port = self.port_combo.currentText()
+        port2 = self.port2_combo.currentText()
         self.port_combo.clear()
-        self.port_combo.addItems(list_serial_ports())
+        self.port_combo.addItems(ports)
+        if port:
+            self.port_combo.setCurrentText(port)
+        self.port2_combo.clear()
+        self.port2_combo.addItem(NO_PORT)
+        self.port2_combo.addItems(ports)
+        self.port2_combo.setCurrentText(port2 or NO_PORT)
+
+    def select_stream(self, stream):
+        if stream:
+            self.current_stream = stream
+            if self.pipeline:
+                self.pipeline.select_stream(stream)
 
     def toggle_connection(self):
         if self.connected:
@@ -541,30 +868,166 @@ class MainWindow(QWidget):
 
     def connect_serial(self):
         port = self.port_combo.currentText()
+        port2 = self.port2_combo.currentText()
+        if self.process_check.isChecked():
+            self.connect_pipeline(port, port2)
+            return
         try:
-            self.serial = serial.Serial(port, 115200, timeout=2)
+            # La ingesta corre en su propio hilo y abre los puertos ahí (sin trabar
+            # la interfaz); update_data vacía la cola y sigue el estado del puerto
+            self.engine = IngestEngine(self.stats)
+            # Solo el puerto USB negocia velocidad; el segundo suele ser una radio
+            source = self.engine.add_source(port, DEFAULT_STREAM, BOOT_BAUD,
+                                            target_baud=int(self.baud_combo.currentText()))
+            if port2 and port2 != NO_PORT and port2 != port:
+                stream2 = DEFAULT_STREAM if self.port2_mode_combo.currentIndex() == 0 else 'cansat2'
+                self.engine.add_source(port2, stream2, BOOT_BAUD)
+            self.engine.start(background=True)
+            self.stream_combo.clear()
+            self.stream_combo.addItems(self.engine.streams())
+            # Control adaptativo: los comandos van por todos los puertos del stream mostrado
+            # (la velocidad del enlace se actualiza al abrir, ver update_link_state)
+            self.link_controller = LinkController(lambda cmd: self.engine.send(self.current_stream, cmd),
+                                                  link_bytes_per_s=link_bytes_per_s(source.baudrate))
+            self.link_controller.enabled = self.adaptive_check.isChecked()
+            self.video.reset()
+            self.attitude_history.clear()
+            self.tagger.reset()
+            self.flight.reset()
+            self.resampler.reset()
             self.connected = True
-            self.status_label.setText("Conectado")
-            self.status_label.setStyleSheet(get_status_color(True))
+            self.link_state = None
+            self.update_link_state(self.engine.state(self.current_stream), source.baudrate)
             self.ser_port = port
         except Exception as e:
             self.status_label.setText("Error")
             self.status_label.setStyleSheet(get_status_color(False))
             print("Error al conectar:", e)
 
+    def connect_pipeline(self, port, port2):
+        """Conexión en modo multiproceso: la ingesta y la decodificación van en otros procesos"""
+        ports = [(port, DEFAULT_STREAM)]
+        if port2 and port2 != NO_PORT and port2 != port:
+            ports.append((port2, DEFAULT_STREAM if self.port2_mode_combo.currentIndex() == 0 else 'cansat2'))
+        try:
+            # Como con hilos: los puertos se abren en el proceso de ingesta sin
+            # trabar la interfaz; update_data sigue el estado hasta 'connected'
+            self.pipeline = ProcessPipeline(ports, int(self.baud_combo.currentText()), DEFAULT_STREAM,
+                                            self.adaptive_check.isChecked())
+            self.pipeline.start(background=True)
+            self.pipeline.frames.request_stabilized(self.stabilize_check.isChecked())
+        except Exception as e:
+            self.pipeline = None
+            self.status_label.setText("Error")
+            self.status_label.setStyleSheet(get_status_color(False))
+            print("Error al conectar:", e)
+            return
+        self.current_stream = DEFAULT_STREAM
+        self.stream_combo.clear()
+        self.stream_combo.addItems(self.pipeline.streams)
+        self.video.reset()
+        self.attitude_history.clear()
+        self.tagger.reset()
+        self.flight.reset()
+        self.resampler.reset()
+        self.connected = True
+        self.link_state = None
+        self.update_link_state(self.pipeline.link_state, self.pipeline.baudrate)
+        self.ser_port = port
+
+    def update_link_state(self, state, baudrate):
+        """Barra de estado según el puerto: abrirlo y reconectarlo lo hace la ingesta"""
+        if state == self.link_state:
+            return
+        previous, self.link_state = self.link_state, state
+        if state == STATE_OPEN:
+            if self.engine and self.recorder is None and previous in (None, STATE_CONNECTING):
+                # Primera apertura: recién ahora hay algo que grabar
+                try:
+                    self.recorder = Recorder(new_recording_path(), self.stats)
+                except OSError as e:
+                    print("No se pudo crear la grabación:", e)
+            if self.link_controller:
+                # Tras reconectar la velocidad pudo cambiar (el firmware vuelve a BOOT_BAUD)
+                self.link_controller.link_bytes_per_s = link_bytes_per_s(baudrate)
+            mode = ", multiproceso" if self.pipeline else ""
+            self.status_label.setText(f"Conectado ({baudrate or 'USB-CDC'}{mode})")
+        elif state == STATE_FAILED and (self.engine and self.engine.sources[0].state == STATE_FAILED
+                                        or self.pipeline and self.pipeline.error is not None):
+            # El puerto principal no abrió (o la ingesta multiproceso no respondió):
+            # como antes, la conexión falla
+            print("Error al conectar:", self.engine.sources[0].error if self.engine else self.pipeline.error)
+            self.disconnect_serial()
+            self.status_label.setText("Error")
+            return
+        else:
+            self.status_label.setText(LINK_TEXT.get(state, state))
+        self.status_label.setStyleSheet(get_status_color(state == STATE_OPEN))
+
+    def on_link_gap(self, gap):
+        """Un puerto volvió tras una caída (la grabación ya tiene su REC_GAP)"""
+        self.stats.count('link_gaps')
+        print(f"{gap.source}: enlace restablecido tras {gap.end - gap.start:.1f} s sin datos")
+
     def disconnect_serial(self):
-        if self.serial:
-            self.serial.close()
+        if self.engine:
+            self.engine.stop()
+            self.engine = None
+        if self.pipeline:
+            # El video apunta a la memoria compartida: se copia antes de liberarla
+            if self.last_img is not None:
+                self.last_img = self.last_img.copy()
+                self.video_view.set_frame(self.last_img)
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        self.link_controller = None
         self.connected = False
+        self.link_state = None
         self.status_label.setText("Desconectado")
         self.status_label.setStyleSheet(get_status_color(False))
         self.ser_port = None
 
+    def closeEvent(self, event):
+        # Detiene el hilo de ingesta y libera los puertos al cerrar la ventana
+        if self.connected:
+            self.disconnect_serial()
+        self.port_scanner.stop()
+        self.video.stop()
+        super().closeEvent(event)
+
     def save_image(self):
         if self.last_img is not None:
             filename, _ = QFileDialog.getSaveFileName(self, "Guardar Imagen", "", "JPEG (*.jpg *.jpeg)")
             if filename:
-                cv2.imwrite(filename, cv2.cvtColor(self.last_img, cv2.COLOR_RGB2BGR))
+                # En modo multiproceso lo guarda el proceso de decodificación
+                full_jpeg = self.pipeline.last_jpeg() if self.pipeline else self.video.video.full_jpeg
+                if full_jpeg is not None:
+                    # El JPEG tal como llegó: resolución completa y sin recomprimir
+                    with open(filename, 'wb') as f:
+                        f.write(full_jpeg)
+                else:
+                    cv2.imwrite(filename, cv2.cvtColor(self.last_img, cv2.COLOR_RGB2BGR))
+
+    def export_video(self):
+        """Exporta una grabación a AVI MJPEG (copia los JPEG, no recomprime)."""
+        start = self.recorder.path if self.recorder else RECORDINGS_DIR
+        recording, _ = QFileDialog.getOpenFileName(self, "Grabación", start, "Grabación CanSat (*.cnr)")
+        if not recording:
+            return
+        output, _ = QFileDialog.getSaveFileName(self, "Exportar video", os.path.splitext(recording)[0] + ".avi",
+                                                "AVI (*.avi)")
+        if not output:
+            return
+        if self.recorder and os.path.abspath(recording) == os.path.abspath(self.recorder.path):
+            self.recorder.flush()  # la grabación en curso también se puede exportar
+        try:
+            info = export_avi(recording, output)
+            print(f"Video exportado: {info['output']} ({info['images']} imágenes, {info['duration_s']:.1f} s)")
+        except (OSError, ValueError) as e:
+            print("Error al exportar video:", e)
 
     def save_log(self):
         filename, _ = QFileDialog.getSaveFileName(self, "Guardar Log", "", "CSV (*.csv)")
@@ -607,103 +1070,235 @@ class MainWindow(QWidget):
         self.pitch = pitch
         self.roll = roll
         self.yaw = yaw
-        self.init_cube()
+        self.scheduler.mark('labels', 'cube')
+
+    def refresh_cube(self):
+        """El cubo se dibuja una vez en init_cube; aquí solo se mueve la cámara"""
+        if not self.panel_visible(self.canvas):
+            return
+        view = (self.pitch, self.yaw, self.roll)
+        if self.drawn_versions.get('cube') == view:
+            return
+        self.drawn_versions['cube'] = view
+        self.ax.view_init(elev=self.pitch, azim=self.yaw, roll=self.roll)
+        self.canvas.draw()
+
+    def refresh_labels(self):
+        """Textos de actitud y telemetría con la última muestra"""
         self.pitch_label.setText(f"Pitch: {self.pitch:.1f}°")
         self.roll_label.setText(f"Roll: {self.roll:.1f}°")
         self.yaw_label.setText(f"Yaw: {self.yaw:.1f}°")
+        self.state_label.setText(f"Estado: {PHASE_NAMES[self.flight.phase]}")
+        if self.last_sample is None:
+            return
+        ax_val, ay_val, az_val = self.last_sample[:3]
+        # Actualiza telemetría con datos reales del IMU
+        self.bat_bar.setValue(90)
+        self.temp_label.setText("Temp: 25.0 °C")
+        self.alt_label.setText("Altitud: 123 m")
+
+        # Actualiza valores de sensores en el dashboard
+        accel_magnitude = math.sqrt(ax_val**2 + ay_val**2 + az_val**2)
+        self.accel_value.setText(f"{accel_magnitude:.2f}")
+        self.altitude_value.setText("316")  # Puedes actualizar con datos reales de altitud
+        self.pressure_value.setText("987.4")  # Puedes actualizar con datos reales de presión
+
+    def refresh_video(self):
+        """Decodifica y muestra solo la imagen más reciente del cuadro"""
+        self.pending_video = 0
+        if self.pipeline:
+            # Ya decodificado en otro proceso: vista sin copia de la última ranura
+            latest = self.pipeline.frames.latest()
+            if latest is not None:
+                self.stats.count('frames')
+                self.last_img = latest[1]
+                self.video_view.set_frame(self.last_img)
+            return
+        # Decodificado (reducido al panel) y enderezado en el hilo de video
+        img = self.video.take()
+        if img is not None:
+            self.stats.count('frames')
+            self.video_view.set_frame(img)
+            self.last_img = img
+
+    def process_imu(self, packets):
+        """Decodifica el lote de líneas IMU de una vez y las pasa por el filtro.
+
+        Devuelve la última muestra válida en unidades físicas, o None.
+        """
+        stats = self.stats
+        lines = [packet.data for packet in packets]
+        stats.count('imu_lines', len(lines))
+        self.log_lines.extend(lines)
+        with stats.span('parse'):
+            raw, valid = decode_imu_lines(lines)
+            physical = raw[valid] * PHYSICAL_SCALE
+        bad = len(lines) - int(valid.sum())
+        if bad:
+            stats.count('bad_lines', bad)
+        # Con hora del CanSat el dt es exacto aunque las líneas lleguen en lotes
+        times = [sample_time(packet.data, packet.t) for packet, ok in zip(packets, valid.tolist()) if ok]
+        return self.process_samples(times, physical)
+
+    def process_samples(self, times, physical):
+        """Filtro de actitud, búfer de gráficas y fase de vuelo para un lote de muestras.
+
+        physical es (n, 6) en g y °/s con sus horas en `times`. Devuelve la última
+        muestra (lista) o None.
+        """
+        stats = self.stats
+        sample = None
+        for t_sample, sample_i in zip(times, physical.tolist()):
+            sample = sample_i
+            dt = t_sample - self.last_time if self.last_time is not None else 0.0
+            if dt < 0 or dt > 1.0:
+                dt = 0.0  # Reinicio del CanSat o cambio de reloj
+            self.last_time = t_sample
+            # Filtro complementario
+            with stats.span('filter'):
+                self.pitch, self.roll, self.yaw = self.attitude.update(*sample, dt)
+            self.attitude_history.add(t_sample, self.pitch, self.roll, self.yaw)
+        if len(times):
+            # Al búfer (gráficas y espectro) en la grilla uniforme; dibujar es aparte
+            with stats.span('resample'):
+                grid, values, filled = self.resampler.update(times, physical)
+            self.imu_buffer.extend(grid, values)
+            if filled.any():
+                stats.count('resample_filled', int(filled.sum()))
+            # Fase de vuelo: un solo paso vectorizado por lote
+            with stats.span('flight'):
+                events = self.flight.feed(times, physical)
+            for event in events:
+                self.on_flight_event(event)
+        return sample
+
+    def tag_frames(self):
+        """Cuadros cuya actitud ya se puede interpolar: etiqueta a la grabación"""
+        for tag in self.tagger.resolve(self.attitude_history, time.time()):
+            self.frame_tag = tag
+            self.stats.count('frame_tags')
+            if self.recorder is not None:
+                self.recorder.add_tag(tag, time.time())
+
+    def on_flight_event(self, event):
+        """Evento de vuelo: a la grabación, a la consola y al panel de estado"""
+        self.stats.count('flight_events')
+        if self.recorder is not None:
+            self.recorder.add_event(event, time.time())
+        elif self.pipeline is not None:
+            self.pipeline.add_event(event, time.time())  # graba el proceso de ingesta
+        print(f"Evento de vuelo: {event.name} ({event.t:.2f} s) -> {PHASE_NAMES[event.phase]}")
+        self.scheduler.mark('labels')
 
     def update_data(self):
         if not self.connected or self.pause_btn.isChecked():
             return
+        stats = self.stats
+        t_update = perf_counter_ns()
+        if self.pipeline:
+            try:
+                self.update_from_pipeline()
+            except Exception as e:
+                stats.error(e)
+                print("Error en update_data:", e)
+            finally:
+                stats.record('update', perf_counter_ns() - t_update)
+            return
         try:
-            # Lee línea de datos del MPU6050
-            line = self.serial.readline().decode(errors='ignore').strip()
-            if not line.startswith('ACC:'):
+            # Paquetes ya separados y validados por el hilo de ingesta
+            stats.gauge('queue_depth', self.engine.queue_depth(self.current_stream))
+            with stats.span('drain'):
+                packets = self.engine.drain(self.current_stream)
+            # Después de vaciar: si llegaron paquetes, el estado ya dice abierto y la
+            # grabación (que se crea al abrir) existe antes de recorrerlos
+            self.update_link_state(self.engine.state(self.current_stream), self.engine.sources[0].baudrate)
+            if not self.connected:
                 return
-            self.log_lines.append(line)
-            acc = line.split('ACC:')[1].split(';')[0]
-            gyro = line.split('GYRO:')[1].split(';')[0]
-            ax_val, ay_val, az_val = [float(x) for x in acc.split(',')]
-            gx_val, gy_val, gz_val = [float(x) for x in gyro.split(',')]
-            # Convierte a unidades físicas
-            ax_val /= 16384.0
-            ay_val /= 16384.0
-            az_val /= 16384.0
-            gx_val /= 131.0
-            gy_val /= 131.0
-            gz_val /= 131.0
-            now = time.time()
-            dt = now - self.last_time
-            self.last_time = now
-            # Pitch y roll del acelerómetro
-            pitch_acc = math.atan2(-ax_val, math.sqrt(ay_val**2 + az_val**2)) * 180 / math.pi
-            roll_acc = math.atan2(ay_val, az_val) * 180 / math.pi
-            # Filtro complementario
-            self.pitch = self.alpha * (self.pitch + gy_val * dt) + (1 - self.alpha) * pitch_acc
-            self.roll = self.alpha * (self.roll + gx_val * dt) + (1 - self.alpha) * roll_acc
-            self.yaw += gz_val * dt
-            self.update_cube(self.pitch, self.roll, self.yaw)
-            # Lee imagen
-            while self.serial.read(1) != b'\xAA':
-                pass
-            size_bytes = self.serial.read(2)
-            img_size = (size_bytes[0] << 8) | size_bytes[1]
-            img_data = b''
-            while len(img_data) < img_size:
-                img_data += self.serial.read(img_size - len(img_data))
-            img_array = np.frombuffer(img_data, dtype=np.uint8)
-            img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            if img is not None:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                h, w, ch = img.shape
-                bytes_per_line = ch * w
-                qt_img = QImage(img.data, w, h, bytes_per_line, QImage.Format_RGB888)
-                pixmap = QPixmap.fromImage(qt_img).scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.video_label.setPixmap(pixmap)
-                self.last_img = img
-            # Actualiza telemetría con datos reales del IMU
-            self.bat_bar.setValue(90)
-            self.temp_label.setText("Temp: 25.0 °C")
-            self.alt_label.setText("Altitud: 123 m")
-            self.state_label.setText("Estado: En vuelo")
-            
-            # Actualiza valores de sensores en el dashboard
-            accel_magnitude = math.sqrt(ax_val**2 + ay_val**2 + az_val**2)
-            self.accel_value.setText(f"{accel_magnitude:.2f}")
-            self.altitude_value.setText("316")  # Puedes actualizar con datos reales de altitud
-            self.pressure_value.setText("987.4")  # Puedes actualizar con datos reales de presión
-            # --- Datos para mini-grafica:
-            now = time.time()
-            self.mini_time.append(now)
-            self.mini_accel.append(math.sqrt(ax_val**2 + ay_val**2 + az_val**2))
-
-            # Limitar tamaño de la ventana
-            if len(self.mini_time) > self.mini_max_pts:
-                self.mini_time.pop(0)
-                self.mini_accel.pop(0)
-
-            # Convertir a tiempo relativo
-            t_rel = [t - self.mini_time[0] for t in self.mini_time]
-
-            # Dibujar mini-grafica
-            self.mini_ax.clear()
-            self.mini_ax.set_facecolor('#1b3957')
-            self.mini_ax.plot(t_rel, self.mini_accel, linewidth=1, label='|a| (g)')
-            self.mini_ax.set_xticks([])
-            self.mini_ax.set_yticks([])
-            self.mini_ax.legend(loc='upper right', facecolor='#1b3957', edgecolor='#2a4d6c', fontsize=8)
-            self.mini_fig.tight_layout()
-            self.mini_canvas.draw()
-
-            # Actualiza las gráficas con los datos del IMU (solo si estamos en la pestaña de gráficas)
-            if self.tab_widget.currentIndex() == 1:  # Pestaña de gráficas
-                self.update_graphs(ax_val, ay_val, az_val, gx_val, gy_val, gz_val)
+            sample = None
+            imu_packets = []
+            video_packets = []
+            capture_ms = None
+            recorder = self.recorder
+            for packet in packets:
+                kind, data = packet.kind, packet.data
+                self.link_controller.on_packet(kind, data, packet.t)
+                if recorder is not None:
+                    recorder.add(kind, data, packet.t)
+                if kind == PKT_IMU:
+                    imu_packets.append(packet)
+                elif kind in VIDEO_PACKETS:
+                    if self.pending_video:
+                        stats.count('skipped_frames')  # Solo se muestra la más reciente
+                    self.pending_video += 1
+                    video_packets.append((kind, data))
+                    capture_ms = getattr(data, 'capture_ms', None)
+                    if capture_ms is not None:
+                        self.tagger.add(capture_ms, packet.t)
+                elif kind == PKT_TEXT:
+                    print(f"{packet.source}:", data)
+                elif kind == PKT_GAP:
+                    self.on_link_gap(data)
+            if imu_packets:
+                sample = self.process_imu(imu_packets)
+            display_size = (self.video_view.width(), self.video_view.height())
+            if video_packets:
+                # Roll a la hora de captura con las muestras de este lote ya en la historia
+                roll = None
+                if self.stabilize_check.isChecked():
+                    angles = self.attitude_history.euler_at(capture_ms / 1000.0 if capture_ms is not None else None)
+                    roll = angles[1] if angles is not None else 0.0
+                self.video.submit(video_packets, display_size, roll)
+            elif display_size != self.video.display_size:
+                # Si el panel creció, la imagen reducida se vuelve a decodificar
+                self.video.submit([], display_size, self.video.roll)
+            if self.video.ready():
+                self.scheduler.mark('video')
+            self.tag_frames()
+            self.link_controller.tick()
+            if sample is not None:
+                # Textos, cubo y gráficas se repintan en el próximo cuadro
+                self.last_sample = sample
+                self.scheduler.mark('labels', 'cube', 'mini_plot', 'graphs')
         except Exception as e:
+            stats.error(e)
             print("Error en update_data:", e)
+        finally:
+            stats.record('update', perf_counter_ns() - t_update)
 
-if __name__ == "__main__":
+    def update_from_pipeline(self):
+        """Modo multiproceso: lotes IMU ya decodificados, aviso de video nuevo y textos"""
+        stats = self.stats
+        pipeline = self.pipeline
+        for message in pipeline.messages():
+            if message[0] == 'text':
+                print(f"{message[1]}:", message[2])
+            elif message[0] == 'gap':
+                self.on_link_gap(message[1])
+        self.update_link_state(pipeline.link_state, pipeline.baudrate)
+        if not self.connected:
+            return
+        # Tamaño del panel para decodificar reducido (y de nuevo si crece)
+        pipeline.frames.request_size(self.video_view.width(), self.video_view.height())
+        with stats.span('drain'):
+            rows = pipeline.imu.get_all()
+        stats.gauge('imu_lost', pipeline.imu.lost)
+        if len(rows):
+            stats.count('imu_lines', len(rows))
+            sample = self.process_samples(rows[:, 0].tolist(), rows[:, 1:])
+            self.last_sample = sample
+            self.scheduler.mark('labels', 'cube', 'mini_plot', 'graphs')
+        if pipeline.frames.head != pipeline.frames.last_read:
+            self.scheduler.mark('video')
+
+def main():
+    # QtWebEngine se importa después de crear la aplicación (mapa diferido);
+    # para eso necesita contextos OpenGL compartidos desde antes
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
     window = MainWindow()
     window.show()
-    app.exec_()
\ No newline at end of file
+    return app.exec_()
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,239 @@
+"""Decodificación, conversión de unidades, filtro de actitud, búfer de muestras e
+historia de actitud (cuaterniones) para el MPU6050."""
+import math
+import re
+from itertools import compress
+from operator import itemgetter
+
+import numpy as np
+
+# Escalas por defecto del MPU6050 (±2 g y ±250 °/s)
+ACC_LSB_PER_G = 16384.0
+GYRO_LSB_PER_DPS = 131.0
+# Cuentas crudas (ax..gz) -> g y °/s, para arreglos de muestras
+PHYSICAL_SCALE = np.array([1 / ACC_LSB_PER_G] * 3 + [1 / GYRO_LSB_PER_DPS] * 3)
+
+# Un resultado por línea: ('x,y,z', 'x,y,z') si empieza con 'ACC:x,y,z;GYRO:x,y,z;'
+# y ('', '') si no. Sin ceros a la izquierda (el firmware nunca los manda, así un
+# dígito colado por ruido no pasa) y seis dígitos para detectar valores fuera de int16.
+_INT = r'(?:0|-?[1-9]\d{0,5})'
+_XYZ = r'(%s,%s,%s)' % (_INT, _INT, _INT)
+IMU_FIELDS = re.compile(r'^ACC:%s;GYRO:%s;|^.*$' % (_XYZ, _XYZ), re.M)
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+def decode_imu_lines(lines):
+    """Decodifica de una vez muchas líneas 'ACC:x,y,z;GYRO:x,y,z;...'.
+
+    `lines` es una lista de líneas o un bloque de texto (str o bytes) con una
+    línea por renglón. Devuelve (raw, valid): raw es int16 (n, 6) con las
+    cuentas crudas y valid es bool (n,); una línea con otro formato o con
+    valores fuera de int16 queda en cero y con valid False, nunca como muestra.
+    """
+    if not len(lines):
+        return np.zeros((0, 6), np.int16), np.zeros(0, bool)
+    if isinstance(lines, (bytes, bytearray, memoryview)):
+        lines = bytes(lines).decode('ascii', errors='replace')
+    if isinstance(lines, str):
+        text = lines[:-1] if lines.endswith('\n') else lines
+    else:
+        text = '\n'.join(lines)
+    # Una pasada de regex y una sola conversión de texto a números para todo el bloque
+    fields = IMU_FIELDS.findall(text)
+    n = len(fields)
+    valid = np.fromiter(map(len, map(itemgetter(0), fields)), np.int32, n) > 0
+    values = np.zeros((n, 6), np.int32)
+    if valid.any():
+        flat = ','.join(map(','.join, compress(fields, valid)))
+        values[valid] = np.fromstring(flat, dtype=np.int32, sep=',').reshape(-1, 6)
+        valid &= ((values >= INT16_MIN) & (values <= INT16_MAX)).all(axis=1)
+        values[~valid] = 0
+    return values.astype(np.int16), valid
+
+
+def to_physical(ax, ay, az, gx, gy, gz):
+    """Convierte cuentas crudas a g y °/s."""
+    return (ax / ACC_LSB_PER_G, ay / ACC_LSB_PER_G, az / ACC_LSB_PER_G,
+            gx / GYRO_LSB_PER_DPS, gy / GYRO_LSB_PER_DPS, gz / GYRO_LSB_PER_DPS)
+
+
+class ComplementaryFilter:
+    """Filtro complementario: giroscopio a corto plazo, acelerómetro a largo plazo."""
+
+    def __init__(self, alpha=0.98):
+        self.alpha = alpha
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.yaw = 0.0
+
+    def reset(self):
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.yaw = 0.0
+
+    def update(self, ax, ay, az, gx, gy, gz, dt):
+        """Integra una muestra en unidades físicas y devuelve (pitch, roll, yaw) en grados."""
+        # Pitch y roll del acelerómetro
+        pitch_acc = math.atan2(-ax, math.sqrt(ay**2 + az**2)) * 180 / math.pi
+        roll_acc = math.atan2(ay, az) * 180 / math.pi
+        # Filtro complementario
+        self.pitch = self.alpha * (self.pitch + gy * dt) + (1 - self.alpha) * pitch_acc
+        self.roll = self.alpha * (self.roll + gx * dt) + (1 - self.alpha) * roll_acc
+        self.yaw += gz * dt
+        return self.pitch, self.roll, self.yaw
+
+
+class SampleBuffer:
+    """Búfer circular de muestras (tiempo y N canales) sobre arreglos NumPy.
+
+    Agregar cuesta lo mismo con el búfer lleno o vacío; `version` cambia con
+    cada muestra para que quien dibuja sepa si hay algo nuevo y `total`
+    cuenta todas las agregadas, para que un consumidor pida solo las nuevas.
+    """
+
+    def __init__(self, channels, capacity):
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        self.data = np.zeros((capacity, channels))
+        self.pos = 0
+        self.count = 0
+        self.version = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+        self.version += 1
+
+    def append(self, t, values):
+        self.t[self.pos] = t
+        self.data[self.pos] = values
+        self.pos = (self.pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.version += 1
+        self.total += 1
+
+    def extend(self, t, values):
+        """Agrega un lote: t (n,) y values (n, canales)."""
+        n = len(t)
+        if n == 0:
+            return
+        if n > self.capacity:
+            t, values = t[-self.capacity:], values[-self.capacity:]
+        idx = np.arange(self.pos, self.pos + len(t)) % self.capacity
+        self.t[idx] = t
+        self.data[idx] = values
+        self.pos = (self.pos + len(t)) % self.capacity
+        self.count = min(self.count + len(t), self.capacity)
+        self.version += 1
+        self.total += n
+
+    def latest(self, n=None):
+        """Copias (t, datos) de las últimas n muestras en orden cronológico."""
+        n = self.count if n is None else min(n, self.count)
+        idx = np.arange(self.pos - n, self.pos) % self.capacity
+        return self.t[idx], self.data[idx]
+
+    def since(self, total):
+        """(t, datos, total actual) con las muestras agregadas desde `total`.
+
+        Si el búfer ya pisó algunas, devuelve las que quedan.
+        """
+        t, data = self.latest(max(0, self.total - total))
+        return t, data, self.total
+
+
+def euler_to_quat(pitch, roll, yaw):
+    """Ángulos en grados (o arreglos) -> cuaterniones (..., 4) w, x, y, z.
+
+    Orden yaw (z), pitch (y), roll (x), como ComplementaryFilter.
+    """
+    p, r, y = (np.radians(np.asarray(a, dtype=float)) / 2 for a in (pitch, roll, yaw))
+    cp, sp, cr, sr, cy, sy = np.cos(p), np.sin(p), np.cos(r), np.sin(r), np.cos(y), np.sin(y)
+    return np.stack([cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy], axis=-1)
+
+
+def quat_to_euler(q):
+    """Cuaterniones (..., 4) -> (pitch, roll, yaw) en grados."""
+    w, x, y, z = np.moveaxis(np.asarray(q, dtype=float), -1, 0)
+    roll = np.degrees(np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y)))
+    pitch = np.degrees(np.arcsin(np.clip(2 * (w * y - z * x), -1.0, 1.0)))
+    yaw = np.degrees(np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z)))
+    return pitch, roll, yaw
+
+
+def slerp(q0, q1, f):
+    """Interpolación esférica entre cuaterniones (..., 4) con fracción f (...)."""
+    q0 = np.asarray(q0, dtype=float)
+    q1 = np.asarray(q1, dtype=float)
+    f = np.asarray(f, dtype=float)[..., None]
+    dot = (q0 * q1).sum(axis=-1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)         # por el camino corto
+    theta = np.arccos(np.clip(np.abs(dot), 0.0, 1.0))
+    sin_theta = np.sin(theta)
+    near = sin_theta < 1e-6                 # casi iguales: basta la interpolación lineal
+    safe = np.where(near, 1.0, sin_theta)
+    w0 = np.where(near, 1 - f, np.sin((1 - f) * theta) / safe)
+    w1 = np.where(near, f, np.sin(f * theta) / safe)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+class AttitudeHistory:
+    """Actitud reciente (cuaterniones con la hora del CanSat) para consultarla a cualquier hora.
+
+    `at(t)` ubica t entre dos muestras con np.searchsorted sobre las horas
+    (ordenadas) e interpola con slerp; fuera del rango devuelve la muestra
+    del extremo. Si el reloj vuelve atrás (reinicio del CanSat) se empieza
+    de nuevo.
+    """
+
+    def __init__(self, capacity=512):
+        self.buffer = SampleBuffer(4, capacity)
+        self.last_q = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
+        self.last_q = None
+
+    @property
+    def last_time(self):
+        return self.buffer.t[self.buffer.pos - 1] if len(self.buffer) else None
+
+    def add(self, t, pitch, roll, yaw):
+        if len(self.buffer) and t < self.last_time:
+            self.clear()
+        q = euler_to_quat(pitch, roll, yaw)
+        if self.last_q is not None and np.dot(q, self.last_q) < 0:
+            q = -q                          # mismo giro, signo continuo
+        self.last_q = q
+        self.buffer.append(t, q)
+
+    def at(self, t):
+        """Cuaterniones (..., 4) interpolados a las horas t (s), o None sin historia."""
+        times, quats = self.buffer.latest()
+        if not len(times):
+            return None
+        t = np.asarray(t, dtype=float)
+        i = np.clip(np.searchsorted(times, t), 1, max(1, len(times) - 1))
+        lo = i - 1
+        hi = np.minimum(i, len(times) - 1)
+        span = times[hi] - times[lo]
+        f = np.clip(np.where(span > 0, (t - times[lo]) / np.where(span > 0, span, 1.0), 0.0), 0.0, 1.0)
+        return slerp(quats[lo], quats[hi], f)
+
+    def euler_at(self, t=None):
+        """(pitch, roll, yaw) en grados interpolados a la hora t (la última si es None), o None."""
+        q = self.at(self.last_time if t is None else t)
+        return None if q is None else tuple(float(a) for a in quat_to_euler(q))
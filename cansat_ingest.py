@@ -0,0 +1,514 @@
+"""Ingesta de varios puertos serie en un solo hilo con asyncio.
+
+Cada puerto es una fuente (`SerialSource`) asociada a un stream: dos radios del
+mismo CanSat comparten stream y sus paquetes repetidos se descartan por número
+de secuencia (líneas IMU con 'SEQ:n;') o, en imágenes, por la secuencia de la
+línea previa más el CRC. Un segundo CanSat usa otro stream. La interfaz
+consume cada stream con `drain(stream)`; otros consumidores en el mismo hilo
+(p. ej. el broker) se registran en `listeners`.
+
+Un puerto también puede ser una URL de pyserial ('socket://127.0.0.1:5760'
+para leer del broker en lugar del CanSat).
+
+En POSIX los puertos se vigilan con `loop.add_reader` (el costo depende de los
+datos que llegan, no de cuántos puertos hay); en Windows los handles serie no
+sirven para select, así que una sola corrutina recorre todos los puertos.
+
+Si un puerto se cae (SerialException o fin de datos) se cierra y se reabre
+solo, con espera exponencial entre intentos (RECONNECT_MIN_S a
+RECONNECT_MAX_S). Un puerto USB se busca por VID/PID y número de serie, así
+que se encuentra aunque el sistema le cambie el nombre al volver. Al
+reabrirlo se entrega un paquete PKT_GAP con la duración del corte (la
+grabación lo guarda como REC_GAP). Abrir un puerto (y negociar la velocidad)
+bloquea, así que se hace en un hilo aparte y el resto de los puertos sigue
+leyéndose; con `start(background=True)` tampoco bloquea a quien arranca.
+
+Mientras una fuente negociada está fuera de BOOT_BAUD se le envía KA cada
+KEEPALIVE_S, y `stop()` le pide volver a BOOT_BAUD antes de cerrarla (ver
+cansat_link).
+"""
+import asyncio
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+
+import serial
+
+from cansat_protocol import (LinkGap, StreamDecoder, parse_device_time, parse_seq, PKT_GAP, PKT_IMU, PKT_IMAGE, PKT_REPEAT,
+                             PKT_THUMB)
+from cansat_link import (BOOT_BAUD, KEEPALIVE_S, find_port, format_command, negotiate_baud, open_port,
+                         port_identity, restore_baud)
+from cansat_stats import PerfStats
+
+DEFAULT_STREAM = 'cansat1'
+POLL_INTERVAL = 0.005   # s, solo para el modo por sondeo
+DEDUP_WINDOW = 1024     # secuencias recordadas por stream
+RESTART_SEQ = 64        # SEQ que retrocede más que esto: el CanSat se reinició
+RESTART_MS = 1000       # ídem con la hora T: del CanSat
+COUNTER_MOD = 1 << 32   # SEQ y T: son uint32 en el firmware y dan la vuelta
+RECONNECT_MIN_S = 0.25  # espera tras el primer intento fallido de reconexión
+RECONNECT_MAX_S = 5.0   # tope de la espera; un puerto que duró más se reintenta enseguida
+
+# Estado de una fuente (y de un stream, ver IngestEngine.state)
+STATE_CLOSED = 'cerrado'
+STATE_CONNECTING = 'conectando'
+STATE_OPEN = 'abierto'
+STATE_RECONNECTING = 'reconectando'
+STATE_FAILED = 'error'
+
+# Paquete entregado a la interfaz
+Packet = namedtuple('Packet', 'stream source kind seq t data')
+
+
+class SerialSource:
+    """Un puerto serie que alimenta un stream.
+
+    Con `target_baud` se negocia esa velocidad con el firmware al abrir;
+    `baudrate` queda con la velocidad final (0 en USB-CDC).
+    """
+
+    def __init__(self, port, stream=DEFAULT_STREAM, baudrate=115200, name=None, stats=None,
+                 target_baud=None):
+        self.port = port
+        self.stream = stream
+        self.baudrate = baudrate
+        self.target_baud = target_baud
+        self.name = name or port
+        self.serial = None
+        self.decoder = StreamDecoder(stats)
+        self.error = None
+        self.last_seq = None
+        # Identidad USB para reencontrar el puerto aunque cambie de nombre
+        self.identity = None
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.down_since = None      # hora local de la caída, hasta reconectar
+        self.backoff = 0.0
+        self.counters = {'bytes': 0, 'packets': 0, 'duplicates': 0, 'reconnects': 0}
+        # La interfaz y el hilo de ingesta escriben comandos: una línea no se mezcla con otra
+        self.write_lock = threading.Lock()
+
+    @property
+    def is_url(self):
+        return '://' in self.port
+
+    def open(self):
+        # timeout=0: las lecturas devuelven solo lo disponible
+        if self.is_url:
+            ser = serial.serial_for_url(self.port, self.baudrate or BOOT_BAUD, timeout=0)
+        else:
+            self.identity = port_identity(self.port) or self.identity
+            ser = open_port(self.port, self.baudrate or BOOT_BAUD, timeout=0)
+        if self.target_baud and not self.is_url:
+            # También al reconectar: el firmware reiniciado vuelve a BOOT_BAUD
+            try:
+                self.baudrate = negotiate_baud(ser, self.target_baud)
+                ser.reset_input_buffer()
+            except (serial.SerialException, OSError):
+                ser.close()
+                raise
+        self.decoder.reset()
+        self.error = None
+        self.opened_at = time.monotonic()
+        # Se publica ya negociado: send() no escribe en medio de la negociación
+        self.serial = ser
+
+    @property
+    def negotiated(self):
+        """True si el firmware quedó en una velocidad que hay que mantener (y luego deshacer)."""
+        return bool(self.target_baud) and not self.is_url and self.baudrate not in (0, BOOT_BAUD)
+
+    def restore_baud(self):
+        if self.is_open and self.negotiated:
+            try:
+                with self.write_lock:
+                    restore_baud(self.serial)
+            except (serial.SerialException, OSError):
+                pass
+
+    def close(self):
+        if self.serial:
+            try:
+                self.serial.close()
+            except serial.SerialException:
+                pass
+        self.serial = None
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    def relocate(self):
+        """Actualiza `port` al nombre actual del dispositivo USB; False si no está conectado."""
+        if self.identity is None:
+            return True
+        port = find_port(self.identity, prefer=self.port)
+        if port is None:
+            return False
+        self.port = port
+        return True
+
+    def read_available(self):
+        data = self.serial.read(self.serial.in_waiting or 1)
+        self.counters['bytes'] += len(data)
+        return data
+
+    def write(self, data):
+        if self.is_open:
+            with self.write_lock:
+                self.serial.write(data)
+
+
+def counter_delta(value, last):
+    """value - last para contadores uint32 del firmware: la vuelta de 2**32 a 0 es +1."""
+    return (value - last + COUNTER_MOD // 2) % COUNTER_MOD - COUNTER_MOD // 2
+
+
+class Deduplicator:
+    """Recuerda las últimas secuencias/CRC vistas en un stream.
+
+    Tras un reinicio del CanSat SEQ vuelve a 0: si SEQ o T: retroceden más
+    que RESTART_SEQ / RESTART_MS se olvida la ventana, si no las muestras
+    nuevas se descartarían como repetidas. La vuelta de los contadores
+    uint32 no es un reinicio. Una línea del CanSat de antes del reinicio
+    que llega tarde por la otra radio (is_stale) no mueve SEQ ni T:; si no,
+    la siguiente línea nueva parecería otro reinicio.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW):
+        self.order = deque()
+        self.seen = set()
+        self.window = window
+        self.last_seq = None
+        self.last_t = None
+        self.previous = None        # (SEQ, T:) al reiniciarse, durante `window` líneas
+        self.since_restart = 0
+
+    def is_stale(self, seq, t_dev):
+        """True si la línea IMU es del CanSat de antes del último reinicio."""
+        if self.previous is None:
+            return False
+        prev_seq, prev_t = self.previous
+        checks = []
+        if seq is not None and prev_seq is not None and self.last_seq is not None:
+            checks.append(counter_delta(seq, self.last_seq) > RESTART_SEQ
+                          and -self.window <= counter_delta(seq, prev_seq) <= 0)
+        if t_dev is not None and prev_t is not None and self.last_t is not None:
+            checks.append(counter_delta(t_dev, self.last_t) > RESTART_MS and counter_delta(t_dev, prev_t) <= 0)
+        return bool(checks) and all(checks)
+
+    def check_restart(self, seq, t_dev):
+        """Vacía la ventana si la línea IMU (seq, T: en ms) viene de un CanSat reiniciado."""
+        restarted = ((seq is not None and self.last_seq is not None
+                      and counter_delta(seq, self.last_seq) < -RESTART_SEQ)
+                     or (t_dev is not None and self.last_t is not None
+                         and counter_delta(t_dev, self.last_t) < -RESTART_MS))
+        if restarted:
+            self.order.clear()
+            self.seen.clear()
+            self.previous = (self.last_seq, self.last_t)
+            self.since_restart = 0
+        elif self.previous is not None:
+            self.since_restart += 1
+            if self.since_restart > self.window:
+                self.previous = None
+        if seq is not None and (restarted or self.last_seq is None or counter_delta(seq, self.last_seq) > 0):
+            self.last_seq = seq
+        if t_dev is not None and (restarted or self.last_t is None or counter_delta(t_dev, self.last_t) > 0):
+            self.last_t = t_dev
+        return restarted
+
+    def is_new(self, key):
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.order.append(key)
+        if len(self.order) > self.window:
+            self.seen.discard(self.order.popleft())
+        return True
+
+
+class IngestEngine:
+    """Lee N fuentes en un hilo con un event loop de asyncio."""
+
+    def __init__(self, stats=None, queue_size=4096):
+        self.stats = stats if stats is not None else PerfStats()
+        self.sources = []
+        # queue_size=0: sin colas, los paquetes solo van a `listeners`
+        self.queue_size = queue_size
+        self.queues = {}
+        # Funciones llamadas con cada Packet aceptado, en el hilo de ingesta
+        self.listeners = []
+        self.dedup = {}
+        self.loop = None
+        self.thread = None
+        self.running = False
+        self.readers = {}       # fuente -> fd vigilado con add_reader
+        self.polled = []        # fuentes sin select (Windows)
+        self.poll_task = None
+
+    # --------- Configuración ---------
+    def add_source(self, port, stream=DEFAULT_STREAM, baudrate=115200, name=None, target_baud=None):
+        source = SerialSource(port, stream, baudrate, name, self.stats, target_baud)
+        self.sources.append(source)
+        self.queues.setdefault(stream, deque(maxlen=self.queue_size))
+        self.dedup.setdefault(stream, Deduplicator())
+        return source
+
+    def streams(self):
+        return list(self.queues)
+
+    def sources_for(self, stream):
+        return [s for s in self.sources if s.stream == stream]
+
+    # --------- Ciclo de vida ---------
+    def start(self, background=False):
+        """Abre los puertos (lanza serial.SerialException si alguno falla) y arranca el hilo.
+
+        Con background=True los abre el hilo de ingesta y vuelve enseguida; el
+        resultado se ve en state() (una fuente que no abre queda en STATE_FAILED).
+        """
+        if not background:
+            try:
+                for source in self.sources:
+                    source.open()
+            except serial.SerialException:
+                for source in self.sources:
+                    source.close()
+                raise
+        for source in self.sources:
+            source.state = STATE_OPEN if source.is_open else STATE_CONNECTING
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='ingest', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.thread = None
+        for source in self.sources:
+            source.restore_baud()
+            source.close()
+            source.state = STATE_CLOSED
+        self.loop = None
+
+    def _run(self):
+        loop = self.loop
+        asyncio.set_event_loop(loop)
+        for source in self.sources:
+            if source.is_open:
+                self._watch(source)
+            else:
+                loop.create_task(self._connect(source))
+        loop.create_task(self._keepalive())
+        try:
+            loop.run_forever()
+        finally:
+            for fd in self.readers.values():
+                loop.remove_reader(fd)
+            self.readers.clear()
+            self.polled.clear()
+            self.poll_task = None
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _watch(self, source):
+        """Empieza a leer una fuente abierta (add_reader o sondeo)."""
+        try:
+            fd = source.serial.fileno()
+            self.loop.add_reader(fd, self._on_readable, source)
+            self.readers[source] = fd
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            self.polled.append(source)
+            if self.poll_task is None:
+                self.poll_task = self.loop.create_task(self._poll())
+        source.state = STATE_OPEN
+
+    async def _keepalive(self):
+        """Mantiene la velocidad negociada: sin comandos el firmware vuelve a BOOT_BAUD."""
+        command = format_command(KA=1)
+        while self.running:
+            await asyncio.sleep(KEEPALIVE_S)
+            for source in self.sources:
+                if source.is_open and source.negotiated:
+                    try:
+                        source.write(command)
+                    except (serial.SerialException, OSError) as e:
+                        self.stats.error(e)
+
+    async def _poll(self):
+        while self.running:
+            for source in list(self.polled):
+                try:
+                    waiting = source.serial.in_waiting
+                except (serial.SerialException, OSError) as e:
+                    self._source_failed(source, e)
+                    continue
+                if waiting:
+                    self._on_readable(source)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _on_readable(self, source):
+        try:
+            data = source.read_available()
+        except (serial.SerialException, OSError) as e:
+            self._source_failed(source, e)
+            return
+        if not data:
+            if source in self.readers:
+                # Listo para leer pero sin datos: el otro extremo cerró
+                self._source_failed(source, serial.SerialException('fin de datos'))
+            return
+        self.stats.count('bytes', len(data))
+        self._dispatch(source, source.decoder.feed(data))
+
+    def _source_failed(self, source, exc):
+        source.error = str(exc)
+        self.stats.error(exc)
+        fd = self.readers.pop(source, None)
+        if fd is not None:
+            self.loop.remove_reader(fd)
+        if source in self.polled:
+            self.polled.remove(source)
+        source.close()
+        self.stats.count('source_errors')
+        if not self.running:
+            return
+        # Un puerto que se cae apenas reabierto no se reintenta en ráfaga
+        if time.monotonic() - source.opened_at >= RECONNECT_MAX_S:
+            source.backoff = 0.0
+        else:
+            source.backoff = min(max(source.backoff * 2, RECONNECT_MIN_S), RECONNECT_MAX_S)
+        source.down_since = time.time()
+        source.state = STATE_RECONNECTING
+        self.loop.create_task(self._connect(source))
+
+    async def _connect(self, source):
+        """Abre la fuente en otro hilo; tras una caída reintenta hasta lograrlo."""
+        retry = source.down_since is not None
+        delay = source.backoff
+        while self.running:
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                await self.loop.run_in_executor(None, self._open_source, source)
+            except (serial.SerialException, OSError, ValueError) as e:
+                source.error = str(e)
+                if not retry:
+                    source.state = STATE_FAILED
+                    self.stats.error(e)
+                    return
+                delay = source.backoff = min(max(delay * 2, RECONNECT_MIN_S), RECONNECT_MAX_S)
+                continue
+            self._watch(source)
+            if retry:
+                gap = LinkGap(source.name, source.down_since, time.time())
+                source.down_since = None
+                source.counters['reconnects'] += 1
+                self.stats.count('reconnects')
+                self.stats.record('link_gap', int(max(0.0, gap.end - gap.start) * 1e9))
+                self._dispatch(source, [(PKT_GAP, gap)])
+            return
+
+    def _open_source(self, source):
+        """En un hilo del executor: busca el puerto por su identidad USB y lo abre."""
+        if not source.relocate():
+            raise serial.SerialException(f"{source.name}: dispositivo no conectado")
+        source.open()
+        if not self.running:
+            # stop() llegó mientras se abría: nadie más lo va a cerrar
+            source.close()
+            raise serial.SerialException('ingesta detenida')
+
+    def _dispatch(self, source, packets):
+        now = time.time()
+        queue = self.queues[source.stream]
+        dedup = self.dedup[source.stream]
+        redundant = len(self.sources_for(source.stream)) > 1
+        # Copia: otro hilo puede agregar o quitar listeners (p. ej. el broker)
+        listeners = tuple(self.listeners)
+        for kind, data in packets:
+            seq = None
+            if kind == PKT_IMU:
+                seq = parse_seq(data)
+                key = ('imu', seq) if seq is not None else None
+                source.last_seq = seq
+                if redundant:
+                    t_dev = parse_device_time(data)
+                    if dedup.is_stale(seq, t_dev):
+                        # Llegó tarde por la otra radio, de antes del reinicio del CanSat
+                        source.counters['duplicates'] += 1
+                        self.stats.count('stale_lines')
+                        continue
+                    if dedup.check_restart(seq, t_dev):
+                        self.stats.count('dedup_restarts')
+            elif kind == PKT_IMAGE or kind == PKT_THUMB:
+                # La imagen sigue a la línea IMU: dos imágenes iguales tras líneas
+                # distintas son cuadros distintos (escena estática)
+                key = (kind, source.last_seq, zlib.crc32(data))
+            elif kind == PKT_REPEAT:
+                key = (kind, data.frame_id, data.capture_ms)
+            else:
+                key = None
+            if redundant and key is not None and not dedup.is_new(key):
+                source.counters['duplicates'] += 1
+                self.stats.count('duplicates')
+                continue
+            if queue.maxlen and len(queue) == queue.maxlen:
+                self.stats.count('queue_drops')
+            packet = Packet(source.stream, source.name, kind, seq, now, data)
+            queue.append(packet)
+            source.counters['packets'] += 1
+            for listener in listeners:
+                listener(packet)
+
+    # --------- Consumo ---------
+    def drain(self, stream=DEFAULT_STREAM):
+        """Devuelve (y quita) todos los paquetes pendientes del stream."""
+        queue = self.queues.get(stream)
+        if not queue:
+            return []
+        packets = []
+        pop = queue.popleft
+        for _ in range(len(queue)):
+            packets.append(pop())
+        return packets
+
+    def state(self, stream=DEFAULT_STREAM):
+        """Estado del stream: abierto si alguna fuente lo está; si no, el de la que está más cerca."""
+        states = {s.state for s in self.sources_for(stream)}
+        for state in (STATE_OPEN, STATE_CONNECTING, STATE_RECONNECTING, STATE_FAILED):
+            if state in states:
+                return state
+        return STATE_CLOSED
+
+    def queue_depth(self, stream=DEFAULT_STREAM):
+        queue = self.queues.get(stream)
+        return len(queue) if queue is not None else 0
+
+    def send(self, stream, data):
+        """Escribe `data` en todas las fuentes abiertas del stream (canal tierra-aire)."""
+        for source in self.sources_for(stream):
+            try:
+                source.write(data)
+            except serial.SerialException as e:
+                self.stats.error(e)
+
+    def format_sources(self):
+        lines = [f"{'fuente':14s} {'stream':10s} {'baud':>8s} {'bytes':>10s} {'paquetes':>9s} {'duplic.':>8s} "
+                 f"{'reconex.':>8s}  estado"]
+        for s in self.sources:
+            state = s.state if s.state == STATE_OPEN or not s.error else f"{s.state}: {s.error}"
+            baud = s.baudrate or 'CDC'
+            lines.append(f"{s.name:14s} {s.stream:10s} {baud:>8} {s.counters['bytes']:10d} "
+                         f"{s.counters['packets']:9d} {s.counters['duplicates']:8d} "
+                         f"{s.counters['reconnects']:8d}  {state}")
+        return '\n'.join(lines)
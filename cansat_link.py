@@ -0,0 +1,501 @@
+"""Canal de comandos tierra-aire y control adaptativo del enlace de imagen.
+
+Comandos (una línea de texto, tierra -> CanSat):
+
+    CMD:Q=15;FS=QVGA;INT=200;
+
+    Q    calidad JPEG del sensor (4 = mejor ... 63 = peor)
+    FS   tamaño de cuadro (QQVGA, HQVGA, QVGA, CIF, VGA)
+    INT  intervalo mínimo entre imágenes en ms
+    BAUD velocidad del puerto USB (solo por USB; ver negotiate_baud)
+    TEST envía n tramas de prueba (ver run_link_test)
+    DELTA 1 = repetir/miniatura con la escena quieta, 0 = siempre JPEG completo
+    KA   mantiene la velocidad negociada (solo, no lleva ACK)
+
+El firmware responde con una línea 'ACK:Q=..;FS=..;INT=..;BAUD=..;' con los
+valores aplicados (también la envía al arrancar). BAUD=0 indica USB-CDC
+nativo, donde la velocidad en baudios no aplica. Fuera de BOOT_BAUD el
+firmware vuelve solo a BOOT_BAUD tras LINK_IDLE_S sin comandos por USB, así
+que la estación envía KA cada KEEPALIVE_S y al desconectarse pide BOOT_BAUD
+(ver restore_baud).
+
+Prueba de enlace desde la consola:
+
+    python cansat_link.py COM11 --baud 921600 --test 300
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+import serial
+import serial.tools.list_ports
+
+from cansat_protocol import (FRAG_HEADER, FRAGMENT_SIZE, FRAME_OVERHEAD, PKT_IMU, PKT_IMAGE, PKT_REPEAT,
+                             PKT_TEST, PKT_TEXT, PKT_THUMB, REPEAT_HEADER, TEST_HEADER, StreamDecoder,
+                             parse_device_time)
+
+# Tamaños de cuadro de menor a mayor (nombres de framesize_t sin 'FRAMESIZE_')
+FRAME_SIZES = ['QQVGA', 'HQVGA', 'QVGA', 'CIF', 'VGA']
+QUALITY_BEST = 10
+QUALITY_WORST = 40
+QUALITY_STEP = 5
+INTERVAL_MIN = 100
+INTERVAL_MAX = 2000
+INTERVAL_STEP = 100
+
+# Velocidad del enlace USB
+BOOT_BAUD = 115200          # el firmware arranca (y vuelve) a esta velocidad
+BAUD_RATES = [115200, 230400, 460800, 921600, 2000000]
+BAUD_CONFIRM_S = 2.0        # sin confirmación en este tiempo el firmware vuelve atrás
+LINK_IDLE_S = 5.0           # sin comandos en este tiempo el firmware vuelve a BOOT_BAUD
+KEEPALIVE_S = 1.0
+USB_CDC_VIDS = {0x303A}     # Espressif: ESP32-S2/S3 con USB nativo
+CDC_BYTES_PER_S = 1000000   # cota para el control adaptativo sobre USB-CDC
+SCAN_INTERVAL_S = 2.0       # enumeración de puertos en segundo plano
+
+# Presupuesto del enlace
+IMU_LINE_BYTES = 60         # 'ACC:..;GYRO:..;SEQ:n;T:ms;\r\n' con valores de 5-6 dígitos
+# Tamaño típico de un JPEG con calidad ~12 (medido en escenas de exterior)
+TYPICAL_JPEG_BYTES = {'QQVGA': 2500, 'HQVGA': 4000, 'QVGA': 8000, 'CIF': 13000, 'VGA': 25000}
+
+
+def format_command(**params):
+    """format_command(Q=15, FS='QVGA', INT=200) -> b'CMD:Q=15;FS=QVGA;INT=200;\\n'"""
+    body = ''.join(f"{key}={value};" for key, value in params.items())
+    return f"CMD:{body}\n".encode('ascii')
+
+
+def parse_ack(text):
+    """Devuelve el diccionario de una línea 'ACK:k=v;...' o None si no es un ACK."""
+    if not text.startswith('ACK:'):
+        return None
+    params = {}
+    for item in text[4:].split(';'):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            params[key.strip()] = value.strip()
+    return params
+
+
+class LinkController:
+    """Ajusta calidad, tamaño e intervalo de imagen según el enlace medido.
+
+    Mide bytes/s efectivos, la tasa de líneas IMU y la latencia de cada imagen:
+    desde su captura (hora del CanSat, llevada al reloj local con el menor
+    retardo visto en las líneas IMU) hasta que termina de llegar; sin hora de
+    captura se mide desde la línea IMU previa. Si la IMU
+    cae bajo el objetivo o la latencia lo supera, degrada la imagen en este
+    orden: calidad, tamaño, intervalo. Si hay holgura, mejora en orden inverso.
+    Tras cada cambio espera el ACK y un periodo completo antes de decidir otra vez.
+    """
+
+    def __init__(self, send, link_bytes_per_s=11520, target_imu_hz=40.0,
+                 target_latency=0.5, period=2.0):
+        self.send = send
+        self.link_bytes_per_s = link_bytes_per_s
+        self.target_imu_hz = target_imu_hz
+        self.target_latency = target_latency
+        self.period = period
+        self.enabled = True
+        # Estado conocido del firmware (se actualiza con cada ACK)
+        self.quality = 12
+        self.frame_size = 'QVGA'
+        self.interval = 100
+        self.delta = True
+        self.pending = None
+        # Medidas del periodo actual
+        self._bytes = 0
+        self._imu = 0
+        self._latencies = deque(maxlen=64)
+        self._last_imu_t = None
+        self._clock_offset = None   # hora local - hora del CanSat (s), mínimo visto
+        self._period_start = time.monotonic()
+        self._hold_until = 0.0
+        self._sent_at = 0.0
+        self.last_metrics = {}
+        self.last_action = None
+
+    def on_packet(self, kind, data, t):
+        """Registra un paquete recibido (t = hora de llegada)."""
+        if kind == PKT_IMU:
+            self._imu += 1
+            self._bytes += len(data) + 2
+            self._last_imu_t = t
+            t_dev = parse_device_time(data)
+            if t_dev is not None:
+                offset = t - t_dev / 1000.0
+                if self._clock_offset is None or offset < self._clock_offset:
+                    self._clock_offset = offset
+        elif kind in (PKT_IMAGE, PKT_THUMB, PKT_REPEAT):
+            self._bytes += (REPEAT_HEADER.size if kind == PKT_REPEAT else len(data)) + FRAME_OVERHEAD
+            capture_ms = getattr(data, 'capture_ms', None)
+            if capture_ms is not None and self._clock_offset is not None:
+                self._latencies.append(t - (capture_ms / 1000.0 + self._clock_offset))
+            elif self._last_imu_t is not None:
+                self._latencies.append(t - self._last_imu_t)
+        elif kind == PKT_TEXT:
+            self._bytes += len(data) + 2
+            ack = parse_ack(data)
+            if ack is not None:
+                self._apply_ack(ack)
+
+    def _apply_ack(self, ack):
+        if 'Q' in ack:
+            self.quality = int(ack['Q'])
+        if 'FS' in ack and ack['FS'] in FRAME_SIZES:
+            self.frame_size = ack['FS']
+        if 'INT' in ack:
+            self.interval = int(ack['INT'])
+        if 'DELTA' in ack:
+            self.delta = ack['DELTA'] == '1'
+        self.pending = None
+
+    def metrics(self, now=None):
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self._period_start, 1e-3)
+        latency = sorted(self._latencies)[len(self._latencies) // 2] if self._latencies else 0.0
+        bytes_per_s = self._bytes / elapsed
+        return {
+            'bytes_per_s': bytes_per_s,
+            'utilization': bytes_per_s / self.link_bytes_per_s,
+            'imu_hz': self._imu / elapsed,
+            'frame_latency_s': latency,
+        }
+
+    def tick(self, now=None):
+        """Llamar periódicamente; devuelve el comando enviado (dict) o None."""
+        now = time.monotonic() if now is None else now
+        if now - self._period_start < self.period:
+            return None
+        m = self.last_metrics = self.metrics(now)
+        self._bytes = 0
+        self._imu = 0
+        self._latencies.clear()
+        self._period_start = now
+        if self.pending is not None and now - self._sent_at > 2 * self.period:
+            # Un comando sin ACK después de dos periodos se da por perdido
+            self.pending = None
+        if not self.enabled or now < self._hold_until or self.pending is not None:
+            return None
+
+        starving = m['imu_hz'] < 0.9 * self.target_imu_hz or m['frame_latency_s'] > self.target_latency
+        headroom = (m['imu_hz'] >= self.target_imu_hz and m['utilization'] < 0.6
+                    and m['frame_latency_s'] < 0.5 * self.target_latency)
+        if starving:
+            change = self._degrade()
+        elif headroom:
+            change = self._improve()
+        else:
+            change = None
+        if change:
+            self.pending = change
+            self.last_action = change
+            self._sent_at = now
+            self._hold_until = now + self.period
+            self.send(format_command(**change))
+        return change
+
+    def _degrade(self):
+        if self.quality < QUALITY_WORST:
+            return {'Q': min(self.quality + QUALITY_STEP, QUALITY_WORST)}
+        idx = FRAME_SIZES.index(self.frame_size)
+        if idx > 0:
+            return {'FS': FRAME_SIZES[idx - 1]}
+        if self.interval < INTERVAL_MAX:
+            return {'INT': min(self.interval + INTERVAL_STEP, INTERVAL_MAX)}
+        return None
+
+    def _improve(self):
+        if self.interval > INTERVAL_MIN:
+            return {'INT': max(self.interval - INTERVAL_STEP, INTERVAL_MIN)}
+        idx = FRAME_SIZES.index(self.frame_size)
+        if idx < FRAME_SIZES.index('QVGA'):
+            return {'FS': FRAME_SIZES[idx + 1]}
+        if self.quality > QUALITY_BEST:
+            return {'Q': max(self.quality - QUALITY_STEP, QUALITY_BEST)}
+        return None
+
+    def describe(self):
+        m = self.last_metrics
+        text = f"Cámara: Q={self.quality} {self.frame_size} int={self.interval} ms"
+        if self.delta:
+            text += " (delta)"
+        if m:
+            text += (f"  |  enlace {m['bytes_per_s'] / 1024:.1f} KB/s ({m['utilization']:.0%})"
+                     f"  IMU {m['imu_hz']:.0f} Hz  latencia {m['frame_latency_s'] * 1000:.0f} ms")
+        return text
+
+
+# --------- Enumeración de puertos ---------
+# Identidad USB de un puerto: sobrevive a que el sistema le cambie el nombre al
+# reconectarlo (COM11 -> COM12, ttyUSB0 -> ttyUSB1). serial_number puede ser None.
+PortIdentity = namedtuple('PortIdentity', 'vid pid serial_number')
+
+
+def port_identity(port, ports=None):
+    """PortIdentity del puerto, o None si no es USB (o no aparece)."""
+    for info in serial.tools.list_ports.comports() if ports is None else ports:
+        if info.device == port and info.vid is not None:
+            return PortIdentity(info.vid, info.pid, info.serial_number)
+    return None
+
+
+def find_port(identity, prefer=None, ports=None):
+    """Nombre actual del puerto con esa identidad (si hay varios, `prefer`), o None."""
+    matches = [info.device for info in (serial.tools.list_ports.comports() if ports is None else ports)
+               if (info.vid, info.pid) == identity[:2]
+               and (identity.serial_number is None or info.serial_number == identity.serial_number)]
+    if prefer in matches:
+        return prefer
+    return matches[0] if matches else None
+
+
+class PortScanner:
+    """Enumera los puertos serie en un hilo para no trabar la interfaz.
+
+    `ports` es la última lista de nombres y `version` cambia cuando la lista
+    cambia; `scan_now()` adelanta la próxima enumeración.
+    """
+
+    def __init__(self, interval=SCAN_INTERVAL_S):
+        self.interval = interval
+        self.ports = []
+        self.version = 0
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='port-scan', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    def scan_now(self):
+        self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.clear()
+            try:
+                ports = sorted(info.device for info in serial.tools.list_ports.comports())
+            except OSError:
+                ports = self.ports
+            if ports != self.ports:
+                self.ports = ports
+                self.version += 1
+            self.wake.wait(self.interval)
+
+
+# --------- Negociación de velocidad y prueba de enlace ---------
+def is_usb_cdc(port):
+    """True si `port` es un USB-CDC nativo de Espressif (sin conversor UART)."""
+    for info in serial.tools.list_ports.comports():
+        if info.device == port:
+            return info.vid in USB_CDC_VIDS
+    return False
+
+
+def link_bytes_per_s(baud):
+    """Bytes/s teóricos de un enlace 8N1 (10 bits por byte); baud 0 = USB-CDC."""
+    return baud / 10 if baud else CDC_BYTES_PER_S
+
+
+def open_port(port, baudrate=BOOT_BAUD, timeout=0):
+    """Abre el puerto sin mover DTR/RTS, que reiniciarían la ESP32."""
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = baudrate
+    ser.timeout = timeout
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    return ser
+
+
+def _read(ser):
+    data = ser.read(ser.in_waiting or 1)
+    if not data and not ser.timeout:
+        time.sleep(0.005)
+    return data
+
+
+def _wait_ack(ser, timeout, key=None):
+    decoder = StreamDecoder()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for kind, text in decoder.feed(_read(ser)):
+            if kind == PKT_TEXT:
+                ack = parse_ack(text)
+                if ack is not None and (key is None or key in ack):
+                    return ack
+    return None
+
+
+def probe(ser, baud, timeout=0.5):
+    """Pone el puerto en `baud`, envía un comando vacío y devuelve el ACK o None."""
+    ser.baudrate = baud
+    ser.reset_input_buffer()
+    ser.write(format_command())
+    return _wait_ack(ser, timeout)
+
+
+def negotiate_baud(ser, target, timeout=0.5):
+    """Lleva el enlace USB del CanSat a `target` baudios; devuelve la velocidad final.
+
+    Primero busca la velocidad actual del firmware: `target` (una conexión
+    anterior cerrada hace menos de LINK_IDLE_S) y luego BOOT_BAUD, donde
+    vuelve solo pasado ese tiempo. Si no responde a BOOT_BAUD es una versión
+    sin comandos y no se prueba más. Luego pide BAUD=target; el firmware
+    responde a la velocidad vieja, cambia y espera cualquier comando a la
+    nueva: si no llega en BAUD_CONFIRM_S vuelve a la anterior. Devuelve 0 en
+    USB-CDC y la velocidad de arranque si el firmware no responde. `ser`
+    queda configurado en la velocidad devuelta.
+    """
+    if is_usb_cdc(ser.port):
+        return 0
+    current = None
+    ack = None
+    for baud in dict.fromkeys([target, BOOT_BAUD]):
+        ack = probe(ser, baud, timeout)
+        if ack is not None:
+            current = baud
+            break
+    if current is None:
+        ser.baudrate = BOOT_BAUD
+        return BOOT_BAUD
+    if ack.get('BAUD') == '0':
+        return 0
+    if current == target:
+        return target
+    ser.write(format_command(BAUD=target))
+    ack = _wait_ack(ser, timeout, 'BAUD')
+    if ack is None or ack['BAUD'] != str(target):
+        return current
+    ser.flush()
+    time.sleep(0.05)  # el firmware vacía su salida antes de cambiar
+    if probe(ser, target, timeout) is not None:
+        return target
+    # Sin confirmación: el firmware vuelve solo a la velocidad anterior
+    time.sleep(BAUD_CONFIRM_S)
+    ser.baudrate = current
+    return current
+
+
+def restore_baud(ser):
+    """Devuelve el firmware a BOOT_BAUD (al desconectarse) para los scripts simples."""
+    ser.write(format_command(BAUD=BOOT_BAUD))
+    ser.flush()
+
+
+def link_budget(bytes_per_s, imu_hz=50.0):
+    """Tasa IMU máxima y cuadros/s posibles por tamaño con `imu_hz` reservado."""
+    frag_overhead = 1 + (FRAME_OVERHEAD + FRAG_HEADER.size) / FRAGMENT_SIZE
+    video = max(bytes_per_s - imu_hz * IMU_LINE_BYTES, 0.0)
+    return {
+        'imu_hz_max': bytes_per_s / IMU_LINE_BYTES,
+        'imu_hz_reserved': imu_hz,
+        'video_fps': {fs: video / (size * frag_overhead) for fs, size in TYPICAL_JPEG_BYTES.items()},
+    }
+
+
+def run_link_test(ser, count=200, timeout=10.0, imu_hz=50.0):
+    """Pide `count` tramas de prueba y mide el enlace real.
+
+    Cuenta todos los bytes recibidos (las líneas IMU siguen llegando) entre el
+    primer y el último byte; las tramas perdidas salen de los huecos en el
+    contador de cada trama. Termina al recibir todas o tras 1 s sin datos.
+    """
+    decoder = StreamDecoder()
+    ser.reset_input_buffer()
+    ser.write(format_command(TEST=count))
+    seen = set()
+    nbytes = 0
+    first = last = None
+    deadline = time.monotonic() + timeout
+    while len(seen) < count:
+        now = time.monotonic()
+        if now > deadline or (last is not None and now - last > 1.0):
+            break
+        data = _read(ser)
+        if not data:
+            continue
+        now = time.monotonic()
+        if first is None:
+            first = now
+        last = now
+        nbytes += len(data)
+        for kind, payload in decoder.feed(data):
+            if kind == PKT_TEST:
+                seen.add(TEST_HEADER.unpack_from(payload)[0])
+    elapsed = (last - first) if first is not None and last > first else 0.0
+    bytes_per_s = nbytes / elapsed if elapsed else 0.0
+    lost = count - len(seen)
+    counters = decoder.stats.counters
+    result = {
+        'baud': ser.baudrate,
+        'bytes': nbytes,
+        'elapsed_s': elapsed,
+        'bytes_per_s': bytes_per_s,
+        'efficiency': bytes_per_s / link_bytes_per_s(ser.baudrate),
+        'frames_sent': count,
+        'frames_lost': lost,
+        'frame_error_rate': lost / count if count else 0.0,
+        'crc_errors': counters.get('crc_errors', 0),
+        'resync_bytes': counters.get('resync_bytes', 0),
+    }
+    # Solo cuenta lo que llegó bien para el presupuesto
+    result['budget'] = link_budget(bytes_per_s * (1 - result['frame_error_rate']), imu_hz)
+    return result
+
+
+def format_link_report(result):
+    b = result['budget']
+    lines = [
+        f"Velocidad: {result['baud'] or 'USB-CDC'} baud",
+        f"Sostenido: {result['bytes_per_s'] / 1024:.1f} KB/s ({result['efficiency']:.0%} del teórico)"
+        f" en {result['elapsed_s']:.1f} s",
+        f"Tramas perdidas: {result['frames_lost']}/{result['frames_sent']}"
+        f" ({result['frame_error_rate']:.2%})  errores CRC: {result['crc_errors']}"
+        f"  bytes descartados: {result['resync_bytes']}",
+        f"IMU máxima (solo IMU): {b['imu_hz_max']:.0f} Hz",
+        f"Video con IMU a {b['imu_hz_reserved']:.0f} Hz:",
+    ]
+    for fs, fps in b['video_fps'].items():
+        lines.append(f"  {fs:6s} {fps:6.1f} cuadros/s")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Negocia la velocidad del enlace y lo mide.')
+    parser.add_argument('port')
+    parser.add_argument('--baud', type=int, default=921600, help='velocidad pedida al CanSat')
+    parser.add_argument('--test', type=int, default=200, help='tramas de prueba (0 = solo negociar)')
+    parser.add_argument('--imu-hz', type=float, default=50.0, help='tasa IMU a reservar en el presupuesto')
+    parser.add_argument('--output', help='archivo JSON donde guardar el resultado')
+    args = parser.parse_args()
+
+    ser = open_port(args.port)
+    try:
+        baud = negotiate_baud(ser, args.baud)
+        print(f"Enlace en {baud or 'USB-CDC'} baud")
+        if args.test:
+            result = run_link_test(ser, args.test, imu_hz=args.imu_hz)
+            print(format_link_report(result))
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(result, f, indent=2)
+    finally:
+        ser.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""Mosaico del suelo con las imágenes del descenso de una grabación.
+
+Uso:
+    python cansat_mosaic.py grabaciones/cansat_20240101_120000.cnr -o mosaico.png
+    python cansat_mosaic.py vuelo.cnr --max-tilt 10 --ratio 0.7 --workers 4
+
+Se eligen las imágenes completas tomadas con la cámara casi vertical: la
+inclinación sale de la etiqueta de actitud de cada cuadro (REC_TAG) y, si la
+grabación tiene eventos de vuelo, solo se usan las del descenso (desde el
+apogeo o la apertura del paracaídas hasta el aterrizaje). Las imágenes sin
+etiqueta se descartan, salvo con --max-tilt 180.
+
+Cada imagen se describe con ORB y cada par de imágenes consecutivas se une
+con una homografía (knnMatch con prueba de razón y findHomography con
+RANSAC). Los dos pasos se reparten entre procesos con ProcessPoolExecutor.
+Los puntos y descriptores de cada cuadro se guardan en un caché junto a la
+grabación (clave: hash del JPEG y parámetros de ORB), así que volver a
+correr con otro --ratio, --min-inliers o --max-tilt no los recalcula.
+
+Si un par no se puede unir, la cadena se corta; se arma el tramo más largo.
+"""
+import argparse
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+
+from cansat_recorder import REC_EVENT, REC_IMAGE, REC_TAG, read_recording
+
+MAX_TILT_DEG = 15.0
+ORB_FEATURES = 1000
+RATIO = 0.75
+MIN_INLIERS = 25
+RANSAC_PX = 4.0
+MAX_CANVAS = 8000       # px por lado; un mosaico más grande se reduce
+DESCENT_START = ('apogee', 'deploy')
+
+# jpeg: bytes; capture_ms: hora de captura; tilt: grados respecto de la vertical (None sin etiqueta)
+Frame = namedtuple('Frame', 'capture_ms jpeg tilt')
+
+
+def tilt_deg(pitch, roll):
+    """Ángulo entre el eje z del CanSat y la vertical."""
+    return float(np.degrees(np.arccos(np.clip(np.cos(np.radians(pitch)) * np.cos(np.radians(roll)), -1, 1))))
+
+
+def load_frames(recording):
+    """Imágenes completas de la grabación con su inclinación y la ventana del descenso (s o None)."""
+    images = []
+    tags = {}
+    start = end = None
+    for rec in read_recording(recording):
+        if rec.kind == REC_IMAGE and rec.data.capture_ms is not None:
+            images.append(rec.data)
+        elif rec.kind == REC_TAG:
+            tags[rec.data.capture_ms] = tilt_deg(rec.data.pitch, rec.data.roll)
+        elif rec.kind == REC_EVENT:
+            if rec.data.name in DESCENT_START and start is None:
+                start = rec.data.t
+            elif rec.data.name == 'landed':
+                end = rec.data.t
+    frames = [Frame(img.capture_ms, bytes(img), tags.get(img.capture_ms)) for img in images]
+    return frames, (start, end)
+
+
+def select_frames(frames, window=(None, None), max_tilt=MAX_TILT_DEG):
+    start, end = window
+    selected = []
+    for frame in frames:
+        t = frame.capture_ms / 1000.0
+        if (start is not None and t < start) or (end is not None and t > end):
+            continue
+        if max_tilt < 180 and (frame.tilt is None or frame.tilt > max_tilt):
+            continue
+        selected.append(frame)
+    return selected
+
+
+# --------- Trabajo de cada proceso ---------
+def _cache_path(cache_dir, jpeg, features):
+    digest = hashlib.sha1(jpeg).hexdigest()[:20]
+    return os.path.join(cache_dir, f'{digest}_orb{features}.npz')
+
+
+def extract_features(jpeg, features=ORB_FEATURES, cache_dir=None):
+    """(puntos (n, 2) float32, descriptores (n, 32) uint8) de un JPEG, usando el caché."""
+    path = _cache_path(cache_dir, jpeg, features) if cache_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as cached:
+            return cached['points'], cached['descriptors']
+    gray = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_GRAYSCALE)
+    points = np.zeros((0, 2), np.float32)
+    descriptors = np.zeros((0, 32), np.uint8)
+    if gray is not None:
+        keypoints, desc = cv2.ORB_create(features).detectAndCompute(gray, None)
+        if desc is not None:
+            points = np.float32([kp.pt for kp in keypoints])
+            descriptors = desc
+    if path:
+        # Se escribe aparte y se renombra: otro proceso nunca lee un archivo a medias
+        tmp = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, points=points, descriptors=descriptors)
+        os.replace(tmp, path)
+    return points, descriptors
+
+
+def match_pair(a, b, ratio=RATIO, min_inliers=MIN_INLIERS):
+    """Homografía 3x3 que lleva la imagen b a la a, o None si no alcanzan los inliers."""
+    (pa, da), (pb, db) = a, b
+    if len(da) < 2 or len(db) < 2:
+        return None
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(db, da, k=2)
+    good = [m[0] for m in matches if len(m) == 2 and m[0].distance < ratio * m[1].distance]
+    if len(good) < min_inliers:
+        return None
+    src = pb[[m.queryIdx for m in good]]
+    dst = pa[[m.trainIdx for m in good]]
+    H, mask = cv2.findHomography(src, dst, cv2.RANSAC, RANSAC_PX)
+    if H is None or int(mask.sum()) < min_inliers:
+        return None
+    return H
+
+
+def _features_job(args):
+    return extract_features(*args)
+
+
+def _match_job(args):
+    return match_pair(*args)
+
+
+# --------- Armado ---------
+def chain_segments(homographies):
+    """Tramos [i, j] de cuadros unidos sin cortes (homographies[k] une k+1 con k)."""
+    segments = []
+    start = 0
+    for k, H in enumerate(homographies):
+        if H is None:
+            segments.append((start, k))
+            start = k + 1
+    segments.append((start, len(homographies)))
+    return segments
+
+
+def compose(images, homographies, max_canvas=MAX_CANVAS):
+    """Mosaico RGB: cada imagen se lleva al plano de la primera y se promedia."""
+    transforms = [np.eye(3)]
+    for H in homographies:
+        transforms.append(transforms[-1] @ H)
+    corners = []
+    for img, T in zip(images, transforms):
+        h, w = img.shape[:2]
+        quad = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+        corners.append(cv2.perspectiveTransform(quad, T).reshape(-1, 2))
+    corners = np.concatenate(corners)
+    x0, y0 = np.floor(corners.min(axis=0))
+    x1, y1 = np.ceil(corners.max(axis=0))
+    scale = min(1.0, max_canvas / max(x1 - x0, y1 - y0))
+    offset = np.array([[scale, 0, -x0 * scale], [0, scale, -y0 * scale], [0, 0, 1]])
+    size = (int((x1 - x0) * scale) + 1, int((y1 - y0) * scale) + 1)
+    total = np.zeros((size[1], size[0], 3), np.float32)
+    weight = np.zeros((size[1], size[0]), np.float32)
+    for img, T in zip(images, transforms):
+        M = offset @ T
+        total += cv2.warpPerspective(img.astype(np.float32), M, size)
+        weight += cv2.warpPerspective(np.ones(img.shape[:2], np.float32), M, size)
+    mosaic = total / np.maximum(weight, 1e-6)[..., None]
+    mosaic[weight == 0] = 0
+    return mosaic.astype(np.uint8)
+
+
+def build_mosaic(frames, features=ORB_FEATURES, ratio=RATIO, min_inliers=MIN_INLIERS,
+                 cache_dir=None, workers=None):
+    """Mosaico del tramo unido más largo; devuelve (imagen BGR o None, info)."""
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    with ProcessPoolExecutor(workers) as pool:
+        feats = list(pool.map(_features_job, [(f.jpeg, features, cache_dir) for f in frames]))
+        pairs = [(feats[k], feats[k + 1], ratio, min_inliers) for k in range(len(frames) - 1)]
+        homographies = list(pool.map(_match_job, pairs))
+    segments = chain_segments(homographies)
+    first, last = max(segments, key=lambda s: s[1] - s[0])
+    info = {'frames': len(frames), 'segments': len(segments), 'used': last - first + 1,
+            'first_ms': frames[first].capture_ms if frames else None}
+    if last - first < 1:
+        return None, info
+    images = [cv2.imdecode(np.frombuffer(f.jpeg, np.uint8), cv2.IMREAD_COLOR) for f in frames[first:last + 1]]
+    return compose(images, homographies[first:last]), info
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mosaico del suelo con las imágenes del descenso.')
+    parser.add_argument('recording')
+    parser.add_argument('-o', '--output', help='imagen de salida (por defecto, junto a la grabación)')
+    parser.add_argument('--max-tilt', type=float, default=MAX_TILT_DEG,
+                        help='inclinación máxima respecto de la vertical (grados; 180 = todas)')
+    parser.add_argument('--all-phases', action='store_true', help='no limitar al descenso')
+    parser.add_argument('--step', type=int, default=1, help='usar una de cada N imágenes elegidas')
+    parser.add_argument('--features', type=int, default=ORB_FEATURES, help='puntos ORB por imagen')
+    parser.add_argument('--ratio', type=float, default=RATIO, help='prueba de razón de Lowe')
+    parser.add_argument('--min-inliers', type=int, default=MIN_INLIERS)
+    parser.add_argument('--workers', type=int, help='procesos (por defecto, uno por núcleo)')
+    parser.add_argument('--no-cache', action='store_true', help='no leer ni guardar puntos ORB')
+    args = parser.parse_args()
+
+    base = os.path.splitext(args.recording)[0]
+    output = args.output or base + '_mosaico.png'
+    frames, window = load_frames(args.recording)
+    frames = select_frames(frames, (None, None) if args.all_phases else window, args.max_tilt)[::args.step]
+    print(f"{args.recording}: {len(frames)} imágenes elegidas")
+    if len(frames) < 2:
+        parser.error("hacen falta al menos dos imágenes (probar --max-tilt o --all-phases)")
+    mosaic, info = build_mosaic(frames, args.features, args.ratio, args.min_inliers,
+                                None if args.no_cache else base + '_orb', args.workers)
+    if mosaic is None:
+        print("No se pudo unir ningún par de imágenes")
+        return 1
+    cv2.imwrite(output, mosaic)
+    print(f"{output}: {info['used']} de {info['frames']} imágenes ({info['segments']} tramos), "
+          f"{mosaic.shape[1]}x{mosaic.shape[0]}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,491 @@
+"""Modo multiproceso: ingesta -> decodificación -> interfaz.
+
+Con hilos, el GIL hace que la decodificación JPEG, NumPy y matplotlib
+compitan con la lectura serie. En este modo cada etapa es un proceso:
+
+- Ingesta: IngestEngine, grabación y control adaptativo del enlace. Pasa los
+  paquetes del stream mostrado, en lotes, a la decodificación por una
+  multiprocessing.Queue (son bytes chicos; el costo está en lo que sigue).
+- Decodificación: FrameReconstructor, decode_imu_lines y, si se pide, el
+  video estabilizado por roll (RollStabilizer). Publica cuadros RGB
+  en un FrameRing, el JPEG original de la última imagen completa en otro
+  (para guardarla) y lotes IMU (hora, g y °/s) en un BatchRing, todos en
+  multiprocessing.shared_memory; los textos van por otra cola y las
+  etiquetas de actitud de cada cuadro vuelven a la ingesta para grabarlas.
+- Interfaz: lee los anillos con vistas NumPy sin copiar y sigue haciendo el
+  filtro de actitud, la fase de vuelo y el dibujo.
+
+Los anillos tienen ranuras de tamaño fijo con número de secuencia. Para el
+video gana el último cuadro: el lector fija (pin) la ranura que muestra y el
+escritor nunca la pisa, así la vista sigue siendo válida mientras se pinta.
+Los lotes IMU se leen en orden; si el lector se atrasa más de lo que cabe en
+el anillo se cuentan como perdidos.
+
+La interfaz crea y libera la memoria compartida; `stop()` (desde
+disconnect_serial) avisa a los procesos, espera que terminen y recién
+entonces cierra los anillos.
+"""
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import serial
+
+from cansat_imu import PHYSICAL_SCALE, AttitudeHistory, ComplementaryFilter, decode_imu_lines
+from cansat_ingest import DEFAULT_STREAM, STATE_CONNECTING, STATE_FAILED, STATE_OPEN, IngestEngine
+from cansat_link import BOOT_BAUD, LinkController, link_bytes_per_s
+from cansat_protocol import MAX_IMAGE, PKT_GAP, PKT_IMU, PKT_TEXT, VIDEO_PACKETS, sample_time
+from cansat_recorder import Recorder, new_recording_path
+from cansat_stats import PerfStats
+from cansat_video import FrameReconstructor, FrameTagger, RollStabilizer
+
+FRAME_SLOTS = 3                     # mínimo para que gane el último sin pisar al lector
+MAX_FRAME_SHAPE = (1200, 1600, 3)   # UXGA, la mayor resolución de la ESP32-CAM
+JPEG_SHAPE = (MAX_IMAGE, 1)         # JPEG original como columna de bytes
+IMU_SLOTS = 64
+IMU_BATCH = 256                     # muestras por ranura (un lote más grande se parte)
+IMU_COLUMNS = 7                     # hora (s) y ax, ay, az (g), gx, gy, gz (°/s)
+BATCH_INTERVAL = 0.01               # s entre envíos de la ingesta a la decodificación
+STATUS_INTERVAL = 1.0
+START_TIMEOUT = 10.0                # s para abrir puertos y negociar velocidad
+JOIN_TIMEOUT = 2.0
+
+# spawn en todas las plataformas: no se hereda el estado de Qt por fork
+_mp = mp.get_context('spawn')
+
+# Cabecera del anillo (int64): secuencia y ranura del último escrito, ranura
+# fijada por el lector, y tamaño de pantalla y estabilización pedidos por el lector
+HEAD_SEQ, HEAD_SLOT, PINNED, WANT_W, WANT_H, WANT_STABLE, HEADER_FIELDS = range(7)
+# Metadatos por ranura (int64): secuencia (-1 mientras se escribe), forma y sello
+SLOT_SEQ, SLOT_ROWS, SLOT_COLS, SLOT_CH, SLOT_STAMP, META_FIELDS = range(6)
+NO_STAMP = -1
+
+
+class ShmRing:
+    """Ranuras de tamaño fijo en un bloque de memoria compartida.
+
+    El proceso que lo crea (name=None) es su dueño y lo libera con unlink();
+    los demás se conectan con ShmRing.attach(*ring.spec).
+    """
+
+    def __init__(self, slots, slot_shape, dtype, name=None):
+        self.slots = slots
+        self.slot_shape = tuple(slot_shape)
+        self.dtype = np.dtype(dtype)
+        slot_bytes = int(np.prod(self.slot_shape)) * self.dtype.itemsize
+        header_bytes = 8 * (HEADER_FIELDS + slots * META_FIELDS)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        buf = self.shm.buf
+        self.header = np.ndarray(HEADER_FIELDS, np.int64, buf)
+        self.meta = np.ndarray((slots, META_FIELDS), np.int64, buf, 8 * HEADER_FIELDS)
+        # Cada ranura es contigua: un arreglo más chico que el máximo ocupa el comienzo
+        self.data = np.ndarray((slots, int(np.prod(self.slot_shape))), self.dtype, buf, header_bytes)
+        if self.owner:
+            self.header[:] = 0
+            self.header[HEAD_SLOT] = self.header[PINNED] = -1
+            self.meta[:, SLOT_SEQ] = -1
+        self.last_read = 0          # del lector: última secuencia leída
+
+    @property
+    def spec(self):
+        return (self.slots, self.slot_shape, self.dtype.str, self.shm.name)
+
+    @classmethod
+    def attach(cls, slots, slot_shape, dtype, name):
+        return cls(slots, slot_shape, dtype, name)
+
+    @property
+    def head(self):
+        return int(self.header[HEAD_SEQ])
+
+    def _slot_view(self, slot):
+        rows, cols, ch = (int(n) for n in self.meta[slot, SLOT_ROWS:SLOT_CH + 1])
+        if len(self.slot_shape) == 3:
+            return self.data[slot, :rows * cols * ch].reshape(rows, cols, ch)
+        return self.data[slot, :rows * cols].reshape(rows, cols)
+
+    def _write(self, slot, array, stamp):
+        """Copia `array` a la ranura y la publica como la más nueva."""
+        seq = self.head + 1
+        meta = self.meta[slot]
+        meta[SLOT_SEQ] = -1
+        rows, cols = array.shape[:2]
+        ch = array.shape[2] if array.ndim == 3 else 1
+        self.data[slot, :array.size] = array.reshape(-1)
+        meta[SLOT_ROWS:SLOT_STAMP + 1] = (rows, cols, ch, stamp)
+        meta[SLOT_SEQ] = seq
+        self.header[HEAD_SLOT] = slot
+        self.header[HEAD_SEQ] = seq
+        return seq
+
+    def close(self):
+        # Las vistas deben soltarse antes de cerrar el bloque
+        self.header = self.meta = self.data = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameRing(ShmRing):
+    """Cuadros RGB uint8; el lector siempre toma el último (los viejos se saltan)."""
+
+    def __init__(self, slots=FRAME_SLOTS, slot_shape=MAX_FRAME_SHAPE, dtype=np.uint8, name=None):
+        super().__init__(slots, slot_shape, dtype, name)
+
+    def fits(self, frame):
+        return all(n <= m for n, m in zip(frame.shape, self.slot_shape))
+
+    def put(self, frame, stamp=NO_STAMP):
+        """Escribe un cuadro en una ranura que no sea la última ni la fijada por el lector."""
+        head_slot = int(self.header[HEAD_SLOT])
+        while True:
+            busy = (head_slot, int(self.header[PINNED]))
+            slot = (head_slot + 1) % self.slots
+            while slot in busy:
+                slot = (slot + 1) % self.slots
+            # Se marca la ranura como ocupada y recién entonces se mira el pin:
+            # si el lector la fijó en el medio, se deja intacta y se elige otra
+            old = self.meta[slot, SLOT_SEQ]
+            self.meta[slot, SLOT_SEQ] = -1
+            if self.header[PINNED] != slot:
+                return self._write(slot, frame, stamp)
+            self.meta[slot, SLOT_SEQ] = old
+
+    def latest(self):
+        """(seq, vista RGB, sello) del cuadro más nuevo si hay uno sin leer, o None.
+
+        La vista sigue válida hasta la próxima llamada que devuelva otro cuadro.
+        """
+        while True:
+            seq = self.head
+            if seq == self.last_read:
+                return None
+            slot = int(self.header[HEAD_SLOT])
+            self.header[PINNED] = slot
+            # El escritor pudo haber empezado a pisar esa ranura antes del pin
+            if self.meta[slot, SLOT_SEQ] >= seq:
+                break
+        self.last_read = int(self.meta[slot, SLOT_SEQ])
+        return self.last_read, self._slot_view(slot), int(self.meta[slot, SLOT_STAMP])
+
+    def request_size(self, width, height):
+        """Tamaño del panel, para que el decodificador reduzca al decodificar."""
+        self.header[WANT_W] = width
+        self.header[WANT_H] = height
+
+    def request_stabilized(self, enabled):
+        self.header[WANT_STABLE] = int(enabled)
+
+    def stabilized(self):
+        return bool(self.header[WANT_STABLE])
+
+    def requested_size(self):
+        w, h = int(self.header[WANT_W]), int(self.header[WANT_H])
+        return (w, h) if w > 0 and h > 0 else None
+
+
+class BatchRing(ShmRing):
+    """Lotes de filas float64 (p. ej. muestras IMU) leídos en orden."""
+
+    def __init__(self, slots=IMU_SLOTS, slot_shape=(IMU_BATCH, IMU_COLUMNS), dtype=np.float64, name=None):
+        super().__init__(slots, slot_shape, dtype, name)
+        self.lost = 0
+
+    def put(self, rows):
+        for start in range(0, len(rows), self.slot_shape[0]):
+            self._write((self.head + 1) % self.slots, rows[start:start + self.slot_shape[0]], NO_STAMP)
+
+    def get_all(self):
+        """Copia de todas las filas nuevas concatenadas (n, columnas)."""
+        head = self.head
+        first = max(self.last_read + 1, head - self.slots + 1)
+        self.lost += first - (self.last_read + 1)
+        chunks = []
+        for seq in range(first, head + 1):
+            slot = seq % self.slots
+            chunk = self._slot_view(slot).copy()
+            if self.meta[slot, SLOT_SEQ] != seq:
+                self.lost += 1      # se pisó mientras se copiaba
+                continue
+            chunks.append(chunk)
+        self.last_read = head
+        if not chunks:
+            return np.zeros((0, self.slot_shape[1]))
+        return np.concatenate(chunks)
+
+
+# --------- Procesos ---------
+def _ingest_main(ports, target_baud, stream, adaptive, control, packets_out, ui_out, stop):
+    """Proceso de ingesta: puertos, grabación, control del enlace y reenvío de lotes."""
+    engine = IngestEngine(PerfStats())
+    try:
+        source = engine.add_source(ports[0][0], ports[0][1], BOOT_BAUD, target_baud=target_baud)
+        for port, port_stream in ports[1:]:
+            engine.add_source(port, port_stream, BOOT_BAUD)
+        engine.start()
+    except (serial.SerialException, OSError, ValueError) as e:
+        ui_out.put(('error', str(e)))
+        packets_out.put(None)
+        return
+    link = LinkController(lambda cmd: engine.send(stream, cmd),
+                          link_bytes_per_s=link_bytes_per_s(source.baudrate))
+    link.enabled = adaptive
+    try:
+        recorder = Recorder(new_recording_path(), engine.stats)
+    except OSError as e:
+        recorder = None
+        ui_out.put(('text', 'recorder', f"No se pudo crear la grabación: {e}"))
+    ui_out.put(('connected', source.baudrate, engine.streams(), recorder.path if recorder else None))
+    next_status = time.monotonic()
+    try:
+        while not stop.is_set():
+            try:
+                while True:
+                    command = control.get_nowait()
+                    if command[0] == 'stream':
+                        stream = command[1]
+                    elif command[0] == 'adaptive':
+                        link.enabled = command[1]
+                    elif command[0] == 'event' and recorder is not None:
+                        recorder.add_event(command[1], command[2])
+                    elif command[0] == 'tag' and recorder is not None:
+                        recorder.add_tag(command[1], time.time())
+            except queue.Empty:
+                pass
+            batch = []
+            for packet in engine.drain(stream):
+                if packet.kind == PKT_GAP:
+                    # Reconectado: la velocidad pudo cambiar al renegociar
+                    link.link_bytes_per_s = link_bytes_per_s(source.baudrate)
+                link.on_packet(packet.kind, packet.data, packet.t)
+                if recorder is not None:
+                    recorder.add(packet.kind, packet.data, packet.t)
+                batch.append((packet.source, packet.kind, packet.t, packet.data))
+            if batch:
+                packets_out.put(batch)
+            link.tick()
+            now = time.monotonic()
+            if now >= next_status:
+                next_status = now + STATUS_INTERVAL
+                ui_out.put(('status', engine.format_sources(), link.describe(), engine.state(stream),
+                            source.baudrate))
+            time.sleep(BATCH_INTERVAL)
+    finally:
+        engine.stop()
+        if recorder is not None:
+            recorder.close()
+        packets_out.put(None)   # fin para la decodificación
+        # Sin lector, lo que quede en las colas no debe trabar la salida del proceso
+        packets_out.cancel_join_thread()
+        ui_out.cancel_join_thread()
+
+
+def _decode_main(packets_in, ui_out, control, frame_spec, jpeg_spec, imu_spec, stop):
+    """Proceso de decodificación: JPEG -> FrameRing, líneas IMU -> BatchRing y
+    etiquetas de actitud de cada cuadro -> cola de control de la ingesta."""
+    frames = FrameRing.attach(*frame_spec)
+    jpegs = FrameRing.attach(*jpeg_spec)
+    imu = BatchRing.attach(*imu_spec)
+    video = FrameReconstructor()
+    attitude = ComplementaryFilter()
+    history = AttitudeHistory()
+    tagger = FrameTagger()
+    stabilizer = RollStabilizer()
+    last_t = None
+    published_jpeg = None
+    try:
+        while not stop.is_set():
+            try:
+                batch = packets_in.get(timeout=0.1)
+            except queue.Empty:
+                batch = ()      # sin paquetes igual se miran el panel y las etiquetas vencidas
+            if batch is None:
+                break
+            lines = []
+            arrival = []
+            new_video = False
+            for source, kind, t, data in batch:
+                if kind == PKT_IMU:
+                    lines.append(data)
+                    arrival.append(t)
+                elif kind in VIDEO_PACKETS:
+                    video.add(kind, data)
+                    new_video = True
+                    capture_ms = getattr(data, 'capture_ms', None)
+                    if capture_ms is not None:
+                        tagger.add(capture_ms, t)
+                elif kind == PKT_TEXT:
+                    ui_out.put(('text', source, data))
+                elif kind == PKT_GAP:
+                    ui_out.put(('gap', data))
+            if lines:
+                raw, valid = decode_imu_lines(lines)
+                rows = np.empty((int(valid.sum()), IMU_COLUMNS))
+                rows[:, 0] = [sample_time(line, t) for line, t, ok in zip(lines, arrival, valid) if ok]
+                rows[:, 1:] = raw[valid] * PHYSICAL_SCALE
+                imu.put(rows)
+                # Actitud propia para etiquetar y estabilizar sin esperar a la interfaz
+                for row in rows.tolist():
+                    dt = row[0] - last_t if last_t is not None else 0.0
+                    last_t = row[0]
+                    history.add(row[0], *attitude.update(*row[1:], dt if 0 <= dt <= 1.0 else 0.0))
+            # Las etiquetas van a la ingesta, que es la que graba
+            for tag in tagger.resolve(history, time.time()):
+                control.put(('tag', tag))
+            display_size = frames.requested_size()
+            if new_video or display_size != video.display_size:
+                # Solo se decodifica lo último del lote, al tamaño del panel (de
+                # nuevo si el panel creció y la imagen reducida ya no alcanza)
+                video.display_size = display_size
+                img = video.render()
+                if img is not None and frames.stabilized():
+                    capture_ms = video.capture_ms
+                    angles = history.euler_at(capture_ms / 1000.0 if capture_ms is not None else None)
+                    img = stabilizer.apply(img, angles[1] if angles is not None else 0.0)
+                if img is not None and frames.fits(img):
+                    frames.put(img, video.capture_ms if video.capture_ms is not None else NO_STAMP)
+                # JPEG de la imagen completa ya decodificada, tal como llegó, para guardarla
+                if video.full_jpeg is not published_jpeg and video.full_rgb is not None:
+                    published_jpeg = video.full_jpeg
+                    jpeg = np.frombuffer(published_jpeg, np.uint8).reshape(-1, 1)
+                    if jpegs.fits(jpeg):
+                        jpegs.put(jpeg)
+    finally:
+        frames.close()
+        jpegs.close()
+        imu.close()
+        ui_out.cancel_join_thread()
+        control.cancel_join_thread()
+
+
+class ProcessPipeline:
+    """Arranca y detiene los procesos de ingesta y decodificación desde la interfaz."""
+
+    def __init__(self, ports, target_baud=None, stream=DEFAULT_STREAM, adaptive=True):
+        self.ports = ports          # [(puerto, stream), ...]; el primero negocia target_baud
+        self.target_baud = target_baud
+        self.stream = stream
+        self.adaptive = adaptive
+        self.frames = None
+        self.jpegs = None           # JPEG original de la última imagen completa
+        self.jpeg = None            # copia del último leído de jpegs
+        self.imu = None
+        self.processes = []
+        self.pending = []           # mensajes que llegaron antes de 'connected'
+        self.baudrate = None
+        self.streams = list(dict.fromkeys(port_stream for _, port_stream in ports))
+        self.recording_path = None
+        self.sources_text = ''
+        self.link_text = ''
+        self.link_state = None      # estado del stream mostrado (STATE_* de cansat_ingest)
+        self.error = None           # por qué no abrió la ingesta (con STATE_FAILED)
+        self.start_deadline = None
+
+    def start(self, background=False):
+        """Crea los anillos y los procesos; lanza serial.SerialException si la ingesta no abre.
+
+        Con background=True vuelve enseguida, como IngestEngine.start: los
+        puertos se abren en el proceso de ingesta y el resultado se ve en
+        link_state al llamar a messages() (STATE_FAILED y `error` si no abrió).
+        """
+        self.frames = FrameRing()
+        self.jpegs = FrameRing(slot_shape=JPEG_SHAPE)
+        self.imu = BatchRing()
+        self.stop_event = _mp.Event()
+        self.control = _mp.Queue()
+        self.packets = _mp.Queue()
+        self.ui_queue = _mp.Queue()
+        self.processes = [
+            _mp.Process(target=_ingest_main, name='cansat-ingest', daemon=True,
+                       args=(self.ports, self.target_baud, self.stream, self.adaptive,
+                             self.control, self.packets, self.ui_queue, self.stop_event)),
+            _mp.Process(target=_decode_main, name='cansat-decode', daemon=True,
+                       args=(self.packets, self.ui_queue, self.control, self.frames.spec, self.jpegs.spec,
+                             self.imu.spec, self.stop_event)),
+        ]
+        for process in self.processes:
+            process.start()
+        self.link_state = STATE_CONNECTING
+        self.start_deadline = time.monotonic() + START_TIMEOUT
+        if background:
+            return
+        while self.link_state == STATE_CONNECTING:
+            try:
+                message = self.ui_queue.get(timeout=max(0.0, self.start_deadline - time.monotonic()))
+            except queue.Empty:
+                message = ('error', 'la ingesta no respondió')
+            if not self._start_message(message):
+                self.pending.append(message)
+        if self.link_state == STATE_FAILED:
+            self.stop()
+            raise serial.SerialException(self.error)
+
+    def _start_message(self, message):
+        """Procesa 'connected' o 'error' de la ingesta; devuelve False para los demás mensajes."""
+        if message[0] == 'connected':
+            _, self.baudrate, self.streams, self.recording_path = message
+            self.link_state = STATE_OPEN
+        elif message[0] == 'error':
+            self.error = message[1]
+            self.link_state = STATE_FAILED
+        else:
+            return False
+        return True
+
+    def stop(self):
+        """Avisa a los procesos, espera que terminen y libera la memoria compartida."""
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join(JOIN_TIMEOUT)
+        self.processes = []
+        for q in (self.control, self.packets, self.ui_queue):
+            q.cancel_join_thread()
+            q.close()
+        for ring in (self.frames, self.jpegs, self.imu):
+            ring.close()
+        self.frames = self.jpegs = self.imu = None
+
+    def last_jpeg(self):
+        """Bytes de la última imagen completa tal como llegó, o None."""
+        latest = self.jpegs.latest()
+        if latest is not None:
+            self.jpeg = latest[1].tobytes()
+        return self.jpeg
+
+    def select_stream(self, stream):
+        self.stream = stream
+        self.control.put(('stream', stream))
+
+    def set_adaptive(self, enabled):
+        self.control.put(('adaptive', enabled))
+
+    def add_event(self, event, t):
+        self.control.put(('event', event, t))
+
+    def messages(self):
+        """Mensajes pendientes de los procesos: ('text', fuente, línea) o ('gap', LinkGap); los de estado se guardan."""
+        out, self.pending = self.pending, []
+        while True:
+            try:
+                message = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'status':
+                _, self.sources_text, self.link_text, self.link_state, self.baudrate = message
+            elif not self._start_message(message):
+                out.append(message)
+        if self.link_state == STATE_CONNECTING and time.monotonic() > self.start_deadline:
+            self._start_message(('error', 'la ingesta no respondió'))
+        return out
@@ -0,0 +1,408 @@
+"""Protocolo serie del CanSat: líneas de IMU en texto y tramas binarias.
+
+Formato de trama (todo big endian):
+
+    0xAA 0x55 | tipo (1) | longitud (2) | datos (longitud) | CRC32 (4)
+
+El CRC32 (el mismo de zlib) cubre tipo, longitud y datos. Entre tramas el
+firmware envía líneas de texto terminadas en '\\n'
+("ACC:x,y,z;GYRO:x,y,z;SEQ:n;T:ms;" o mensajes de error).
+
+Las imágenes pueden llegar completas (FRAME_JPEG) o en fragmentos
+(FRAME_JPEG_FRAG) intercalados con líneas IMU; los fragmentos empiezan con
+FRAG_HEADER: id de imagen, tamaño total, posición y hora de captura (ms).
+Las tramas FRAME_TEST solo se usan en la prueba de enlace (contador de 4
+bytes y relleno, FRAGMENT_SIZE en total).
+
+Con la escena quieta el firmware no repite el JPEG completo: envía
+FRAME_REPEAT (id de la última imagen completa y hora de captura) o
+FRAME_THUMB (hora de captura y un JPEG a 1/4 de resolución).
+"""
+import struct
+from collections import namedtuple
+import time
+import zlib
+
+from cansat_stats import PerfStats
+
+FRAME_MAGIC = b'\xAA\x55'
+FRAME_HEADER = struct.Struct('>2sBH')   # magic, tipo, longitud
+FRAME_CRC = struct.Struct('>I')
+FRAME_OVERHEAD = FRAME_HEADER.size + FRAME_CRC.size
+
+# Tipos de trama
+FRAME_JPEG = 0x01
+FRAME_JPEG_FRAG = 0x02
+FRAME_TEST = 0x03
+FRAME_REPEAT = 0x04
+FRAME_THUMB = 0x05
+FRAME_TYPES = {FRAME_JPEG, FRAME_JPEG_FRAG, FRAME_TEST, FRAME_REPEAT, FRAME_THUMB}
+
+FRAG_HEADER = struct.Struct('>HIII')    # id, tamaño total, posición, hora de captura
+TEST_HEADER = struct.Struct('>I')       # contador de la trama de prueba
+REPEAT_HEADER = struct.Struct('>HI')    # id de la imagen repetida, hora de captura
+THUMB_HEADER = struct.Struct('>I')      # hora de captura
+MAX_IMAGE = 512 * 1024                  # una VGA JPEG cabe con margen
+FRAGMENT_SIZE = 1024                    # bytes de JPEG por fragmento, igual que en el firmware
+
+# Longitud máxima de los datos por tipo de trama
+MAX_PAYLOAD = 60000     # una QVGA JPEG ronda 4-15 KB; más que esto es basura
+MAX_FRAGMENT = FRAG_HEADER.size + FRAGMENT_SIZE
+MAX_TEST = FRAGMENT_SIZE
+MAX_THUMB = 16 * 1024   # miniatura de hasta 160x120
+MAX_LINE = 256          # una línea ACC/GYRO ocupa ~45 bytes
+
+# Una cabecera que espera sus datos se abandona si ya debería haber llegado
+# a la velocidad mínima del enlace (115200 baudios) con este margen, o si
+# en los bytes retenidos ya hay una línea IMU completa (el firmware nunca
+# intercala líneas dentro de una trama).
+MIN_LINK_BYTES_PER_S = 11520
+PENDING_MARGIN_S = 0.25
+
+JPEG_SOI = b'\xFF\xD8'
+JPEG_EOI = b'\xFF\xD9'
+
+# Tipos de paquete devueltos por StreamDecoder.feed()
+PKT_IMU = 'imu'
+PKT_TEXT = 'text'
+PKT_IMAGE = 'image'
+PKT_TEST = 'test'
+PKT_REPEAT = 'repeat'
+PKT_THUMB = 'thumb'
+VIDEO_PACKETS = (PKT_IMAGE, PKT_REPEAT, PKT_THUMB)
+# No viene del aire: la ingesta lo agrega al reabrir un puerto que se cayó
+PKT_GAP = 'gap'
+
+# Datos de un paquete PKT_REPEAT
+FrameRef = namedtuple('FrameRef', 'frame_id capture_ms')
+# Datos de un paquete PKT_GAP: puerto y horas locales (s) de la caída y la reconexión
+LinkGap = namedtuple('LinkGap', 'source start end')
+
+
+def parse_imu_line(line):
+    """Convierte 'ACC:x,y,z;GYRO:x,y,z;' en seis valores crudos del sensor."""
+    acc = line.split('ACC:')[1].split(';')[0]
+    gyro = line.split('GYRO:')[1].split(';')[0]
+    ax, ay, az = [float(x) for x in acc.split(',')]
+    gx, gy, gz = [float(x) for x in gyro.split(',')]
+    return ax, ay, az, gx, gy, gz
+
+
+def _int_field(line, key):
+    start = line.find(key)
+    if start < 0:
+        return None
+    end = line.find(';', start + len(key))
+    try:
+        return int(line[start + len(key):end if end >= 0 else len(line)])
+    except ValueError:
+        return None
+
+
+def parse_seq(line):
+    """Número de secuencia de una línea IMU ('...;SEQ:n;') o None si no lo trae."""
+    return _int_field(line, 'SEQ:')
+
+
+def parse_device_time(line):
+    """Hora de muestreo en ms del CanSat ('...;T:ms;') o None si no la trae."""
+    return _int_field(line, ';T:')
+
+
+def sample_time(line, arrival):
+    """Hora de la muestra en s: la del CanSat si la trae, si no la de llegada."""
+    t_dev = _int_field(line, ';T:')
+    return t_dev / 1000.0 if t_dev is not None else arrival
+
+
+def build_frame(payload, frame_type=FRAME_JPEG):
+    """Arma una trama como la envía el firmware (útil para pruebas y benchmarks)."""
+    header = FRAME_HEADER.pack(FRAME_MAGIC, frame_type, len(payload))
+    crc = zlib.crc32(header[2:])
+    crc = zlib.crc32(payload, crc)
+    return header + payload + FRAME_CRC.pack(crc)
+
+
+def build_fragments(image, frame_id, chunk=FRAGMENT_SIZE, capture_ms=0):
+    """Parte una imagen en tramas FRAME_JPEG_FRAG como el firmware unificado."""
+    return [build_frame(FRAG_HEADER.pack(frame_id, len(image), offset, capture_ms)
+                        + image[offset:offset + chunk], FRAME_JPEG_FRAG)
+            for offset in range(0, len(image), chunk)]
+
+
+def build_repeat(frame_id, capture_ms=0):
+    return build_frame(REPEAT_HEADER.pack(frame_id, capture_ms), FRAME_REPEAT)
+
+
+def build_thumb(jpeg, capture_ms=0):
+    return build_frame(THUMB_HEADER.pack(capture_ms) + jpeg, FRAME_THUMB)
+
+
+def is_valid_jpeg(data):
+    """Verificación barata: el JPEG empieza con SOI y termina con EOI."""
+    return data[:2] == JPEG_SOI and data[-2:] == JPEG_EOI
+
+
+class JpegImage(bytes):
+    """Bytes de un JPEG con la hora de captura (ms) y el id del firmware si se conocen."""
+    capture_ms = None
+    frame_id = None
+
+
+class FrameAssembler:
+    """Reensambla imágenes fragmentadas.
+
+    Se admite una sola imagen en curso: si llega un fragmento de otra imagen
+    la anterior se descarta (se perdió algún fragmento). La imagen se
+    completa cuando cada byte llegó al menos una vez; un fragmento repetido
+    no suma. Contadores: fragments, duplicate_fragments, incomplete_frames,
+    bad_fragments.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.frame_id = None
+        self.data = None
+        self.covered = None     # un byte por byte de la imagen: 1 si ya llegó
+        self.received = 0       # bytes distintos recibidos
+        self.capture_ms = None
+
+    def add(self, payload):
+        """Agrega un fragmento; devuelve los bytes de la imagen cuando está completa."""
+        if len(payload) <= FRAG_HEADER.size:
+            self.stats.count('bad_fragments')
+            return None
+        frame_id, total, offset, capture_ms = FRAG_HEADER.unpack_from(payload)
+        chunk = memoryview(payload)[FRAG_HEADER.size:]
+        if total > MAX_IMAGE or offset + len(chunk) > total:
+            self.stats.count('bad_fragments')
+            return None
+        if frame_id != self.frame_id or self.data is None or len(self.data) != total:
+            if self.data is not None:
+                self.stats.count('incomplete_frames')
+            self.frame_id = frame_id
+            self.data = bytearray(total)
+            self.covered = bytearray(total)
+            self.received = 0
+            self.capture_ms = capture_ms
+        end = offset + len(chunk)
+        new = self.covered.count(0, offset, end)
+        if not new:
+            self.stats.count('duplicate_fragments')
+            return None
+        self.data[offset:end] = chunk
+        self.covered[offset:end] = b'\x01' * len(chunk)
+        self.received += new
+        self.stats.count('fragments')
+        if self.received < total:
+            return None
+        data = JpegImage(self.data)
+        data.capture_ms = self.capture_ms
+        data.frame_id = self.frame_id
+        self.data = None
+        self.covered = None
+        self.frame_id = None
+        return data
+
+
+class StreamDecoder:
+    """Separa el flujo serie en líneas de texto y tramas validadas.
+
+    Se alimenta con lo que haya llegado (`feed(data)`) y nunca bloquea: una
+    trama incompleta queda en el búfer hasta la siguiente llamada. Ante una
+    cabecera imposible o un CRC incorrecto se busca el siguiente 0xAA 0x55 en
+    el búfer con `find` en lugar de leer byte a byte; entre líneas de texto
+    se recuerda su posición para no volver a recorrer el búfer por cada
+    línea (un lote grande sería cuadrático). Una cabecera falsa que
+    pasa las verificaciones no retiene el flujo más de lo que tardaría su
+    trama (ver MIN_LINK_BYTES_PER_S): se abandona y las líneas retenidas
+    detrás de ella salen en la misma llamada.
+
+    Contadores en `stats`: frames_ok, repeat_frames, thumb_frames, crc_errors,
+    bad_jpeg, bad_header, stale_headers, resyncs, resync_bytes, garbage_lines.
+    """
+
+    def __init__(self, stats=None):
+        self.buf = bytearray()
+        self.stats = stats if stats is not None else PerfStats()
+        self.assembler = FrameAssembler(self.stats)
+        self._pending_deadline = None   # hora límite de la cabecera en buf[0]
+        self._pending_scan = 0          # hasta dónde se buscaron líneas retenidas
+
+    def reset(self):
+        self.buf.clear()
+        self.assembler = FrameAssembler(self.stats)
+        self._pending_deadline = None
+
+    def _discard(self, n):
+        del self.buf[:n]
+        self._pending_deadline = None
+        self.stats.count('resyncs')
+        self.stats.count('resync_bytes', n)
+
+    def feed(self, data):
+        """Agrega bytes y devuelve la lista de paquetes completos (tipo, datos)."""
+        buf = self.buf
+        buf += data
+        packets = []
+        stats = self.stats
+        magic = None    # posición del próximo FRAME_MAGIC (-1: no hay); None: buscarla
+        while buf:
+            if buf.startswith(FRAME_MAGIC):
+                magic = None
+                if len(buf) < FRAME_HEADER.size:
+                    break
+                _, frame_type, length = FRAME_HEADER.unpack_from(buf)
+                if not self._plausible_header(frame_type, length):
+                    stats.count('bad_header')
+                    self._discard(1)
+                    continue
+                total = FRAME_HEADER.size + length + FRAME_CRC.size
+                if len(buf) < total:
+                    if self._stale_header(length):
+                        # Se reintenta desde el byte siguiente: salen las líneas retenidas
+                        stats.count('stale_headers')
+                        self._discard(1)
+                        continue
+                    break
+                with memoryview(buf) as view:
+                    crc = zlib.crc32(view[2:FRAME_HEADER.size + length])
+                if crc != FRAME_CRC.unpack_from(buf, total - FRAME_CRC.size)[0]:
+                    # Puede ser un 0xAA 0x55 dentro de otros datos: buscar el siguiente
+                    stats.count('crc_errors')
+                    self._discard(1)
+                    continue
+                payload = bytes(buf[FRAME_HEADER.size:FRAME_HEADER.size + length])
+                del buf[:total]
+                self._pending_deadline = None
+                packet = self._frame_packet(frame_type, payload)
+                if packet is not None:
+                    packets.append(packet)
+                continue
+
+            if magic is None:
+                magic = buf.find(FRAME_MAGIC)
+            newline = buf.find(b'\n', 0, magic if magic >= 0 else len(buf))
+            if newline >= 0:
+                line = bytes(buf[:newline])
+                del buf[:newline + 1]
+                if magic >= 0:
+                    magic -= newline + 1
+                packet = self._line_packet(line)
+                if packet is not None:
+                    packets.append(packet)
+            elif magic > 0:
+                # Bytes sueltos antes de una trama: basura por pérdida de sincronía
+                self._discard(magic)
+            else:
+                # Sin fin de línea ni trama todavía; conserva el último byte por
+                # si es el 0xAA de una cabecera partida
+                if len(buf) > MAX_LINE:
+                    self._discard(len(buf) - 1)
+                break
+        return packets
+
+    def _stale_header(self, length):
+        """True si la cabecera en buf[0] esperó de más o retiene una línea IMU completa."""
+        now = time.monotonic()
+        if self._pending_deadline is None:
+            self._pending_deadline = now + PENDING_MARGIN_S + length / MIN_LINK_BYTES_PER_S
+            self._pending_scan = FRAME_HEADER.size
+        if now > self._pending_deadline:
+            return True
+        buf = self.buf
+        start = buf.find(b'\nACC:', self._pending_scan)
+        if start < 0:
+            self._pending_scan = max(self._pending_scan, len(buf) - 4)
+            return False
+        self._pending_scan = start
+        return buf.find(b'\n', start + 1, start + 1 + MAX_LINE) >= 0
+
+    def _plausible_header(self, frame_type, length):
+        """Descarta pronto las cabeceras falsas para no esperar datos que no vendrán."""
+        if frame_type not in FRAME_TYPES or length > MAX_PAYLOAD:
+            return False
+        if frame_type == FRAME_JPEG_FRAG and not FRAG_HEADER.size < length <= MAX_FRAGMENT:
+            return False
+        if frame_type == FRAME_REPEAT and length != REPEAT_HEADER.size:
+            return False
+        if frame_type == FRAME_TEST and not TEST_HEADER.size <= length <= MAX_TEST:
+            return False
+        if frame_type == FRAME_THUMB and not THUMB_HEADER.size + 4 <= length <= MAX_THUMB:
+            return False
+        if frame_type == FRAME_JPEG:
+            start = FRAME_HEADER.size
+            head = self.buf[start:start + 2]
+            if len(head) == 2 and (length < 4 or head != JPEG_SOI):
+                return False
+        return True
+
+    def _line_packet(self, line):
+        # Tras perder sincronía la basura queda pegada al inicio de la línea
+        start = line.rfind(b'ACC:')
+        if start > 0:
+            self.stats.count('resync_bytes', start)
+            line = line[start:]
+        try:
+            text = line.decode('ascii').strip()
+        except UnicodeDecodeError:
+            self.stats.count('garbage_lines')
+            return None
+        if not text:
+            return None
+        if not text.isprintable():
+            self.stats.count('garbage_lines')
+            return None
+        if text.startswith('ACC:'):
+            return PKT_IMU, text
+        return PKT_TEXT, text
+
+    def _frame_packet(self, frame_type, payload):
+        if frame_type == FRAME_JPEG_FRAG:
+            payload = self.assembler.add(payload)
+            if payload is None:
+                return None
+            frame_type = FRAME_JPEG
+        if frame_type == FRAME_JPEG:
+            if not is_valid_jpeg(payload):
+                self.stats.count('bad_jpeg')
+                return None
+            self.stats.count('frames_ok')
+            if not isinstance(payload, JpegImage):
+                payload = JpegImage(payload)
+            return PKT_IMAGE, payload
+        if frame_type == FRAME_REPEAT:
+            self.stats.count('repeat_frames')
+            return PKT_REPEAT, FrameRef(*REPEAT_HEADER.unpack(payload))
+        if frame_type == FRAME_THUMB:
+            thumb = JpegImage(payload[THUMB_HEADER.size:])
+            if not is_valid_jpeg(thumb):
+                self.stats.count('bad_jpeg')
+                return None
+            thumb.capture_ms = THUMB_HEADER.unpack_from(payload)[0]
+            self.stats.count('thumb_frames')
+            return PKT_THUMB, thumb
+        if frame_type == FRAME_TEST:
+            return PKT_TEST, payload
+        self.stats.count('unknown_frames')
+        return None
+
+
+class SerialPacketReader:
+    """Lector bloqueante sobre un puerto serie para los scripts simples."""
+
+    def __init__(self, ser, decoder=None):
+        self.ser = ser
+        self.decoder = decoder if decoder is not None else StreamDecoder()
+        self.pending = []
+
+    def read_packet(self, timeout=2.0):
+        """Devuelve el siguiente paquete (tipo, datos) o None si vence el tiempo."""
+        deadline = time.monotonic() + timeout
+        while not self.pending:
+            if time.monotonic() > deadline:
+                return None
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if data:
+                self.pending.extend(self.decoder.feed(data))
+        return self.pending.pop(0)
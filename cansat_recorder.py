@@ -0,0 +1,139 @@
+"""Grabación de la sesión en un archivo binario de solo agregar.
+
+Formato: REC_MAGIC y luego registros
+
+    tipo (1) | hora local (8, float64 s) | longitud (4) | datos
+
+Tipos: REC_IMU y REC_TEXT (línea ASCII), REC_IMAGE y REC_THUMB (hora de
+captura en ms, 4 bytes, y el JPEG), REC_REPEAT (REPEAT_HEADER), REC_EVENT
+(evento de vuelo: hora de la muestra, 8 bytes, y 'evento,fase' en ASCII),
+REC_TAG (actitud de un cuadro a su hora de captura, FRAME_TAG; se asocia a
+la imagen por esa hora y llega después de ella) y REC_GAP (caída del
+enlace: horas locales de la caída y la reconexión, GAP_TIMES, y el puerto;
+se graba al reconectar, justo antes de los primeros datos nuevos). Una
+repetición no copia el JPEG: quien lee usa la última REC_IMAGE. La lectura
+es secuencial y en memoria constante.
+"""
+import os
+import struct
+import time
+from collections import namedtuple
+
+from cansat_flight import FlightEvent
+from cansat_protocol import (FrameRef, JpegImage, LinkGap, PKT_GAP, PKT_IMAGE, PKT_IMU, PKT_REPEAT,
+                             PKT_TEXT, PKT_THUMB, REPEAT_HEADER)
+from cansat_stats import PerfStats
+from cansat_video import FrameTag
+
+REC_MAGIC = b'CANSATREC1\n'
+REC_HEADER = struct.Struct('>BdI')  # tipo, hora local, longitud
+CAPTURE = struct.Struct('>I')
+NO_CAPTURE = 0xFFFFFFFF
+EVENT_TIME = struct.Struct('>d')
+FRAME_TAG = struct.Struct('>I7d')  # capture_ms, cuaternión y pitch/roll/yaw
+GAP_TIMES = struct.Struct('>dd')   # caída y reconexión (hora local)
+
+REC_IMU = 1
+REC_TEXT = 2
+REC_IMAGE = 3
+REC_REPEAT = 4
+REC_THUMB = 5
+REC_EVENT = 6
+REC_TAG = 7
+REC_GAP = 8
+
+RECORDINGS_DIR = 'grabaciones'
+
+# data: str (IMU/texto), JpegImage (imagen/miniatura), FrameRef (repetición)
+# FlightEvent (evento de vuelo), FrameTag (actitud de un cuadro) o LinkGap (caída del enlace)
+Record = namedtuple('Record', 'kind t data')
+
+
+def new_recording_path(directory=RECORDINGS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime('cansat_%Y%m%d_%H%M%S.cnr'))
+
+
+class Recorder:
+    """Escribe los paquetes recibidos en un archivo de grabación."""
+
+    def __init__(self, path, stats=None):
+        self.path = path
+        self.stats = stats if stats is not None else PerfStats()
+        self.file = open(path, 'wb', buffering=1 << 16)
+        self.file.write(REC_MAGIC)
+
+    def write(self, kind, t, payload):
+        self.file.write(REC_HEADER.pack(kind, t, len(payload)))
+        self.file.write(payload)
+        self.stats.count('rec_bytes', REC_HEADER.size + len(payload))
+
+    def add(self, kind, data, t):
+        """Graba un paquete de StreamDecoder (los demás tipos se ignoran)."""
+        if kind == PKT_IMU:
+            self.write(REC_IMU, t, data.encode('ascii'))
+        elif kind == PKT_TEXT:
+            self.write(REC_TEXT, t, data.encode('ascii'))
+        elif kind == PKT_IMAGE or kind == PKT_THUMB:
+            capture_ms = getattr(data, 'capture_ms', None)
+            head = CAPTURE.pack(NO_CAPTURE if capture_ms is None else capture_ms)
+            self.write(REC_IMAGE if kind == PKT_IMAGE else REC_THUMB, t, head + data)
+        elif kind == PKT_REPEAT:
+            self.write(REC_REPEAT, t, REPEAT_HEADER.pack(data.frame_id, data.capture_ms))
+        elif kind == PKT_GAP:
+            self.write(REC_GAP, t, GAP_TIMES.pack(data.start, data.end) + data.source.encode('utf-8'))
+
+    def add_event(self, event, t):
+        """Graba un FlightEvent de cansat_flight."""
+        name = f"{event.name},{event.phase}".encode('ascii')
+        self.write(REC_EVENT, t, EVENT_TIME.pack(event.t) + name)
+
+    def add_tag(self, tag, t):
+        """Graba un FrameTag de cansat_video."""
+        self.write(REC_TAG, t, FRAME_TAG.pack(*tag))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def _jpeg(payload):
+    capture_ms = CAPTURE.unpack_from(payload)[0]
+    image = JpegImage(payload[CAPTURE.size:])
+    image.capture_ms = None if capture_ms == NO_CAPTURE else capture_ms
+    return image
+
+
+def read_recording(path):
+    """Genera los registros (Record) de una grabación; ignora un final truncado."""
+    with open(path, 'rb') as f:
+        if f.read(len(REC_MAGIC)) != REC_MAGIC:
+            raise ValueError(f"{path} no es una grabación de CanSat")
+        while True:
+            head = f.read(REC_HEADER.size)
+            if len(head) < REC_HEADER.size:
+                return
+            kind, t, length = REC_HEADER.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if kind in (REC_IMU, REC_TEXT):
+                data = payload.decode('ascii', errors='replace')
+            elif kind in (REC_IMAGE, REC_THUMB):
+                data = _jpeg(payload)
+            elif kind == REC_REPEAT:
+                data = FrameRef(*REPEAT_HEADER.unpack(payload))
+            elif kind == REC_EVENT:
+                name, phase = payload[EVENT_TIME.size:].decode('ascii').split(',')
+                data = FlightEvent(EVENT_TIME.unpack_from(payload)[0], name, phase)
+            elif kind == REC_TAG:
+                data = FrameTag(*FRAME_TAG.unpack(payload))
+            elif kind == REC_GAP:
+                data = LinkGap(payload[GAP_TIMES.size:].decode('utf-8', errors='replace'),
+                               *GAP_TIMES.unpack_from(payload))
+            else:
+                data = payload
+            yield Record(kind, t, data)
@@ -0,0 +1,76 @@
+"""Planificador de dibujo de la estación terrena.
+
+Los datos nuevos solo marcan paneles como sucios (`mark`). Un QTimer a la
+tasa objetivo llama una vez por cuadro al dibujo de cada panel sucio, en el
+orden en que se registraron. Así el costo de render queda acotado por los
+cuadros/s y no por cuántas líneas IMU o imágenes lleguen entre cuadro y
+cuadro. Cada panel decide al dibujar si está visible; al cambiar de pestaña
+o restaurar la ventana se marcan todos (`mark_all`).
+"""
+from time import perf_counter_ns
+
+from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtGui import QGuiApplication
+
+from cansat_stats import PerfStats
+
+DEFAULT_FPS = 30
+
+
+def screen_fps():
+    """Tasa de refresco de la pantalla principal (60 si no se conoce)."""
+    screen = QGuiApplication.primaryScreen()
+    rate = screen.refreshRate() if screen is not None else 0
+    return rate if rate >= 1 else 60
+
+
+class RenderScheduler:
+    """Repinta cada panel sucio a lo sumo una vez por cuadro."""
+
+    def __init__(self, fps=DEFAULT_FPS, stats=None):
+        self.stats = stats if stats is not None else PerfStats()
+        self.panels = {}        # nombre -> función de dibujo
+        self.dirty = set()
+        self.fps = None
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.set_fps(fps)
+
+    def add(self, name, draw):
+        self.panels[name] = draw
+
+    def mark(self, *names):
+        self.dirty.update(names)
+
+    def mark_all(self):
+        self.dirty.update(self.panels)
+
+    def set_fps(self, fps):
+        """Cambia la tasa objetivo; nunca más rápido que la pantalla."""
+        self.fps = min(fps, screen_fps())
+        self.timer.setInterval(max(1, round(1000 / self.fps)))
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def tick(self):
+        """Un cuadro: dibuja los paneles sucios."""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        t0 = perf_counter_ns()
+        for name, draw in self.panels.items():
+            if name in dirty:
+                try:
+                    with self.stats.span(name):
+                        draw()
+                except Exception as e:
+                    # Un panel con error no debe tirar la aplicación ni a los demás
+                    self.stats.error(e)
+                    print(f"Error al dibujar {name}:", e)
+        self.stats.record('frame', perf_counter_ns() - t0)
+        self.stats.count('render_frames')
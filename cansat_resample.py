@@ -0,0 +1,121 @@
+"""Remuestreo a tasa uniforme de un flujo IMU irregular, por lotes.
+
+Las horas llegan con jitter (hora de llegada a tierra) y con huecos (líneas
+perdidas, la interfaz trabada), pero la FFT, los filtros y la exportación
+suponen una tasa fija. UniformResampler lleva cada lote a una grilla de
+`rate` Hz con interpolación lineal o cúbica (Hermite con pendientes por
+diferencias finitas) en una sola pasada vectorizada. Las últimas muestras
+de cada lote quedan guardadas para continuar la grilla en el siguiente, así
+que el resultado no depende de cómo se corten los lotes: la cúbica solo
+interpola un tramo cuando ya tiene las muestras de ambos lados de sus dos
+extremos (pendientes centradas), así que emite una muestra más tarde.
+
+Un intervalo entre muestras mayor que `max_gap` es un hueco: sus puntos de
+grilla se rellenan con interpolación lineal (la cúbica oscila en un hueco)
+y quedan marcados en la máscara `filled`. Si la hora retrocede (reinicio del
+CanSat) o el hueco supera `max_fill` no se rellena: la grilla vuelve a
+empezar en la muestra siguiente.
+
+Con hora de llegada, las líneas leídas juntas comparten la hora. Esas
+muestras se reparten hacia atrás, entre la muestra anterior y su hora, a lo
+sumo un periodo nominal cada una (si la interfaz estuvo trabada, el hueco
+queda antes del grupo y se rellena como cualquier otro).
+"""
+import numpy as np
+
+GAP_FACTOR = 1.5        # un intervalo > 1.5 periodos es un hueco (falta al menos una muestra)
+MAX_FILL_S = 1.0        # huecos más largos no se rellenan
+METHODS = ('linear', 'cubic')
+
+
+class UniformResampler:
+    """Lleva lotes (t, muestras) a una grilla uniforme de `rate` Hz."""
+
+    def __init__(self, channels, rate, method='linear', max_gap=None, max_fill=MAX_FILL_S):
+        if method not in METHODS:
+            raise ValueError(f"método desconocido: {method}")
+        self.channels = channels
+        self.rate = float(rate)
+        self.method = method
+        self.max_gap = GAP_FACTOR / self.rate if max_gap is None else max_gap
+        self.max_fill = max_fill
+        # La cúbica necesita una muestra de cada lado del tramo para las pendientes
+        self.keep = 3 if method == 'cubic' else 1
+        self.reset()
+
+    def reset(self):
+        self.carry_t = np.zeros(0)
+        self.carry = np.zeros((0, self.channels))
+        self.origin = None      # hora del primer punto de la grilla
+        self.index = 0          # próximo punto: origin + index / rate
+
+    def update(self, t, samples):
+        """Agrega un lote; devuelve (t (m,), valores (m, canales), filled bool (m,))."""
+        t = np.concatenate([self.carry_t, np.asarray(t, dtype=float)])
+        v = np.concatenate([self.carry, np.asarray(samples, dtype=float).reshape(-1, self.channels)])
+        dt = np.diff(t)
+        if (dt == 0).any():
+            t = self._spread(t, dt)
+            dt = np.diff(t)
+        # Cortes: la hora retrocede o el hueco es demasiado largo para rellenar
+        breaks = np.flatnonzero((dt < 0) | (dt > self.max_fill)) + 1
+        out = []
+        start = 0
+        for end in breaks:
+            out.append(self._emit(t[start:end], v[start:end], final=True))
+            self.origin = None
+            start = end
+        out.append(self._emit(t[start:], v[start:], final=False))
+        self.carry_t = t[start:][-self.keep:]
+        self.carry = v[start:][-self.keep:]
+        if len(out) == 1:
+            return out[0]
+        return tuple(np.concatenate(parts) for parts in zip(*out))
+
+    def _spread(self, t, dt):
+        """Reparte los grupos de muestras con la misma hora (ver docstring del módulo)."""
+        new = np.concatenate([[True], dt != 0])
+        starts = np.flatnonzero(new)
+        counts = np.diff(np.append(starts, len(t)))
+        run = np.cumsum(new) - 1
+        rank = np.arange(len(t)) - starts[run]
+        span = np.full(len(starts), np.inf)
+        span[1:] = t[starts[1:]] - t[starts[1:] - 1]
+        nominal = counts / self.rate
+        span = np.where(span > 0, np.minimum(span, nominal), nominal)
+        return t[starts][run] - span[run] * (counts[run] - 1 - rank) / counts[run]
+
+    def _emit(self, t, v, final):
+        """Puntos de grilla de un tramo sin cortes (horas crecientes)."""
+        empty = (np.zeros(0), np.zeros((0, self.channels)), np.zeros(0, bool))
+        if self.origin is None and len(t):
+            self.origin = t[0]
+            self.index = 0
+        cubic = self.method == 'cubic'
+        if len(t) < 2 or (cubic and not final and len(t) < 3):
+            return empty
+        # Sin la muestra siguiente, la pendiente cúbica del último punto no está lista
+        limit = t[-1] if final or not cubic else t[-2]
+        last = int(np.floor((limit - self.origin) * self.rate + 1e-9))
+        if last < self.index:
+            return empty
+        grid = self.origin + np.arange(self.index, last + 1) / self.rate
+        self.index = last + 1
+        grid = grid[grid >= t[0]]
+        idx = np.clip(np.searchsorted(t, grid, side='right') - 1, 0, len(t) - 2)
+        h = t[idx + 1] - t[idx]
+        u = ((grid - t[idx]) / h)[:, None]
+        v0 = v[idx]
+        v1 = v[idx + 1]
+        values = v0 + u * (v1 - v0)
+        gap = h > self.max_gap
+        if cubic and len(t) >= 3:
+            m = np.gradient(v, t, axis=0)
+            hh = h[:, None]
+            u2 = u * u
+            u3 = u2 * u
+            cubic = ((2 * u3 - 3 * u2 + 1) * v0 + (u3 - 2 * u2 + u) * hh * m[idx]
+                     + (-2 * u3 + 3 * u2) * v1 + (u3 - u2) * hh * m[idx + 1])
+            values = np.where(gap[:, None], values, cubic)
+        filled = gap & (u[:, 0] > 1e-9)
+        return grid, values, filled
@@ -0,0 +1,98 @@
+"""Espectro de vibración (PSD de Welch) incremental para los ejes del IMU.
+
+Las muestras nuevas se acumulan; cada vez que alcanzan para uno o más
+segmentos de `nfft` muestras (solapados a `overlap`) se les quita la media,
+se multiplican por la ventana de Hann y se transforman todos juntos con una
+sola llamada a numpy.fft.rfft. La PSD de cada segmento se promedia en forma
+exponencial (≈ los últimos `average` segmentos), así el espectro sigue los
+cambios de régimen sin recalcular la historia.
+
+La ventana, el bloque de segmentos, la FFT y la PSD usan arreglos reservados
+una sola vez. Con el IMU a 50 Hz el espectro llega a 25 Hz (Nyquist); una
+vibración más rápida aparece plegada (alias) en esa banda.
+"""
+import inspect
+
+import numpy as np
+
+# numpy >= 2.0 escribe la FFT directo en un arreglo ya reservado
+_RFFT_OUT = 'out' in inspect.signature(np.fft.rfft).parameters
+
+
+class WelchSpectrum:
+    """PSD de Welch por canal, actualizada por lotes de muestras."""
+
+    def __init__(self, channels, nfft=128, overlap=0.5, average=8, max_segments=16):
+        self.channels = channels
+        self.nfft = nfft
+        self.hop = max(1, int(nfft * (1 - overlap)))
+        self.alpha = 1.0 / average
+        self.max_segments = max_segments
+        self.window = np.hanning(nfft)
+        self.window_power = float((self.window ** 2).sum())
+        self.pending = np.zeros((nfft + max_segments * self.hop, channels))
+        self.frames = np.zeros((max_segments, channels, nfft))
+        self.fft = np.zeros((max_segments, channels, nfft // 2 + 1), dtype=complex)
+        self.power = np.zeros((max_segments, channels, nfft // 2 + 1))
+        self.psd = np.zeros((channels, nfft // 2 + 1))
+        self.reset()
+
+    def reset(self):
+        self.filled = 0
+        self.segments = 0
+        self.psd[:] = 0.0
+
+    def update(self, samples):
+        """Agrega muestras (n, channels); devuelve cuántos segmentos nuevos entraron."""
+        samples = np.asarray(samples, dtype=float)
+        added = 0
+        while len(samples):
+            room = len(self.pending) - self.filled
+            chunk = samples[:room]
+            self.pending[self.filled:self.filled + len(chunk)] = chunk
+            self.filled += len(chunk)
+            samples = samples[len(chunk):]
+            added += self._process()
+        return added
+
+    def _process(self):
+        added = 0
+        while self.filled >= self.nfft:
+            k = min(1 + (self.filled - self.nfft) // self.hop, self.max_segments)
+            # Segmentos solapados como vista (sin copiar) y luego al bloque reservado
+            view = np.lib.stride_tricks.sliding_window_view(self.pending[:self.filled], self.nfft, axis=0)
+            view = view[:k * self.hop:self.hop]
+            frames = self.frames[:k]
+            np.subtract(view, view.mean(axis=-1, keepdims=True), out=frames)
+            frames *= self.window
+            if _RFFT_OUT:
+                spec = np.fft.rfft(frames, axis=-1, out=self.fft[:k])
+            else:
+                spec = self.fft[:k]
+                spec[:] = np.fft.rfft(frames, axis=-1)
+            power = self.power[:k]
+            np.multiply(spec.real, spec.real, out=power)
+            power += spec.imag * spec.imag
+            if self.segments == 0:
+                # Sin historia: el primer lote es un promedio de Welch común
+                self.psd[:] = power.mean(axis=0)
+            else:
+                # Promedio exponencial de los k segmentos, del más viejo al más nuevo
+                weights = self.alpha * (1 - self.alpha) ** np.arange(k - 1, -1, -1)
+                self.psd *= (1 - self.alpha) ** k
+                self.psd += np.tensordot(weights, power, axes=1)
+            self.segments += k
+            used = k * self.hop
+            self.pending[:self.filled - used] = self.pending[used:self.filled]
+            self.filled -= used
+            added += k
+        return added
+
+    def frequencies(self, fs):
+        return np.fft.rfftfreq(self.nfft, 1.0 / fs)
+
+    def density(self, fs):
+        """PSD de un solo lado en unidades²/Hz para la tasa de muestreo fs."""
+        psd = self.psd / (fs * self.window_power)
+        psd[:, 1:-1 if self.nfft % 2 == 0 else None] *= 2
+        return psd
@@ -0,0 +1,174 @@
+"""Instrumentación de bajo costo: tiempos por etapa, contadores y medidores.
+
+Los tiempos se toman con perf_counter_ns y se acumulan en histogramas de
+potencias de 2 (un entero por cubeta), así medir cuesta lo mismo en la
+muestra 10 que en la 10 millones.
+"""
+import json
+import time
+from time import perf_counter_ns
+
+N_BUCKETS = 48  # 2**47 ns ~ 39 horas, de sobra para una etapa
+
+
+class Histogram:
+    """Histograma logarítmico (base 2) de duraciones en nanosegundos."""
+
+    def __init__(self):
+        self.buckets = [0] * N_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        self.buckets[min(ns.bit_length(), N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, q):
+        """Cota superior (ns) del percentil q en [0, 1]."""
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        acc = 0
+        for i, n in enumerate(self.buckets):
+            acc += n
+            if acc >= target:
+                return min(1 << i, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        mean = self.total_ns / self.count if self.count else 0
+        return {
+            'count': self.count,
+            'mean_us': mean / 1e3,
+            'p50_us': self.percentile(0.50) / 1e3,
+            'p95_us': self.percentile(0.95) / 1e3,
+            'p99_us': self.percentile(0.99) / 1e3,
+            'max_us': self.max_ns / 1e3,
+            'total_ms': self.total_ns / 1e6,
+            'buckets': list(self.buckets),
+        }
+
+
+class _Span:
+    """Context manager reutilizable que mide una etapa."""
+    __slots__ = ('hist', 't0')
+
+    def __init__(self, hist):
+        self.hist = hist
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.add(perf_counter_ns() - self.t0)
+        return False
+
+
+class PerfStats:
+    """Agrupa histogramas por etapa, contadores (con tasa por segundo) y medidores."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.last_error = None
+        self._spans = {}
+        self._start = time.time()
+        self._rate_time = time.monotonic()
+        self._rate_counts = {}
+        self._rates = {}
+
+    def span(self, name):
+        """Uso: `with stats.span('decode'): ...`"""
+        span = self._spans.get(name)
+        if span is None:
+            span = self._spans[name] = _Span(self.histogram(name))
+        return span
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        return hist
+
+    def record(self, name, ns):
+        self.histogram(name).add(ns)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def error(self, exc):
+        self.count('errors')
+        self.last_error = f"{type(exc).__name__}: {exc}"
+
+    def reset(self):
+        self.__init__()
+
+    def update_rates(self):
+        """Calcula tasas por segundo desde la última llamada (llamar ~1 vez por segundo)."""
+        now = time.monotonic()
+        dt = now - self._rate_time
+        if dt <= 0:
+            return self._rates
+        self._rates = {name: (value - self._rate_counts.get(name, 0)) / dt
+                       for name, value in self.counters.items()}
+        self._rate_counts = dict(self.counters)
+        self._rate_time = now
+        return self._rates
+
+    def snapshot(self):
+        """Diccionario serializable a JSON con el estado actual."""
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self._start,
+            'stages': {name: h.summary() for name, h in self.histograms.items()},
+            'counters': dict(self.counters),
+            'rates_per_s': dict(self._rates),
+            'gauges': dict(self.gauges),
+            'last_error': self.last_error,
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def format_table(self):
+        """Texto de ancho fijo para mostrar en la interfaz."""
+        lines = [f"{'etapa':14s} {'n':>8s} {'media':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}  (us)"]
+        for name, h in self.histograms.items():
+            s = h.summary()
+            lines.append(f"{name:14s} {s['count']:8d} {s['mean_us']:9.1f} {s['p95_us']:9.1f} "
+                         f"{s['p99_us']:9.1f} {s['max_us']:9.1f}")
+        lines.append('')
+        lines.append(f"{'contador':18s} {'total':>10s} {'por s':>10s}")
+        for name, value in self.counters.items():
+            lines.append(f"{name:18s} {value:10d} {self._rates.get(name, 0.0):10.1f}")
+        if self.gauges:
+            lines.append('')
+            for name, value in self.gauges.items():
+                lines.append(f"{name:18s} {value:10}")
+        if self.last_error:
+            lines.append('')
+            lines.append(f"último error: {self.last_error}")
+        return '\n'.join(lines)
+
+    def format_overlay(self):
+        """Resumen de una línea para el overlay del dashboard."""
+        parts = []
+        for name in ('bytes', 'imu_lines', 'frames'):
+            parts.append(f"{name}/s {self._rates.get(name, 0.0):.0f}")
+        parts.append(f"perdidas {self.counters.get('dropped_frames', 0)}")
+        parts.append(f"resync {self.counters.get('resyncs', 0)}")
+        total = self.histograms.get('update')
+        if total:
+            parts.append(f"update p95 {total.percentile(0.95) / 1e6:.1f} ms")
+        return '  |  '.join(parts)
@@ -0,0 +1,309 @@
+"""Reconstrucción del video a partir de imágenes, repeticiones y miniaturas.
+
+El firmware, con la escena quieta, manda FRAME_REPEAT ("la imagen sigue
+igual") o una miniatura a 1/4 de resolución en lugar del JPEG completo.
+`FrameReconstructor` recibe todos los paquetes de video en orden y solo
+decodifica cuando se pide la imagen a mostrar, así un lote con varias
+imágenes cuesta una sola decodificación. Si el panel es más chico que la
+imagen, libjpeg decodifica directamente a 1/2, 1/4 o 1/8 (IMREAD_REDUCED_*),
+que cuesta bastante menos que decodificar completo y reducir después; si el
+panel crece, la imagen reducida guardada se vuelve a decodificar más grande.
+
+`FrameTagger` etiqueta cada cuadro con la actitud interpolada (slerp) a su
+hora de captura y `RollStabilizer` lo endereza por ese roll con
+cv2.warpAffine. En el modo con hilos `VideoWorker` hace la decodificación y
+el enderezado fuera del hilo de Qt (en modo multiproceso los hace el proceso
+de decodificación).
+"""
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+import cv2
+
+from cansat_imu import quat_to_euler
+from cansat_protocol import PKT_IMAGE, PKT_REPEAT, PKT_THUMB
+from cansat_stats import PerfStats
+
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+ANGLE_STEP = 0.5        # grados: resolución de las matrices de rotación guardadas
+TAG_WAIT_S = 0.5        # espera máxima por muestras IMU posteriores a una captura
+
+# Actitud de un cuadro a su hora de captura (ms del CanSat): cuaternión w, x, y, z
+# y los mismos ángulos en grados
+FrameTag = namedtuple('FrameTag', 'capture_ms w x y z pitch roll yaw')
+
+
+def decode_jpeg(data, reduce=1):
+    """JPEG -> arreglo RGB (a 1/reduce de tamaño), o None si no se puede decodificar."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_FLAGS[reduce])
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class FrameReconstructor:
+    """Mantiene la última imagen completa y decide qué mostrar.
+
+    - PKT_IMAGE: nueva imagen completa.
+    - PKT_REPEAT: vuelve a la última imagen completa (si hay una miniatura
+      en pantalla) o no cambia nada.
+    - PKT_THUMB: miniatura escalada al tamaño de la última imagen completa;
+      no reemplaza a la imagen de referencia.
+
+    Contadores: repeat_frames_shown, thumb_frames_shown, repeat_without_ref,
+    dropped_frames (JPEG que no se pudo decodificar).
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else PerfStats()
+        self.reset()
+
+    def reset(self):
+        self.display_size = None  # (ancho, alto) del panel; None = tamaño completo
+        self.source_size = None   # tamaño original de la última imagen completa
+        self.full_jpeg = None     # última imagen completa (bytes)
+        self.full_rgb = None      # la misma ya decodificada
+        self.reduce = 1           # factor con el que se decodificó full_rgb
+        self.thumb_jpeg = None
+        self.showing = None       # 'full', 'thumb' o None
+        self.wanted = None
+        self.capture_ms = None
+
+    def add(self, kind, data):
+        """Registra un paquete de video; no decodifica."""
+        if kind == PKT_IMAGE:
+            self.full_jpeg = data
+            self.full_rgb = None
+            self.wanted = 'full'
+        elif kind == PKT_THUMB:
+            self.thumb_jpeg = data
+            self.wanted = 'thumb'
+        elif kind == PKT_REPEAT:
+            if self.full_jpeg is None:
+                self.stats.count('repeat_without_ref')
+                return
+            self.wanted = 'full'
+        else:
+            return
+        self.capture_ms = getattr(data, 'capture_ms', None)
+
+    def _reduction(self):
+        """Mayor factor que deja la imagen al menos del tamaño del panel."""
+        if self.display_size is None or self.source_size is None:
+            return 1
+        (dw, dh), (sw, sh) = self.display_size, self.source_size
+        for factor in (8, 4, 2):
+            if sw // factor >= dw and sh // factor >= dh:
+                return factor
+        return 1
+
+    def render(self):
+        """Devuelve la imagen RGB a mostrar o None si no cambió nada."""
+        wanted, self.wanted = self.wanted, None
+        if wanted != 'thumb' and self.full_rgb is not None and self._reduction() < self.reduce:
+            # El panel creció: la imagen reducida guardada ya no alcanza
+            self.full_rgb = None
+            if wanted is None and self.showing == 'full':
+                wanted = 'full'
+        if wanted is None:
+            return None
+        if wanted == 'full':
+            if self.full_rgb is not None and self.showing == 'full':
+                self.stats.count('repeat_frames_shown')
+                return None
+            if self.full_rgb is None:
+                reduce = self._reduction()
+                self.full_rgb = decode_jpeg(self.full_jpeg, reduce)
+                if self.full_rgb is None:
+                    self.stats.count('dropped_frames')
+                    self.full_jpeg = None
+                    return None
+                h, w = self.full_rgb.shape[:2]
+                self.source_size = (w * reduce, h * reduce)
+                self.reduce = reduce
+            self.showing = 'full'
+            return self.full_rgb
+        thumb = decode_jpeg(self.thumb_jpeg)
+        if thumb is None:
+            self.stats.count('dropped_frames')
+            return None
+        if self.full_rgb is not None:
+            h, w = self.full_rgb.shape[:2]
+            thumb = cv2.resize(thumb, (w, h), interpolation=cv2.INTER_LINEAR)
+        self.stats.count('thumb_frames_shown')
+        self.showing = 'thumb'
+        return thumb
+
+
+class RollStabilizer:
+    """Gira cada cuadro por -roll para que el horizonte no gire con el CanSat.
+
+    Quien llama pasa el roll a la hora de captura del cuadro (ver
+    AttitudeHistory y FrameTagger). Las matrices de rotación se guardan por
+    ángulo redondeado a ANGLE_STEP y se escribe en dos búferes de salida
+    reservados que se alternan (el que se está mostrando no se pisa con el
+    siguiente).
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else PerfStats()
+        self.matrices = {}
+        self.buffers = []
+        self.next_buffer = 0
+
+    def _matrix(self, size, angle):
+        step = int(round(angle / ANGLE_STEP)) % int(360 / ANGLE_STEP)
+        matrix = self.matrices.get(step)
+        if matrix is None:
+            w, h = size
+            matrix = self.matrices[step] = cv2.getRotationMatrix2D((w / 2, h / 2), step * ANGLE_STEP, 1.0)
+        return matrix
+
+    def apply(self, rgb, roll):
+        """Cuadro girado por -roll (grados) en un búfer propio."""
+        h, w = rgb.shape[:2]
+        if not self.buffers or self.buffers[0].shape != rgb.shape:
+            # Cambió la resolución: se rehacen matrices y búferes
+            self.matrices.clear()
+            self.buffers = [np.empty_like(rgb), np.empty_like(rgb)]
+        dst = self.buffers[self.next_buffer]
+        self.next_buffer ^= 1
+        with self.stats.span('stabilize'):
+            cv2.warpAffine(rgb, self._matrix((w, h), -roll), (w, h), dst=dst,
+                           flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        return dst
+
+
+class VideoWorker:
+    """FrameReconstructor.render y RollStabilizer.apply en un hilo propio.
+
+    La interfaz entrega los paquetes de video de cada lote con submit() junto
+    con el tamaño del panel y el roll a la hora de captura (None = sin
+    enderezar), y toma el cuadro listo con take(). submit() sin paquetes
+    avisa que cambió el panel. Gana el último: el hilo no
+    decodifica otro cuadro hasta que la interfaz tomó el anterior, así los dos
+    búferes del estabilizador nunca pisan al que está en pantalla.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else PerfStats()
+        self.video = FrameReconstructor(self.stats)
+        self.stabilizer = RollStabilizer(self.stats)
+        self.cond = threading.Condition()
+        self.packets = []           # (tipo, datos) pendientes; None = reset
+        self.dirty = False          # hay paquetes o cambió el tamaño del panel
+        self.display_size = None
+        self.roll = None
+        self.frame = None           # cuadro listo que la interfaz no tomó todavía
+        self.generation = 0         # cambia con reset(): se descarta lo que se estaba decodificando
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='video', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    def reset(self):
+        with self.cond:
+            self.packets = [None]
+            self.dirty = True
+            self.frame = None
+            self.generation += 1
+            self.cond.notify()
+
+    def submit(self, packets, display_size, roll=None):
+        with self.cond:
+            self.packets.extend(packets)
+            self.dirty = True
+            self.display_size = display_size
+            self.roll = roll
+            self.cond.notify()
+
+    def ready(self):
+        return self.frame is not None
+
+    def take(self):
+        """Cuadro RGB listo o None; el hilo puede seguir con el próximo."""
+        with self.cond:
+            frame, self.frame = self.frame, None
+            self.cond.notify()
+        return frame
+
+    def _run(self):
+        video = self.video
+        while True:
+            with self.cond:
+                while self.running and not (self.dirty and self.frame is None):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                packets, self.packets = self.packets, []
+                self.dirty = False
+                display_size, roll, generation = self.display_size, self.roll, self.generation
+            for packet in packets:
+                if packet is None:
+                    video.reset()
+                else:
+                    video.add(*packet)
+            video.display_size = display_size
+            try:
+                with self.stats.span('decode'):
+                    img = video.render()
+                if img is not None and roll is not None:
+                    img = self.stabilizer.apply(img, roll)
+            except Exception as e:
+                self.stats.error(e)
+                continue
+            if img is not None:
+                with self.cond:
+                    if generation == self.generation:
+                        self.frame = img
+
+
+class FrameTagger:
+    """Etiqueta cada cuadro con la actitud interpolada a su hora de captura.
+
+    El firmware toma la línea IMU antes de capturar y la latencia de la
+    cámara no se conoce, así que al llegar la imagen puede no haber todavía
+    muestras posteriores a la captura. Cada cuadro queda pendiente hasta que
+    la historia de actitud pasa su hora o hasta TAG_WAIT_S de espera (reinicio
+    del CanSat o IMU cortada); entonces se usa el extremo más cercano.
+    """
+
+    def __init__(self):
+        self.pending = deque()      # (capture_ms, hora local de llegada)
+
+    def reset(self):
+        self.pending.clear()
+
+    def add(self, capture_ms, arrival):
+        self.pending.append((capture_ms, arrival))
+
+    def resolve(self, history, now):
+        """FrameTag de los cuadros que ya se pueden etiquetar, en orden de llegada."""
+        ready = []
+        last_time = history.last_time
+        while self.pending:
+            capture_ms, arrival = self.pending[0]
+            if not (last_time is not None and last_time >= capture_ms / 1000.0) and now - arrival < TAG_WAIT_S:
+                break
+            self.pending.popleft()
+            ready.append(capture_ms)
+        if not ready or last_time is None:
+            return []
+        quats = history.at(np.array(ready) / 1000.0)
+        pitch, roll, yaw = quat_to_euler(quats)
+        return [FrameTag(ms, *q, p, r, y) for ms, q, p, r, y in
+                zip(ready, quats.tolist(), pitch.tolist(), roll.tolist(), yaw.tolist())]
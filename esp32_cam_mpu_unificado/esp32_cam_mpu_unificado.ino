@@ -1,4 +1,5 @@
 #include "esp_camera.h"
+#include "img_converters.h"
 #include <Wire.h>
 #include <MPU6050.h>
 
@@ -25,6 +26,54 @@ MPU6050 mpu;
 #define ACP_RX_PIN 44   // GPIO44
 #define ACP_TX_PIN 43   // GPIO43
 
+// Tramas binarias (big endian):
+//   0xAA 0x55 | tipo (1) | longitud (2) | datos | CRC32 (4)
+// El CRC32 es el de zlib y cubre tipo, longitud y datos.
+#define FRAME_JPEG 0x01
+#define FRAME_JPEG_FRAG 0x02  // id (2), tamaño total (4), posición (4), hora de captura ms (4), datos
+#define FRAME_TEST 0x03       // contador (4) y relleno, solo en la prueba de enlace
+#define FRAME_REPEAT 0x04     // id de la última imagen completa (2), hora de captura (4)
+#define FRAME_THUMB 0x05      // hora de captura (4), JPEG a 1/4 de resolución
+#define MAX_PAYLOAD 60000
+
+uint32_t crc_table[256];
+
+void initCrcTable() {
+  for (uint32_t i = 0; i < 256; i++) {
+    uint32_t c = i;
+    for (int k = 0; k < 8; k++) c = (c & 1) ? (0xEDB88320 ^ (c >> 1)) : (c >> 1);
+    crc_table[i] = c;
+  }
+}
+
+uint32_t crc32Update(uint32_t crc, const uint8_t* data, size_t len) {
+  crc = ~crc;
+  for (size_t i = 0; i < len; i++) crc = crc_table[(crc ^ data[i]) & 0xFF] ^ (crc >> 8);
+  return ~crc;
+}
+
+// Envía una trama cuyo contenido es `head` seguido de `data` (head puede ser NULL)
+void sendFrame(uint8_t type, const uint8_t* head, size_t head_len, const uint8_t* data, size_t len) {
+  size_t total = head_len + len;
+  if (total > MAX_PAYLOAD) return;
+  uint8_t header[5] = {0xAA, 0x55, type, (uint8_t)(total >> 8), (uint8_t)(total & 0xFF)};
+  uint32_t crc = crc32Update(0, header + 2, 3);
+  if (head_len) crc = crc32Update(crc, head, head_len);
+  crc = crc32Update(crc, data, len);
+  uint8_t trailer[4] = {(uint8_t)(crc >> 24), (uint8_t)(crc >> 16), (uint8_t)(crc >> 8), (uint8_t)crc};
+  Serial.write(header, sizeof(header));
+  if (head_len) Serial.write(head, head_len);
+  Serial.write(data, len);
+  Serial.write(trailer, sizeof(trailer));
+}
+
+void sendFrame(uint8_t type, const uint8_t* data, size_t len) {
+  sendFrame(type, NULL, 0, data, len);
+}
+
+void putU16(uint8_t* p, uint16_t v) { p[0] = v >> 8; p[1] = v; }
+void putU32(uint8_t* p, uint32_t v) { p[0] = v >> 24; p[1] = v >> 16; p[2] = v >> 8; p[3] = v; }
+
 #define FILTER_N 10
 int16_t ax_buf[FILTER_N], ay_buf[FILTER_N], az_buf[FILTER_N];
 int16_t gx_buf[FILTER_N], gy_buf[FILTER_N], gz_buf[FILTER_N];
@@ -34,6 +83,228 @@ bool filter_full = false;
 float ax_f = 0, ay_f = 0, az_f = 0, gx_f = 0, gy_f = 0, gz_f = 0;
 float alpha = 0.2; // Filtro exponencial
 
+// Número de secuencia de cada línea IMU: la estación descarta los duplicados
+// cuando recibe la misma línea por USB y por la radio (Serial1)
+uint32_t seq = 0;
+
+// Parámetros de imagen ajustables desde tierra con "CMD:Q=15;FS=QVGA;INT=200;"
+int jpeg_quality = 12;
+framesize_t frame_size = FRAMESIZE_QVGA;
+uint32_t frame_interval_ms = 100;
+uint32_t last_frame_ms = 0;
+
+// La IMU se muestrea en su propia tarea a ritmo fijo y deja las muestras en un
+// búfer circular; loop() las envía en lotes entre fragmentos de imagen, así la
+// cadencia IMU no depende del tamaño de las imágenes
+#define IMU_PERIOD_MS 20      // 50 Hz
+#define IMU_RING_SIZE 128     // ~2.5 s de margen si el enlace se atasca
+#define FRAGMENT_SIZE 1024    // bytes de JPEG por fragmento (~90 ms a 115200, ~11 ms a 921600)
+
+struct ImuSample {
+  uint32_t t_ms;
+  uint32_t seq;
+  int16_t ax, ay, az, gx, gy, gz;
+};
+ImuSample imu_ring[IMU_RING_SIZE];
+volatile uint16_t imu_head = 0;  // siguiente posición a escribir (tarea IMU)
+volatile uint16_t imu_tail = 0;  // siguiente posición a leer (loop)
+volatile uint32_t imu_overflows = 0;
+portMUX_TYPE imu_mux = portMUX_INITIALIZER_UNLOCKED;
+
+// Velocidad del puerto USB. Tierra la cambia con BAUD=..; si no llega ningún
+// comando a la velocidad nueva en BAUD_CONFIRM_MS se vuelve a la anterior.
+// Fuera de BOOT_BAUD, tierra envía KA=1 cada segundo; si pasan LINK_IDLE_MS
+// sin comandos por USB (estación cerrada) se vuelve a BOOT_BAUD para que los
+// scripts simples lean sin reiniciar el CanSat.
+// Con USB-CDC nativo (ESP32-S2/S3) los baudios no aplican y se informa 0.
+#define BOOT_BAUD 115200
+#define BAUD_CONFIRM_MS 2000
+#define LINK_IDLE_MS 5000
+const uint32_t BAUD_RATES[] = {115200, 230400, 460800, 921600, 2000000};
+#if ARDUINO_USB_CDC_ON_BOOT
+uint32_t usb_baud = 0;
+#else
+uint32_t usb_baud = BOOT_BAUD;
+#endif
+uint32_t previous_baud = BOOT_BAUD;
+bool baud_unconfirmed = false;
+uint32_t baud_changed_ms = 0;
+uint32_t last_usb_cmd_ms = 0;
+
+// Prueba de enlace: tramas FRAME_TEST pendientes (las imágenes esperan)
+uint32_t test_remaining = 0;
+uint32_t test_counter = 0;
+
+// Escena quieta: cada captura se decodifica a 1/4 de resolución y su luma se
+// compara con la de la última imagen completa enviada. Con poca diferencia se
+// manda una repetición; con algo más, una miniatura; si no, la imagen completa.
+// Cada KEYFRAME_MS se manda una completa aunque no cambie nada.
+#define THUMB_SCALE JPG_SCALE_4X
+#define THUMB_MAX_PIXELS (160 * 120)  // VGA / 4
+#define THUMB_QUALITY 60              // calidad de fmt2jpg (0-100, más es mejor)
+#define STATIC_DIFF 3                 // diferencia media de luma (0-255) para repetir
+#define THUMB_DIFF 10                 // hasta aquí basta una miniatura
+#define KEYFRAME_MS 5000
+enum FrameDecision { SEND_FULL, SEND_THUMB, SEND_REPEAT };
+bool delta_enabled = true;
+uint8_t* thumb_rgb = NULL;   // RGB565 de la captura actual
+uint8_t* cur_luma = NULL;
+uint8_t* ref_luma = NULL;    // luma de la última imagen completa enviada
+uint32_t ref_pixels = 0;
+uint32_t cur_pixels = 0;     // 0 si la captura actual no se comparó
+uint32_t last_full_ms = 0;
+
+// Imagen en envío (fragmentada)
+camera_fb_t* tx_fb = NULL;
+size_t tx_offset = 0;
+uint16_t tx_frame_id = 0;
+uint32_t tx_capture_ms = 0;
+
+struct FrameSizeName { const char* name; framesize_t size; };
+const FrameSizeName FRAME_SIZE_NAMES[] = {
+  {"QQVGA", FRAMESIZE_QQVGA}, {"HQVGA", FRAMESIZE_HQVGA}, {"QVGA", FRAMESIZE_QVGA},
+  {"CIF", FRAMESIZE_CIF}, {"VGA", FRAMESIZE_VGA},
+};
+const int N_FRAME_SIZES = sizeof(FRAME_SIZE_NAMES) / sizeof(FRAME_SIZE_NAMES[0]);
+
+// Una línea de comando en construcción por cada puerto (USB y radio)
+struct CommandBuffer { char buf[96]; int len; };
+CommandBuffer cmd_usb = {{0}, 0};
+CommandBuffer cmd_radio = {{0}, 0};
+
+const char* frameSizeName(framesize_t size) {
+  for (int i = 0; i < N_FRAME_SIZES; i++) {
+    if (FRAME_SIZE_NAMES[i].size == size) return FRAME_SIZE_NAMES[i].name;
+  }
+  return "?";
+}
+
+bool baudSupported(uint32_t baud) {
+  for (size_t i = 0; i < sizeof(BAUD_RATES) / sizeof(BAUD_RATES[0]); i++) {
+    if (BAUD_RATES[i] == baud) return true;
+  }
+  return false;
+}
+
+void setUsbBaud(uint32_t baud) {
+#if !ARDUINO_USB_CDC_ON_BOOT
+  Serial.flush();  // termina de enviar a la velocidad anterior
+  Serial.updateBaudRate(baud);
+#endif
+}
+
+void sendAck() {
+  char ack[80];
+  snprintf(ack, sizeof(ack), "ACK:Q=%d;FS=%s;INT=%lu;BAUD=%lu;DELTA=%d;", jpeg_quality,
+           frameSizeName(frame_size), (unsigned long)frame_interval_ms, (unsigned long)usb_baud,
+           delta_enabled ? 1 : 0);
+  Serial.println(ack);
+  Serial1.println(ack);
+}
+
+void handleCommand(char* line, bool from_usb) {
+  if (strncmp(line, "CMD:", 4) != 0) return;
+  if (from_usb) {
+    // Llegó un comando legible a la velocidad nueva: queda confirmada
+    baud_unconfirmed = false;
+    last_usb_cmd_ms = millis();
+  }
+  uint32_t new_baud = 0;
+  bool keepalive = false;
+  bool other = false;
+  sensor_t* s = esp_camera_sensor_get();
+  char* save = NULL;
+  for (char* item = strtok_r(line + 4, ";", &save); item; item = strtok_r(NULL, ";", &save)) {
+    char* eq = strchr(item, '=');
+    if (!eq) continue;
+    *eq = 0;
+    const char* key = item;
+    const char* value = eq + 1;
+    other = other || strcmp(key, "KA") != 0;
+    if (strcmp(key, "KA") == 0) {
+      keepalive = true;  // solo mantiene la velocidad; no lleva ACK
+    } else if (strcmp(key, "Q") == 0) {
+      jpeg_quality = constrain(atoi(value), 4, 63);
+      s->set_quality(s, jpeg_quality);
+    } else if (strcmp(key, "FS") == 0) {
+      for (int i = 0; i < N_FRAME_SIZES; i++) {
+        if (strcmp(value, FRAME_SIZE_NAMES[i].name) == 0) {
+          frame_size = FRAME_SIZE_NAMES[i].size;
+          s->set_framesize(s, frame_size);
+        }
+      }
+    } else if (strcmp(key, "INT") == 0) {
+      frame_interval_ms = constrain(atol(value), 0, 5000);
+    } else if (strcmp(key, "BAUD") == 0) {
+      // Solo por USB: la velocidad de la radio la fija el módulo
+      uint32_t baud = atol(value);
+      if (from_usb && usb_baud != 0 && baudSupported(baud)) new_baud = baud;
+    } else if (strcmp(key, "DELTA") == 0) {
+      delta_enabled = atoi(value) != 0;
+      ref_pixels = 0;  // la próxima imagen sale completa
+    } else if (strcmp(key, "TEST") == 0) {
+      test_remaining = constrain(atol(value), 0, 10000);
+      test_counter = 0;
+    }
+  }
+  bool change_baud = new_baud != 0 && new_baud != usb_baud;
+  if (change_baud) {
+    previous_baud = usb_baud;
+    usb_baud = new_baud;
+  }
+  // El ACK sale todavía a la velocidad anterior
+  if (other || !keepalive) sendAck();
+  if (change_baud) {
+    setUsbBaud(usb_baud);
+    // La velocidad de arranque no necesita confirmación
+    baud_unconfirmed = usb_baud != BOOT_BAUD;
+    baud_changed_ms = millis();
+  }
+}
+
+// Sin confirmación desde tierra se vuelve a la velocidad anterior; sin
+// comandos por LINK_IDLE_MS, a la de arranque
+void checkBaudTimeout() {
+  if (baud_unconfirmed && millis() - baud_changed_ms > BAUD_CONFIRM_MS) {
+    usb_baud = previous_baud;
+    setUsbBaud(usb_baud);
+    baud_unconfirmed = false;
+  } else if (!baud_unconfirmed && usb_baud != 0 && usb_baud != BOOT_BAUD &&
+             millis() - last_usb_cmd_ms > LINK_IDLE_MS) {
+    usb_baud = BOOT_BAUD;
+    setUsbBaud(usb_baud);
+  }
+}
+
+// Trama de prueba de FRAGMENT_SIZE bytes: contador y un patrón fijo
+void sendTestFrame() {
+  static uint8_t pattern[FRAGMENT_SIZE - 4];
+  static bool ready = false;
+  if (!ready) {
+    for (size_t i = 0; i < sizeof(pattern); i++) pattern[i] = i * 37 + 11;
+    ready = true;
+  }
+  uint8_t head[4];
+  putU32(head, test_counter++);
+  sendFrame(FRAME_TEST, head, sizeof(head), pattern, sizeof(pattern));
+  if (--test_remaining == 0) sendAck();
+}
+
+void readCommands(Stream& port, CommandBuffer& cmd) {
+  while (port.available()) {
+    char c = port.read();
+    if (c == '\n' || c == '\r') {
+      if (cmd.len > 0) {
+        cmd.buf[cmd.len] = 0;
+        handleCommand(cmd.buf, &port == &Serial);
+      }
+      cmd.len = 0;
+    } else if (cmd.len < (int)sizeof(cmd.buf) - 1) {
+      cmd.buf[cmd.len++] = c;
+    }
+  }
+}
+
 void addToBuffer(int16_t* buf, int16_t val) {
   buf[filter_idx] = val;
 }
@@ -46,8 +317,150 @@ int16_t avgBuffer(int16_t* buf) {
   return sum / n;
 }
 
+void pushImuSample(const ImuSample& sample) {
+  portENTER_CRITICAL(&imu_mux);
+  uint16_t next = (imu_head + 1) % IMU_RING_SIZE;
+  if (next == imu_tail) {
+    // Búfer lleno: se pierde la muestra más vieja
+    imu_tail = (imu_tail + 1) % IMU_RING_SIZE;
+    imu_overflows++;
+  }
+  imu_ring[imu_head] = sample;
+  imu_head = next;
+  portEXIT_CRITICAL(&imu_mux);
+}
+
+bool popImuSample(ImuSample& sample) {
+  bool ok = false;
+  portENTER_CRITICAL(&imu_mux);
+  if (imu_tail != imu_head) {
+    sample = imu_ring[imu_tail];
+    imu_tail = (imu_tail + 1) % IMU_RING_SIZE;
+    ok = true;
+  }
+  portEXIT_CRITICAL(&imu_mux);
+  return ok;
+}
+
+void imuTask(void* arg) {
+  TickType_t last_wake = xTaskGetTickCount();
+  for (;;) {
+    int16_t ax, ay, az, gx, gy, gz;
+    mpu.getMotion6(&ax, &ay, &az, &gx, &gy, &gz);
+
+    // Media móvil
+    addToBuffer(ax_buf, ax);
+    addToBuffer(ay_buf, ay);
+    addToBuffer(az_buf, az);
+    addToBuffer(gx_buf, gx);
+    addToBuffer(gy_buf, gy);
+    addToBuffer(gz_buf, gz);
+    filter_idx++;
+    if (filter_idx >= FILTER_N) {
+      filter_idx = 0;
+      filter_full = true;
+    }
+    int16_t ax_avg = avgBuffer(ax_buf);
+    int16_t ay_avg = avgBuffer(ay_buf);
+    int16_t az_avg = avgBuffer(az_buf);
+    int16_t gx_avg = avgBuffer(gx_buf);
+    int16_t gy_avg = avgBuffer(gy_buf);
+    int16_t gz_avg = avgBuffer(gz_buf);
+
+    // Filtro exponencial
+    ax_f = alpha * ax_avg + (1 - alpha) * ax_f;
+    ay_f = alpha * ay_avg + (1 - alpha) * ay_f;
+    az_f = alpha * az_avg + (1 - alpha) * az_f;
+    gx_f = alpha * gx_avg + (1 - alpha) * gx_f;
+    gy_f = alpha * gy_avg + (1 - alpha) * gy_f;
+    gz_f = alpha * gz_avg + (1 - alpha) * gz_f;
+
+    ImuSample sample = {millis(), seq++, (int16_t)ax_f, (int16_t)ay_f, (int16_t)az_f,
+                        (int16_t)gx_f, (int16_t)gy_f, (int16_t)gz_f};
+    pushImuSample(sample);
+    vTaskDelayUntil(&last_wake, pdMS_TO_TICKS(IMU_PERIOD_MS));
+  }
+}
+
+// Envía todas las muestras IMU pendientes (USB y radio)
+void flushImu() {
+  ImuSample s;
+  char line[96];
+  while (popImuSample(s)) {
+    int n = snprintf(line, sizeof(line), "ACC:%d,%d,%d;GYRO:%d,%d,%d;SEQ:%lu;T:%lu;\r\n",
+                     s.ax, s.ay, s.az, s.gx, s.gy, s.gz, (unsigned long)s.seq, (unsigned long)s.t_ms);
+    Serial.write((const uint8_t*)line, n);
+    Serial1.write((const uint8_t*)line, n);
+  }
+}
+
+void* allocBuffer(size_t size) {
+  return psramFound() ? ps_malloc(size) : malloc(size);
+}
+
+// Decide cómo enviar la captura; deja la miniatura en thumb_rgb y su luma en cur_luma
+FrameDecision classifyFrame(camera_fb_t* fb) {
+  cur_pixels = 0;
+  if (!delta_enabled || thumb_rgb == NULL) return SEND_FULL;
+  uint32_t pixels = (uint32_t)(fb->width / 4) * (fb->height / 4);
+  if (pixels == 0 || pixels > THUMB_MAX_PIXELS) return SEND_FULL;
+  if (!jpg2rgb565(fb->buf, fb->len, thumb_rgb, THUMB_SCALE)) return SEND_FULL;
+  uint32_t diff = 0;
+  for (uint32_t i = 0; i < pixels; i++) {
+    uint16_t px = (thumb_rgb[2 * i] << 8) | thumb_rgb[2 * i + 1];
+    // Luma aproximada con R5 G6 B5 llevados a 8 bits
+    uint8_t y = (((px >> 11) & 0x1F) * 8 * 77 + ((px >> 5) & 0x3F) * 4 * 150 + (px & 0x1F) * 8 * 29) >> 8;
+    cur_luma[i] = y;
+    if (ref_pixels == pixels) diff += abs((int)y - (int)ref_luma[i]);
+  }
+  cur_pixels = pixels;
+  uint32_t mean = ref_pixels == pixels ? diff / pixels : 255;
+  if (mean >= THUMB_DIFF || millis() - last_full_ms >= KEYFRAME_MS) return SEND_FULL;
+  return mean < STATIC_DIFF ? SEND_REPEAT : SEND_THUMB;
+}
+
+void sendRepeat(uint32_t capture_ms) {
+  uint8_t head[6];
+  putU16(head, tx_frame_id);
+  putU32(head + 2, capture_ms);
+  sendFrame(FRAME_REPEAT, head, sizeof(head));
+}
+
+// Codifica a JPEG la captura reducida que dejó classifyFrame en thumb_rgb
+bool sendThumb(camera_fb_t* fb, uint32_t capture_ms) {
+  uint8_t* jpg = NULL;
+  size_t jpg_len = 0;
+  if (!fmt2jpg(thumb_rgb, (fb->width / 4) * (fb->height / 4) * 2, fb->width / 4, fb->height / 4,
+               PIXFORMAT_RGB565, THUMB_QUALITY, &jpg, &jpg_len)) {
+    return false;
+  }
+  uint8_t head[4];
+  putU32(head, capture_ms);
+  sendFrame(FRAME_THUMB, head, sizeof(head), jpg, jpg_len);
+  free(jpg);
+  return true;
+}
+
+// Envía el siguiente fragmento de la imagen en curso
+void sendNextFragment() {
+  size_t len = tx_fb->len - tx_offset;
+  if (len > FRAGMENT_SIZE) len = FRAGMENT_SIZE;
+  uint8_t head[14];
+  putU16(head, tx_frame_id);
+  putU32(head + 2, tx_fb->len);
+  putU32(head + 6, tx_offset);
+  putU32(head + 10, tx_capture_ms);
+  sendFrame(FRAME_JPEG_FRAG, head, sizeof(head), tx_fb->buf + tx_offset, len);
+  tx_offset += len;
+  if (tx_offset >= tx_fb->len) {
+    esp_camera_fb_return(tx_fb);
+    tx_fb = NULL;
+  }
+}
+
 void setup() {
-  Serial.begin(115200);
+  Serial.begin(BOOT_BAUD);
+  initCrcTable();
   Serial1.begin(115200, SERIAL_8N1, ACP_RX_PIN, ACP_TX_PIN);
   // Inicializa cámara
   camera_config_t config;
@@ -71,8 +484,8 @@ void setup() {
   config.pin_reset = RESET_GPIO_NUM;
   config.xclk_freq_hz = 20000000;
   config.pixel_format = PIXFORMAT_JPEG;
-  config.frame_size = FRAMESIZE_QVGA; // 320x240
-  config.jpeg_quality = 12;
+  config.frame_size = frame_size; // QVGA 320x240 por defecto
+  config.jpeg_quality = jpeg_quality;
   config.fb_count = 1;
   if (esp_camera_init(&config) != ESP_OK) {
     Serial.println("Error al inicializar la cámara");
@@ -85,67 +498,59 @@ void setup() {
     Serial.println("MPU6050 no encontrado!");
     while (1);
   }
+  // Búferes de la comparación de escena (sin ellos todo sale completo)
+  thumb_rgb = (uint8_t*)allocBuffer(THUMB_MAX_PIXELS * 2);
+  cur_luma = (uint8_t*)allocBuffer(THUMB_MAX_PIXELS);
+  ref_luma = (uint8_t*)allocBuffer(THUMB_MAX_PIXELS);
+  if (!thumb_rgb || !cur_luma || !ref_luma) thumb_rgb = NULL;
+  // Muestreo IMU en el núcleo 0 (loop() corre en el 1)
+  xTaskCreatePinnedToCore(imuTask, "imu", 4096, NULL, 2, NULL, 0);
+  // Informa a tierra los parámetros de imagen iniciales
+  sendAck();
 }
 
 void loop() {
-  int16_t ax, ay, az, gx, gy, gz;
-  mpu.getMotion6(&ax, &ay, &az, &gx, &gy, &gz);
-
-  // Media móvil
-  addToBuffer(ax_buf, ax);
-  addToBuffer(ay_buf, ay);
-  addToBuffer(az_buf, az);
-  addToBuffer(gx_buf, gx);
-  addToBuffer(gy_buf, gy);
-  addToBuffer(gz_buf, gz);
-  filter_idx++;
-  if (filter_idx >= FILTER_N) {
-    filter_idx = 0;
-    filter_full = true;
-  }
-  int16_t ax_avg = avgBuffer(ax_buf);
-  int16_t ay_avg = avgBuffer(ay_buf);
-  int16_t az_avg = avgBuffer(az_buf);
-  int16_t gx_avg = avgBuffer(gx_buf);
-  int16_t gy_avg = avgBuffer(gy_buf);
-  int16_t gz_avg = avgBuffer(gz_buf);
-
-  // Filtro exponencial
-  ax_f = alpha * ax_avg + (1 - alpha) * ax_f;
-  ay_f = alpha * ay_avg + (1 - alpha) * ay_f;
-  az_f = alpha * az_avg + (1 - alpha) * az_f;
-  gx_f = alpha * gx_avg + (1 - alpha) * gx_f;
-  gy_f = alpha * gy_avg + (1 - alpha) * gy_f;
-  gz_f = alpha * gz_avg + (1 - alpha) * gz_f;
-
-  // Envía los datos filtrados
-  Serial.print("ACC:");
-  Serial.print((int)ax_f); Serial.print(",");
-  Serial.print((int)ay_f); Serial.print(",");
-  Serial.print((int)az_f); Serial.print(";");
-  Serial.print("GYRO:");
-  Serial.print((int)gx_f); Serial.print(",");
-  Serial.print((int)gy_f); Serial.print(",");
-  Serial.print((int)gz_f); Serial.println(";");
-  Serial1.print("ACC:");
-  Serial1.print((int)ax_f); Serial1.print(",");
-  Serial1.print((int)ay_f); Serial1.print(",");
-  Serial1.print((int)az_f); Serial1.print(";");
-  Serial1.print("GYRO:");
-  Serial1.print((int)gx_f); Serial1.print(",");
-  Serial1.print((int)gy_f); Serial1.print(",");
-  Serial1.print((int)gz_f); Serial1.println(";");
-  // Envía la imagen
-  camera_fb_t *fb = esp_camera_fb_get();
-  if (!fb) {
-    Serial.println("Error al capturar imagen");
+  // Comandos desde tierra por USB o por la radio
+  readCommands(Serial, cmd_usb);
+  readCommands(Serial1, cmd_radio);
+  checkBaudTimeout();
+
+  // Primero las muestras IMU acumuladas, luego a lo sumo un fragmento de imagen
+  flushImu();
+
+  // Prueba de enlace: tramas de prueba en lugar de imágenes
+  if (tx_fb == NULL && test_remaining > 0) {
+    sendTestFrame();
     return;
   }
-  Serial.write(0xAA);
-  Serial.write((fb->len >> 8) & 0xFF);
-  Serial.write(fb->len & 0xFF);
-  Serial.write(fb->buf, fb->len);
-  esp_camera_fb_return(fb);
 
-  delay(100); // Ajusta para la tasa de cuadros
-} 
\ No newline at end of file
+  // Captura una imagen nueva solo cuando se cumple el intervalo pedido desde tierra
+  if (tx_fb == NULL && millis() - last_frame_ms >= frame_interval_ms) {
+    camera_fb_t* fb = esp_camera_fb_get();
+    if (!fb) {
+      Serial.println("Error al capturar imagen");
+    } else {
+      last_frame_ms = millis();
+      FrameDecision decision = classifyFrame(fb);
+      if (decision == SEND_THUMB && !sendThumb(fb, last_frame_ms)) decision = SEND_FULL;
+      if (decision == SEND_REPEAT) sendRepeat(last_frame_ms);
+      if (decision == SEND_FULL) {
+        tx_fb = fb;
+        tx_capture_ms = last_frame_ms;
+        tx_offset = 0;
+        tx_frame_id++;
+        last_full_ms = last_frame_ms;
+        // Esta imagen pasa a ser la referencia de las siguientes
+        if (cur_pixels) memcpy(ref_luma, cur_luma, cur_pixels);
+        ref_pixels = cur_pixels;
+      } else {
+        esp_camera_fb_return(fb);
+      }
+    }
+  }
+  if (tx_fb != NULL) {
+    sendNextFragment();
+  } else {
+    delay(1);
+  }
+}
@@ -18,8 +18,42 @@
 #define HREF_GPIO_NUM     47
 #define PCLK_GPIO_NUM     13
 
+// Tramas binarias (big endian):
+//   0xAA 0x55 | tipo (1) | longitud (2) | datos | CRC32 (4)
+// El CRC32 es el de zlib y cubre tipo, longitud y datos.
+#define FRAME_JPEG 0x01
+#define MAX_PAYLOAD 60000
+
+uint32_t crc_table[256];
+
+void initCrcTable() {
+  for (uint32_t i = 0; i < 256; i++) {
+    uint32_t c = i;
+    for (int k = 0; k < 8; k++) c = (c & 1) ? (0xEDB88320 ^ (c >> 1)) : (c >> 1);
+    crc_table[i] = c;
+  }
+}
+
+uint32_t crc32Update(uint32_t crc, const uint8_t* data, size_t len) {
+  crc = ~crc;
+  for (size_t i = 0; i < len; i++) crc = crc_table[(crc ^ data[i]) & 0xFF] ^ (crc >> 8);
+  return ~crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* data, size_t len) {
+  if (len > MAX_PAYLOAD) return;
+  uint8_t header[5] = {0xAA, 0x55, type, (uint8_t)(len >> 8), (uint8_t)(len & 0xFF)};
+  uint32_t crc = crc32Update(0, header + 2, 3);
+  crc = crc32Update(crc, data, len);
+  uint8_t trailer[4] = {(uint8_t)(crc >> 24), (uint8_t)(crc >> 16), (uint8_t)(crc >> 8), (uint8_t)crc};
+  Serial.write(header, sizeof(header));
+  Serial.write(data, len);
+  Serial.write(trailer, sizeof(trailer));
+}
+
 void setup() {
   Serial.begin(115200);
+  initCrcTable();
   camera_config_t config;
   config.ledc_channel = LEDC_CHANNEL_0;
   config.ledc_timer = LEDC_TIMER_0;
@@ -57,10 +91,7 @@ void loop() {
     Serial.println("Error al capturar imagen");
     return;
   }
-  Serial.write(0xAA);
-  Serial.write((fb->len >> 8) & 0xFF);
-  Serial.write(fb->len & 0xFF);
-  Serial.write(fb->buf, fb->len);
+  sendFrame(FRAME_JPEG, fb->buf, fb->len);
   esp_camera_fb_return(fb);
   delay(100); // Ajusta para la tasa de cuadros
 } 
\ No newline at end of file
@@ -1,24 +1,24 @@
+import sys
 import serial
 import time
+from cansat_protocol import SerialPacketReader, PKT_IMAGE
 
-ser = serial.Serial('COM11', 115200, timeout=5)  # Cambia el puerto si es necesario
+# Puerto del CanSat o, con cansat_broker.py corriendo, 'socket://127.0.0.1:5760'
+PORT = sys.argv[1] if len(sys.argv) > 1 else 'COM11'
+ser = serial.serial_for_url(PORT, 115200, timeout=5)
+reader = SerialPacketReader(ser)
 img_count = 0
 
 while True:
-    # Espera el byte de inicio
-    while ser.read(1) != b'\xAA':
-        pass
-    # Lee el tamaño de la imagen (2 bytes)
-    size_bytes = ser.read(2)
-    img_size = (size_bytes[0] << 8) | size_bytes[1]
-    # Lee la imagen
-    img_data = b''
-    while len(img_data) < img_size:
-        img_data += ser.read(img_size - len(img_data))
+    # Espera la siguiente trama válida (CRC y JPEG verificados); ignora las líneas de texto
+    packet = reader.read_packet()
+    if packet is None or packet[0] != PKT_IMAGE:
+        continue
+    img_data = packet[1]
     # Guarda la imagen
     filename = f'captura_{img_count}.jpg'
     with open(filename, 'wb') as f:
         f.write(img_data)
     print(f'Imagen guardada: {filename}')
     img_count += 1
-    # time.sleep(0.1)  # Descomenta si quieres limitar la tasa de guardado 
\ No newline at end of file
+    # time.sleep(0.1)  # Descomenta si quieres limitar la tasa de guardado 
@@ -12,20 +12,22 @@ from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
 from collections import deque
 import math
+from cansat_protocol import SerialPacketReader, PKT_IMU, PKT_IMAGE
+from cansat_imu import decode_imu_lines
 
 # Configura el puerto serial
-ser = serial.Serial('COM11', 115200, timeout=5)  # Cambia 'COM3' por tu puerto
+# Puerto del CanSat o, con cansat_broker.py corriendo, 'socket://127.0.0.1:5760'
+PORT = sys.argv[1] if len(sys.argv) > 1 else 'COM11'
+ser = serial.serial_for_url(PORT, 115200, timeout=5)
 
 def parse_mpu_line(line):
     # Espera formato: ACC:x,y,z;GYRO:x,y,z;
-    try:
-        acc = line.split('ACC:')[1].split(';')[0]
-        gyro = line.split('GYRO:')[1].split(';')[0]
-        ax, ay, az = [float(x) for x in acc.split(',')]
-        gx, gy, gz = [float(x) for x in gyro.split(',')]
-        return ax, ay, az, gx, gy, gz
-    except Exception:
-        return 0, 0, 0, 0, 0, 0
+    # Devuelve None si la línea no es válida (antes devolvía ceros y se colaban
+    # muestras falsas en la calibración y en los filtros)
+    raw, valid = decode_imu_lines([line])
+    if not valid[0]:
+        return None
+    return tuple(raw[0].tolist())
 
 class DataReceiver(threading.Thread):
     def __init__(self):
@@ -44,27 +46,22 @@ class DataReceiver(threading.Thread):
         self.noise = None
 
     def run(self):
+        reader = SerialPacketReader(ser)
         while self.running:
             try:
-                # Lee línea del MPU6050
-                mpu_line = ser.readline().decode(errors='ignore').strip()
-                if mpu_line.startswith("ACC:"):
+                # Siguiente línea del MPU6050 o imagen ya validada (CRC y JPEG)
+                packet = reader.read_packet(timeout=0.5)
+                if packet is None:
+                    continue
+                kind, data = packet
+                if kind == PKT_IMU:
                     if self.calibrating:
                         if self.calib_start is None:
                             self.calib_start = time.time()
-                        ax, ay, az, gx, gy, gz = parse_mpu_line(mpu_line)
-                        self.calib_samples.append([ax, ay, az, gx, gy, gz])
-                        # Lee y descarta la imagen para mantener el flujo
-                        while ser.read(1) != b'\xAA':
-                            pass
-                        size_bytes = ser.read(2)
-                        img_size = (size_bytes[0] << 8) | size_bytes[1]
-                        img_data = b''
-                        while len(img_data) < img_size:
-                            chunk = ser.read(img_size - len(img_data))
-                            if not chunk:
-                                break
-                            img_data += chunk
+                        values = parse_mpu_line(data)
+                        if values is None:
+                            continue
+                        self.calib_samples.append(list(values))
                         # Termina calibración si pasa el tiempo o si hay suficientes muestras
                         if (time.time() - self.calib_start > self.calib_time) or (len(self.calib_samples) >= self.calib_min_samples):
                             arr = np.array(self.calib_samples)
@@ -74,20 +71,11 @@ class DataReceiver(threading.Thread):
                             print("Calibración terminada. Offsets:", self.offsets, "Ruido:", self.noise)
                         continue
                     with self.lock:
-                        self.latest_mpu = mpu_line
-                    # Espera el byte de inicio de imagen
-                    while ser.read(1) != b'\xAA':
-                        pass
-                    size_bytes = ser.read(2)
-                    img_size = (size_bytes[0] << 8) | size_bytes[1]
-                    img_data = b''
-                    while len(img_data) < img_size:
-                        chunk = ser.read(img_size - len(img_data))
-                        if not chunk:
-                            break
-                        img_data += chunk
+                        self.latest_mpu = data
+                elif kind == PKT_IMAGE and not self.calibrating:
+                    # Durante la calibración las imágenes se descartan
                     with self.lock:
-                        self.latest_img = img_data
+                        self.latest_img = data
             except Exception as e:
                 print("Error en hilo de recepción:", e)
                 time.sleep(0.1)
@@ -223,9 +211,9 @@ class MainWindow(QWidget):
         timeout = time.time() + 5  # 5 segundos máximo para tomar muestras
         while len(samples) < 30 and time.time() < timeout:
             mpu_line, _ = self.data_receiver.get_latest()
-            if mpu_line and mpu_line != last_mpu_line:
-                ax, ay, az, gx, gy, gz = parse_mpu_line(mpu_line)
-                samples.append([ax, ay, az])
+            values = parse_mpu_line(mpu_line) if mpu_line and mpu_line != last_mpu_line else None
+            if values is not None:
+                samples.append(list(values[:3]))
                 last_mpu_line = mpu_line
             else:
                 time.sleep(0.01)
@@ -262,9 +250,10 @@ class MainWindow(QWidget):
         if self.calibrating:
             return  # No actualices visualización hasta terminar calibración
         mpu_line, img_data = self.data_receiver.get_latest()
-        if mpu_line:
+        values = parse_mpu_line(mpu_line) if mpu_line else None
+        if values is not None:
             self.mpu_label.setText("MPU6050: " + mpu_line)
-            ax, ay, az, gx, gy, gz = parse_mpu_line(mpu_line)
+            ax, ay, az, gx, gy, gz = values
             # Aplica offset y escala
             acc = np.array([ax, ay, az])
             acc = (acc - self.offsets) / self.scales
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Los módulos de la estación están en la raíz del repositorio
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture(scope='session')
+def jpegs():
+    """Las dos capturas de ejemplo del repositorio (bytes)."""
+    images = []
+    for name in ('captura.jpg', 'captura1.jpg'):
+        with open(os.path.join(REPO_DIR, name), 'rb') as f:
+            images.append(f.read())
+    return images
@@ -0,0 +1,86 @@
+"""Varianza de Allan: N y K conocidos en ruido sintético y capturas cortas."""
+import math
+
+import numpy as np
+import pytest
+
+from cansat_allan import (FLICKER_FACTOR, allan_deviation, cluster_sizes, format_report, noise_parameters,
+                          suggest_filter)
+
+RATE = 100.0
+N = 0.01        # ruido blanco (unidad/√Hz)
+K = 0.002       # random walk de tasa (unidad·√Hz)
+
+
+def white_plus_random_walk(seed, n=200000, rate=RATE):
+    """Ruido blanco de densidad N más un bias que camina con densidad K."""
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, N * math.sqrt(rate), n) + np.cumsum(rng.normal(0, K / math.sqrt(rate), n))
+
+
+def test_cluster_sizes():
+    m = cluster_sizes(20001)
+    assert m[0] == 1 and m[-1] == 10000
+    assert (np.diff(m) > 0).all()
+    assert len(cluster_sizes(2)) == 0
+
+
+def test_white_noise_slope():
+    x = np.random.default_rng(0).normal(0, 1.0, 50000)
+    taus, adev = allan_deviation(x, RATE, m=[1, 10, 100])
+    assert taus.tolist() == [0.01, 0.1, 1.0]
+    # Blanco: sigma(tau) = sigma / sqrt(m)
+    assert adev[:, 0] == pytest.approx([1.0, 1 / math.sqrt(10), 0.1], rel=0.05)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_recovers_known_noise(seed):
+    taus, adev = allan_deviation(white_plus_random_walk(seed), RATE)
+    params = noise_parameters(taus, adev[:, 0])
+    assert params.random_walk == pytest.approx(N, rel=0.05)
+    assert params.rate_random_walk == pytest.approx(K, rel=0.35)
+    # El mínimo cae cerca del cruce de las rectas (tau = sqrt(3) N / K)
+    assert 0.5 < params.bias_tau / (math.sqrt(3) * N / K) < 2
+    assert params.bias_instability == pytest.approx(adev[:, 0].min() / FLICKER_FACTOR)
+
+
+def test_channels_are_independent():
+    samples = np.column_stack([white_plus_random_walk(0, 50000), 3 * white_plus_random_walk(0, 50000)])
+    taus, adev = allan_deviation(samples, RATE)
+    assert np.allclose(adev[:, 1], 3 * adev[:, 0])
+    # Un desvío constante no cambia nada
+    assert np.allclose(allan_deviation(samples + 5.0, RATE)[1], adev)
+
+
+def test_short_capture_has_no_bias_instability():
+    # 4 s en reposo a 50 Hz: las curvas de los giroscopios bajan hasta el último tau
+    x = np.random.default_rng(0).normal(0, 0.1, (200, 6))
+    taus, adev = allan_deviation(x, 50.0)
+    params = [noise_parameters(taus, adev[:, c]) for c in range(6)]
+    for p in params[3:]:
+        assert p.bias_instability is None and p.bias_tau is None
+        assert p.random_walk == pytest.approx(0.1 / math.sqrt(50.0), rel=0.15)
+    suggestion = suggest_filter(params, 50.0)
+    assert all(v is not None for v in suggestion['noise'])
+    assert suggestion['time_constant_s'] is None and suggestion['alpha'] is None
+    assert 'no tiene mínimo interior' in format_report(params, suggestion, x.std(axis=0))
+
+
+def test_drifting_capture_has_no_minimum():
+    # Solo random walk (el CanSat no estaba quieto): la curva sube desde tau0
+    x = np.cumsum(np.random.default_rng(1).normal(0, 0.1, 200))
+    taus, adev = allan_deviation(x, 50.0)
+    params = noise_parameters(taus, adev[:, 0])
+    assert params.bias_instability is None
+    # Sin tramo -1/2 se usa sigma(tau0) * sqrt(tau0)
+    assert params.random_walk == pytest.approx(adev[0, 0] * math.sqrt(taus[0]))
+
+
+def test_filter_suggestion_from_the_gyro_minimum():
+    taus, adev = allan_deviation(np.column_stack([white_plus_random_walk(s, 100000) for s in range(6)]), RATE)
+    params = [noise_parameters(taus, adev[:, c]) for c in range(6)]
+    suggestion = suggest_filter(params, RATE)
+    tau = min(p.bias_tau for p in params[3:] if p.bias_tau is not None)
+    assert suggestion['time_constant_s'] == tau
+    assert suggestion['alpha'] == pytest.approx(tau / (tau + 1 / RATE))
+    assert suggestion['noise'][0] == pytest.approx(N * math.sqrt(RATE), rel=0.05)
@@ -0,0 +1,114 @@
+"""Broker: colas por cliente con descarte de lo más viejo y datagramas UDP."""
+import asyncio
+from types import SimpleNamespace
+
+from cansat_broker import MAX_DATAGRAM, Subscriber, TelemetryBroker, encode_packet
+from cansat_ingest import DEFAULT_STREAM, Packet
+from cansat_protocol import FRAGMENT_SIZE, PKT_IMAGE, PKT_IMU, JpegImage, StreamDecoder
+from cansat_stats import PerfStats
+
+
+class SlowWriter:
+    """StreamWriter de un cliente que no lee: drain() espera hasta release()."""
+
+    def __init__(self):
+        self.written = []
+        self.gate = asyncio.Event()
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 40000)
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        await self.gate.wait()
+
+    def release(self):
+        self.gate.set()
+
+    def close(self):
+        pass
+
+
+class FakeTransport:
+    def __init__(self):
+        self.datagrams = []
+
+    def sendto(self, data):
+        self.datagrams.append(data)
+
+
+def make_broker():
+    return TelemetryBroker(SimpleNamespace(stats=PerfStats()))
+
+
+def run_slow_client(max_packets, max_bytes, items):
+    """Encola `items` con el primero trabado en drain(); devuelve (cola, subscriber, escritos)."""
+    async def scenario():
+        writer = SlowWriter()
+        sub = Subscriber(writer, max_packets, max_bytes)
+        sender = asyncio.ensure_future(make_broker()._send_loop(sub))
+        sub.push(items[0])
+        await asyncio.sleep(0)
+        assert writer.written == [items[0]] and not sub.queue
+        for item in items[1:]:
+            sub.push(item)
+        queued = list(sub.queue)
+        writer.release()
+        while sub.queue or sub.sent < len(queued) + 1:
+            await asyncio.sleep(0)
+        sender.cancel()
+        return queued, sub, writer.written
+    return asyncio.run(scenario())
+
+
+def test_slow_client_keeps_the_newest_packets():
+    items = [b'linea%02d' % i for i in range(20)]
+    queued, sub, written = run_slow_client(4, 1 << 20, items)
+    assert queued == items[-4:]
+    assert sub.drops == 15
+    assert written == items[:1] + items[-4:]
+    assert sub.bytes == 0
+
+
+def test_slow_client_byte_cap():
+    items = [bytes(100)] * 3 + [b'x' * 250, b'y' * 50, b'z' * 50]
+    queued, sub, written = run_slow_client(100, 300, items)
+    assert queued == [b'y' * 50, b'z' * 50]
+    assert sub.drops == 3
+    # Un paquete más grande que el tope queda solo en la cola, no se pierde
+    queued, sub, written = run_slow_client(100, 300, [b'a', b'b', bytes(1000)])
+    assert queued == [bytes(1000)]
+    assert written[-1] == bytes(1000)
+
+
+def test_udp_sends_one_datagram_per_line_and_fragment(jpegs):
+    broker = make_broker()
+    broker.udp_transport = FakeTransport()
+    image = JpegImage(jpegs[0] * 20)
+    image.capture_ms = 1234
+    image.frame_id = 7
+    line = 'ACC:1,2,3;GYRO:4,5,6;SEQ:1;T:20;'
+    for kind, data in ((PKT_IMU, line), (PKT_IMAGE, image)):
+        broker._on_packet(Packet(DEFAULT_STREAM, 'usb', kind, None, 0.0, data))
+    broker._on_packet(Packet('cansat2', 'radio', PKT_IMU, None, 0.0, line))
+    datagrams = broker.udp_transport.datagrams
+    assert len(image) > MAX_DATAGRAM
+    assert len(datagrams) == 1 + -(-len(image) // FRAGMENT_SIZE)
+    assert max(len(d) for d in datagrams) <= MAX_DATAGRAM
+    assert b''.join(datagrams) == encode_packet(PKT_IMU, line) + encode_packet(PKT_IMAGE, image)
+    decoded = StreamDecoder().feed(b''.join(datagrams))
+    assert [kind for kind, _ in decoded] == [PKT_IMU, PKT_IMAGE]
+    assert decoded[1][1] == image and decoded[1][1].capture_ms == 1234
+    assert 'udp_oversize' not in broker.stats.counters
+    assert broker.stats.counters['broker_packets'] == 2
+
+
+def test_oversize_datagram_is_counted():
+    broker = make_broker()
+    broker.udp_transport = FakeTransport()
+    text = 'x' * (MAX_DATAGRAM + 1)
+    broker._on_packet(Packet(DEFAULT_STREAM, 'usb', PKT_IMU, None, 0.0, text))
+    assert broker.udp_transport.datagrams == []
+    assert broker.stats.counters['udp_oversize'] == 1
@@ -0,0 +1,92 @@
+"""Exportación de grabaciones: AVI MJPEG en la grilla de cuadros/s y CSV del IMU."""
+import struct
+
+import pytest
+
+from cansat_export import IMU_HEADER, export_avi, export_imu_csv, jpeg_size
+from cansat_protocol import PKT_IMAGE, PKT_IMU, PKT_REPEAT, FrameRef, JpegImage
+from cansat_recorder import Recorder
+
+
+def image(data, capture_ms):
+    jpeg = JpegImage(data)
+    jpeg.capture_ms = capture_ms
+    return jpeg
+
+
+def record(path, packets):
+    recorder = Recorder(str(path))
+    for kind, data, t in packets:
+        recorder.add(kind, data, t)
+    recorder.close()
+    return str(path)
+
+
+def avi_chunks(path):
+    """Cuadros '00dc' del AVI (bytes de cada uno) y cantidad de entradas del índice."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == b'RIFF' and data[8:12] == b'AVI '
+    assert struct.unpack_from('<I', data, 4)[0] == len(data) - 8
+    movi = data.index(b'movi') + 4
+    frames = []
+    i = movi
+    while data[i:i + 4] == b'00dc':
+        size = struct.unpack_from('<I', data, i + 4)[0]
+        frames.append(data[i + 8:i + 8 + size])
+        i += 8 + size + (size & 1)
+    assert data[i:i + 4] == b'idx1'
+    entries = struct.unpack_from('<I', data, i + 4)[0] // 16
+    return frames, entries
+
+
+def test_faster_images_are_dropped(tmp_path, jpegs):
+    # 40 imágenes/s en un AVI de 20 cuadros/s: una de cada dos ocupa una ranura ya escrita
+    packets = [(PKT_IMAGE, image(jpegs[i % 2], 10000 + 25 * i), 100 + 0.025 * i) for i in range(400)]
+    rec = record(tmp_path / 'vuelo.cnr', packets)
+    info = export_avi(rec, str(tmp_path / 'vuelo.avi'), fps=20)
+    assert info['images'] == 201
+    assert info['dropped'] == 199
+    assert info['frames'] == 201
+    assert info['duration_s'] == pytest.approx(10.05)
+    assert (info['width'], info['height']) == max(jpeg_size(j) for j in jpegs)
+    frames, entries = avi_chunks(info['output'])
+    assert len(frames) == entries == 201
+    assert all(frame in jpegs for frame in frames)
+
+
+def test_gaps_become_repeats_and_restart_reanchors(tmp_path, jpegs):
+    packets = [(PKT_IMAGE, image(jpegs[0], 5000), 0.0),
+               (PKT_IMAGE, image(jpegs[1], 5500), 0.5),
+               (PKT_REPEAT, FrameRef(1, 5700), 0.7),
+               # Reinicio del CanSat: la hora de captura vuelve a cero
+               (PKT_IMAGE, image(jpegs[0], 100), 0.8)]
+    rec = record(tmp_path / 'vuelo.cnr', packets)
+    info = export_avi(rec, str(tmp_path / 'vuelo.avi'), fps=10)
+    frames, _ = avi_chunks(info['output'])
+    assert info['images'] == 3 and info['dropped'] == 0
+    # 0, vacíos 1-4, 5; el reinicio sigue en la ranura 6 y la repetición deja un vacío en la 7
+    assert [len(f) > 0 for f in frames] == [True] + [False] * 4 + [True, True, False]
+
+
+def test_small_backward_jitter_does_not_reanchor(tmp_path, jpegs):
+    packets = [(PKT_IMAGE, image(jpegs[0], ms), ms / 1000) for ms in (0, 100, 90, 200)]
+    rec = record(tmp_path / 'vuelo.cnr', packets)
+    info = export_avi(rec, str(tmp_path / 'vuelo.avi'), fps=10)
+    assert info['frames'] == 3
+    assert info['dropped'] == 1
+
+
+def test_imu_csv(tmp_path):
+    lines = [f'ACC:{i},0,16384;GYRO:0,0,{-i};SEQ:{i};T:{1000 + 20 * i};' for i in range(300)]
+    del lines[100:110]  # hueco de 200 ms: se rellena
+    packets = [(PKT_IMU, line, 5.0 + k * 0.02) for k, line in enumerate(lines)]
+    rec = record(tmp_path / 'vuelo.cnr', packets)
+    info = export_imu_csv(rec, str(tmp_path / 'imu.csv'), rate=50)
+    with open(info['output']) as f:
+        rows = f.read().splitlines()
+    assert rows[0] == IMU_HEADER
+    assert info['lines'] == 290
+    assert info['samples'] == len(rows) - 1 == 300
+    assert info['filled'] == 10
+    assert sum(row.endswith(',1') for row in rows[1:]) == 10
@@ -0,0 +1,106 @@
+"""Fase de vuelo: perfiles sintéticos a 50 Hz y estadísticas móviles por lotes."""
+import numpy as np
+import pytest
+
+from cansat_flight import (FREEFALL_HOLD, LANDED_HOLD, LAUNCH_HOLD, LONG_WINDOW, SETTLED_HOLD,
+                           FlightPhaseDetector, RollingStats)
+
+RATE = 50
+
+
+def segment(rng, duration, acc, dps=0.0, acc_noise=0.005, gyro_noise=0.3):
+    """Muestras (n, 6) con |a| ~ acc (g) sobre z y |w| ~ dps (°/s) con ruido."""
+    n = int(round(duration * RATE))
+    samples = np.zeros((n, 6))
+    samples[:, 2] = acc
+    samples[:, :3] += rng.normal(0, acc_noise, (n, 3))
+    samples[:, 3:] = dps / np.sqrt(3) + rng.normal(0, gyro_noise, (n, 3))
+    return samples
+
+
+def rocket_flight(seed=0):
+    """Plataforma 5 s, empuje 2 s, caída libre 2 s, golpe del paracaídas, descenso y suelo."""
+    rng = np.random.default_rng(seed)
+    samples = np.vstack([segment(rng, 5, 1.0),
+                         segment(rng, 2, 2.0, 20, 0.02, 2),
+                         segment(rng, 2, 0.05, 50, 0.02, 5),
+                         segment(rng, 0.1, 2.0, 100),
+                         segment(rng, 10.9, 1.0, 30, 0.1, 10),
+                         segment(rng, 6, 1.0)])
+    return np.arange(len(samples)) / RATE, samples
+
+
+def test_rocket_flight_events():
+    t, samples = rocket_flight()
+    detector = FlightPhaseDetector()
+    events = detector.feed(t, samples)
+    assert [(e.name, e.phase) for e in events] == [('launch', 'ascent'), ('apogee', 'apogee'),
+                                                   ('deploy', 'descent'), ('landed', 'landed')]
+    # Cada evento llega después de su hold (más lo que tarda en moverse la media de 5 muestras)
+    times = [e.t for e in events]
+    assert times[0] == pytest.approx(5.0 + LAUNCH_HOLD, abs=0.08)
+    assert times[1] == pytest.approx(7.0 + FREEFALL_HOLD, abs=0.1)
+    assert times[2] == pytest.approx(9.0, abs=0.01)
+    assert times[3] == pytest.approx(20.0 + LONG_WINDOW / RATE + LANDED_HOLD, abs=0.1)
+    assert detector.phase == 'landed' and detector.events == events
+
+
+def test_drop_with_gentle_parachute():
+    # Soltado desde un dron: plataforma -> caída libre; el paracaídas abre sin golpe
+    rng = np.random.default_rng(1)
+    samples = np.vstack([segment(rng, 3, 1.0), segment(rng, 1.5, 0.1, 30, 0.02, 3),
+                         segment(rng, 8, 1.0, 20, 0.05, 5), segment(rng, 5, 1.0)])
+    t = 100.0 + np.arange(len(samples)) / RATE
+    events = FlightPhaseDetector().feed(t, samples)
+    assert [e.name for e in events] == ['apogee', 'deploy', 'landed']
+    assert events[0].t == pytest.approx(103.0 + FREEFALL_HOLD, abs=0.1)
+    assert events[1].t == pytest.approx(104.5 + SETTLED_HOLD, abs=0.1)
+
+
+def test_apogee_from_altitude_without_free_fall():
+    # Motor que se apaga y el CanSat sigue a ~1 g: el apogeo lo da la altitud
+    rng = np.random.default_rng(2)
+    samples = np.vstack([segment(rng, 2, 1.0), segment(rng, 1, 2.0, 20, 0.02, 2),
+                         segment(rng, 6, 1.0, 20, 0.05, 5)])
+    t = np.arange(len(samples)) / RATE
+    altitude = np.where(t < 6.0, 20.0 * np.maximum(t - 2.0, 0.0), 80.0 - 5.0 * (t - 6.0))
+    events = FlightPhaseDetector().feed(t, samples, altitude)
+    assert [e.name for e in events] == ['launch', 'apogee', 'deploy']
+    # Baja APOGEE_DROP_M (3 m) a 5 m/s: 0.6 s después del máximo, más el hold
+    assert events[1].t == pytest.approx(6.6 + FREEFALL_HOLD, abs=0.05)
+    # Ya a ~1 g: descenso con paracaídas tras SETTLED_HOLD
+    assert events[2].t == pytest.approx(events[1].t + SETTLED_HOLD, abs=0.05)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_events_do_not_depend_on_batch_size(seed):
+    t, samples = rocket_flight()
+    expected = FlightPhaseDetector().feed(t, samples)
+    rng = np.random.default_rng(seed)
+    detector = FlightPhaseDetector()
+    events = []
+    start = 0
+    while start < len(t):
+        end = start + int(rng.integers(1, 120))
+        events += detector.feed(t[start:end], samples[start:end])
+        start = end
+    assert events == expected
+
+
+def test_rolling_stats_match_a_full_window():
+    rng = np.random.default_rng(3)
+    x = rng.normal(1.0, 0.2, 500)
+    stats = RollingStats(7)
+    means, variances = [], []
+    for chunk in np.array_split(x, [1, 2, 5, 40, 41, 300]):
+        mean, var = stats.update(chunk)
+        means.append(mean)
+        variances.append(var)
+    mean, var = np.concatenate(means), np.concatenate(variances)
+    # Al comienzo la ventana se completa repitiendo la primera muestra
+    padded = np.concatenate([np.full(6, x[0]), x])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 7)
+    assert np.allclose(mean, windows.mean(axis=1))
+    assert np.allclose(var, windows.var(axis=1), atol=1e-12)
+    stats.reset()
+    assert np.allclose(stats.update(x[:3])[0], [x[0], (6 * x[0] + x[1]) / 7, (5 * x[0] + x[1] + x[2]) / 7])
@@ -0,0 +1,146 @@
+"""Propiedades de decode_imu_lines sobre líneas válidas, fuera de rango y corruptas,
+y la interpolación de actitud (slerp y AttitudeHistory).
+
+Los casos aleatorios usan random.Random con semilla fija: una falla se
+reproduce con la misma semilla.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from cansat_imu import (INT16_MAX, INT16_MIN, AttitudeHistory, decode_imu_lines, euler_to_quat, quat_to_euler,
+                        slerp)
+
+SEEDS = range(4)
+
+
+def random_imu_line(rng, limit=INT16_MAX):
+    values = [rng.randint(-limit - 1, limit) for _ in range(6)]
+    line = 'ACC:%d,%d,%d;GYRO:%d,%d,%d;' % tuple(values)
+    if rng.random() < 0.7:
+        line += 'SEQ:%d;T:%d;' % (rng.randrange(1 << 32), rng.randrange(1 << 32))
+    return line, values
+
+
+def mutate(rng, line):
+    """Corrompe una línea como lo haría un enlace ruidoso."""
+    chars = list(line)
+    for _ in range(rng.randint(1, 3)):
+        op = rng.randrange(4)
+        i = rng.randrange(len(chars) + 1)
+        if op == 0 and chars:
+            del chars[min(i, len(chars) - 1)]
+        elif op == 1:
+            chars.insert(i, rng.choice('0123456789-,;:ACGYROx \r\x00\xff'))
+        elif op == 2 and chars:
+            chars[min(i, len(chars) - 1)] = chr(rng.randrange(256))
+        else:
+            chars = chars[:i]
+    return ''.join(chars).replace('\n', '')
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_valid_lines_decode_exactly(seed):
+    rng = random.Random(seed)
+    lines, values = zip(*[random_imu_line(rng) for _ in range(2000)])
+    raw, valid = decode_imu_lines(list(lines))
+    assert valid.all()
+    assert raw.tolist() == [list(v) for v in values]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_out_of_range_values_are_never_valid(seed):
+    rng = random.Random(seed)
+    lines, values = zip(*[random_imu_line(rng, limit=999999) for _ in range(2000)])
+    raw, valid = decode_imu_lines(list(lines))
+    in_range = np.array([all(INT16_MIN <= v <= INT16_MAX for v in row) for row in values])
+    assert (valid == in_range).all()
+    assert not raw[~valid].any()
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_corrupt_lines_never_give_a_false_sample(seed):
+    rng = random.Random(seed)
+    lines = [mutate(rng, random_imu_line(rng)[0]) for _ in range(2000)]
+    raw, valid = decode_imu_lines(lines)
+    assert len(raw) == len(lines)
+    for line, row, ok in zip(lines, raw.tolist(), valid.tolist()):
+        if ok:
+            assert line.startswith('ACC:%d,%d,%d;GYRO:%d,%d,%d;' % tuple(row))
+        else:
+            assert not any(row)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_block_of_bytes_matches_list_of_lines(seed):
+    rng = random.Random(seed)
+    lines = [random_imu_line(rng)[0] if rng.random() < 0.5 else mutate(rng, random_imu_line(rng)[0])
+             for _ in range(1000)]
+    raw, valid = decode_imu_lines(lines)
+    raw_b, valid_b = decode_imu_lines('\r\n'.join(lines).encode('latin-1') + b'\r\n')
+    assert np.array_equal(raw, raw_b)
+    assert np.array_equal(valid, valid_b)
+
+
+def about_z(degrees):
+    half = np.radians(degrees) / 2
+    return np.array([np.cos(half), 0.0, 0.0, np.sin(half)])
+
+
+def same_rotation(q0, q1):
+    """q y -q son el mismo giro."""
+    return np.allclose(q0, q1, atol=1e-9) or np.allclose(q0, -q1, atol=1e-9)
+
+
+def test_slerp_between_known_rotations():
+    q = slerp(about_z(0), about_z(90), [0.0, 0.25, 0.5, 1.0])
+    for row, degrees in zip(q, (0, 22.5, 45, 90)):
+        assert np.allclose(row, about_z(degrees))
+    # Ángulo constante por unidad de f: no es una interpolación lineal renormalizada
+    q = slerp(euler_to_quat(0, 0, -60), euler_to_quat(0, 0, 120), 1 / 3)
+    assert np.allclose(quat_to_euler(q), (0, 0, 0), atol=1e-9)
+
+
+def test_slerp_takes_the_short_way():
+    # 350° por z es -10°: a mitad de camino desde 0° queda en -5°, no en 175°
+    q1 = about_z(350)
+    assert q1[0] < 0
+    q = slerp(about_z(0), q1, 0.5)
+    assert same_rotation(q, about_z(-5))
+    assert same_rotation(slerp(about_z(0), -q1, 0.5), q)
+    assert np.isclose(np.linalg.norm(q), 1.0)
+
+
+def test_slerp_nearly_equal_rotations():
+    q0, q1 = about_z(10), about_z(10 + 1e-5)
+    q = slerp(q0, q1, 0.5)
+    assert np.all(np.isfinite(q)) and np.isclose(np.linalg.norm(q), 1.0)
+    assert same_rotation(slerp(q0, q0, 0.3), q0)
+
+
+def test_history_interpolates_and_holds_the_ends():
+    history = AttitudeHistory()
+    assert history.at(1.0) is None and history.euler_at() is None and history.last_time is None
+    for i in range(11):
+        history.add(10.0 + 0.1 * i, 0.0, 0.0, 9.0 * i)     # yaw de 0 a 90° en 1 s
+    assert history.last_time == pytest.approx(11.0)
+    assert history.euler_at(10.55) == pytest.approx((0.0, 0.0, 49.5))
+    # Fuera del rango guardado se devuelve la muestra del extremo
+    assert history.euler_at(5.0) == pytest.approx((0.0, 0.0, 0.0), abs=1e-9)
+    assert history.euler_at(99.0) == pytest.approx((0.0, 0.0, 90.0))
+    assert history.euler_at() == pytest.approx((0.0, 0.0, 90.0))
+    quats = history.at([5.0, 10.05, 99.0])
+    assert quats.shape == (3, 4)
+    assert same_rotation(quats[1], euler_to_quat(0, 0, 4.5))
+
+
+def test_history_keeps_the_sign_continuous_and_restarts():
+    history = AttitudeHistory()
+    history.add(0.0, 0.0, 0.0, 170.0)
+    history.add(0.1, 0.0, 0.0, -170.0)                      # cruza ±180°
+    assert abs(history.euler_at(0.05)[2]) == pytest.approx(180.0)
+    # El reloj vuelve atrás (reinicio del CanSat): se empieza de nuevo
+    history.add(0.05, 10.0, 0.0, 0.0)
+    assert len(history) == 1
+    assert history.euler_at(-1.0) == pytest.approx((10.0, 0.0, 0.0))
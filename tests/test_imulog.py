@@ -0,0 +1,116 @@
+"""Registro compacto (.cimu): zigzag, varint, bits y bloques ida y vuelta."""
+import os
+
+import numpy as np
+import pytest
+
+from cansat_imulog import (COLUMNS, IMULOG_MAGIC, ImuLogWriter, bit_width, decode_log, encode_log,
+                           format_line, load_lines, pack_bits, read_imu_log, read_index, rows_from_lines,
+                           unpack_bits, varint_decode, varint_encode, zigzag_decode, zigzag_encode)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEEDS = range(4)
+
+
+def random_rows(rng, n, start_ms=0):
+    """Filas (n, 8) como las de un vuelo: hora creciente, SEQ consecutivo y cuentas int16."""
+    rows = np.empty((n, len(COLUMNS)), np.int64)
+    rows[:, 0] = start_ms + np.cumsum(rng.integers(15, 26, n))
+    rows[:, 1] = np.arange(n)
+    rows[:, 2:] = np.clip(np.cumsum(rng.integers(-300, 301, (n, 6)), axis=0), -32768, 32767)
+    # Saltos grandes de vez en cuando (golpes, reinicio del SEQ)
+    jumps = rng.random(n) < 0.01
+    rows[jumps, 2:] = rng.integers(-32768, 32768, (int(jumps.sum()), 6))
+    rows[rng.random(n) < 0.05, 1] = -1
+    return rows
+
+
+def test_zigzag_and_varint_extremes():
+    values = np.array([0, 1, -1, 63, -64, 64, 2 ** 31 - 1, -2 ** 31, 2 ** 62, -2 ** 62, 2 ** 63 - 1, -2 ** 63],
+                      np.int64)
+    zig = zigzag_encode(values)
+    assert np.array_equal(zigzag_decode(zig), values)
+    assert np.array_equal(varint_decode(varint_encode(zig)), zig)
+    # Los valores chicos ocupan un byte
+    assert len(varint_encode(zigzag_encode(np.array([0, -1, 1, -64, 63], np.int64)))) == 5
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_bit_packing_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    widths = rng.integers(0, 65, 500).astype(np.uint8)
+    values = rng.integers(0, 2 ** 63, 500, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    values = np.where(widths == 64, values, values & ((np.uint64(1) << widths.astype(np.uint64)) - np.uint64(1)))
+    assert (bit_width(values) <= widths).all()
+    data = pack_bits(values, widths)
+    assert len(data) == (int(widths.astype(int).sum()) + 7) // 8
+    assert np.array_equal(unpack_bits(data, widths), values)
+    with pytest.raises(ValueError):
+        unpack_bits(data + b'\0', widths)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_log_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    rows = random_rows(rng, int(rng.integers(1, 3000)))
+    block = int(rng.integers(1, 600))
+    assert np.array_equal(decode_log(encode_log(rows, block)), rows)
+
+
+def test_extreme_values_round_trip():
+    # Diferencias que desbordan int64: se guardan módulo 2**64 y vuelven exactas
+    rng = np.random.default_rng(5)
+    rows = rng.integers(-2 ** 63, 2 ** 63 - 1, (300, len(COLUMNS)), dtype=np.int64, endpoint=True)
+    rows[:, 2:] = rng.integers(-32768, 32768, (300, 6))
+    rows[::7] = [2 ** 63 - 1, -2 ** 63, 32767, -32768, 32767, -32768, 32767, -32768]
+    assert np.array_equal(decode_log(encode_log(rows, 100)), rows)
+
+
+def test_truncated_log_keeps_whole_blocks():
+    rows = random_rows(np.random.default_rng(0), 1000)
+    data = encode_log(rows, 300)
+    decoded = decode_log(data[:-5])
+    assert np.array_equal(decoded, rows[:900])
+    assert len(decode_log(IMULOG_MAGIC)) == 0
+
+
+def test_writer_and_time_range(tmp_path):
+    rows = random_rows(np.random.default_rng(1), 2500, start_ms=1000)
+    path = str(tmp_path / 'vuelo.cimu')
+    writer = ImuLogWriter(path, block=256)
+    # Lotes de tamaño irregular, como llegan a la estación
+    for start in range(0, len(rows), 97):
+        batch = rows[start:start + 97]
+        writer.add(batch[:, 0], batch[:, 1], batch[:, 2:])
+    writer.close()
+    assert np.array_equal(read_imu_log(path), rows)
+    index = read_index(path)
+    assert [info.count for info in index] == [256] * 9 + [196]
+    start_ms, end_ms = rows[700, 0], rows[1800, 0]
+    part = read_imu_log(path, start_ms, end_ms)
+    assert np.array_equal(part, rows[(rows[:, 0] >= start_ms) & (rows[:, 0] <= end_ms)])
+
+
+def test_text_lines_round_trip():
+    lines = ['ACC:12,-34,16384;GYRO:5,-6,7;SEQ:42;T:123456;',
+             'ACC:1,2,3;GYRO:4,5,6;T:123476;',
+             'ACC:1,2,3;GYRO:4,5,6;SEQ:43;',
+             'ACC:-1,-2,-3;GYRO:-4,-5,-6;',
+             'basura',
+             'ACC:99999,0,0;GYRO:0,0,0;SEQ:44;T:123496;']
+    rows = rows_from_lines(lines)
+    assert len(rows) == 4
+    # Sin T: ni SEQ se guarda -1 y no se inventan al volver a texto
+    assert rows[:, :2].tolist() == [[123456, 42], [123476, -1], [-1, 43], [-1, -1]]
+    rows = decode_log(encode_log(rows))
+    assert [format_line(row) for row in rows.tolist()] == lines[:4]
+
+
+def test_sample_log_is_ten_times_smaller():
+    path = os.path.join(REPO_DIR, 'log1.csv')
+    lines = load_lines(path)
+    data = encode_log(rows_from_lines(lines))
+    text = sum(len(line) + 1 for line in lines)
+    assert text / len(data) >= 10
+    assert [format_line(row) for row in decode_log(data).tolist()] == lines
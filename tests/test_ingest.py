@@ -0,0 +1,277 @@
+"""IngestEngine: reconexión con espera exponencial, puertos USB que cambian de nombre
+y descarte de repetidos entre radios (Deduplicator)."""
+import asyncio
+import os
+import time
+from collections import namedtuple
+
+import pytest
+import serial
+
+import cansat_ingest
+import cansat_link
+from cansat_ingest import (COUNTER_MOD, RECONNECT_MAX_S, RECONNECT_MIN_S, RESTART_MS, RESTART_SEQ, STATE_FAILED,
+                           STATE_OPEN, STATE_RECONNECTING, Deduplicator, IngestEngine)
+from cansat_protocol import PKT_GAP, PKT_IMU
+
+PortInfo = namedtuple('PortInfo', 'device vid pid serial_number')
+
+
+def imu_line(seq, t_ms=None):
+    return f'ACC:1,2,3;GYRO:4,5,6;SEQ:{seq};T:{seq * 20 if t_ms is None else t_ms};'
+
+
+class FakeSerial:
+    """Puerto abierto: un pipe le da un fd real para add_reader."""
+
+    def __init__(self, port):
+        self.port = port
+        self.read_fd, self.write_fd = os.pipe()
+        self.is_open = True
+
+    def fileno(self):
+        return self.read_fd
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, n):
+        return b''
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        if self.is_open:
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+        self.is_open = False
+
+
+class FakeUsb:
+    """Dispositivos USB conectados: comports() y open_port() los ven."""
+
+    def __init__(self, monkeypatch):
+        self.devices = {}           # nombre -> PortInfo
+        self.opened = []
+        monkeypatch.setattr(cansat_link.serial.tools.list_ports, 'comports', lambda: list(self.devices.values()))
+        monkeypatch.setattr(cansat_ingest, 'open_port', self.open_port)
+
+    def plug(self, device, serial_number='CANSAT1'):
+        self.devices[device] = PortInfo(device, 0x10C4, 0xEA60, serial_number)
+
+    def unplug(self):
+        self.devices.clear()
+
+    def open_port(self, port, baudrate, timeout=0):
+        if port not in self.devices:
+            raise serial.SerialException(f"could not open port {port}")
+        ser = FakeSerial(port)
+        self.opened.append(ser)
+        return ser
+
+
+@pytest.fixture
+def usb(monkeypatch):
+    fake = FakeUsb(monkeypatch)
+    yield fake
+    for ser in fake.opened:
+        ser.close()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Esperas pedidas por la reconexión; vuelven enseguida."""
+    waited = []
+
+    async def sleep(delay):
+        waited.append(delay)
+    monkeypatch.setattr(cansat_ingest.asyncio, 'sleep', sleep)
+    return waited
+
+
+def started_engine(usb):
+    """Motor con la fuente USB abierta y una radio en el mismo stream (deduplica)."""
+    usb.plug('/dev/ttyUSB0')
+    engine = IngestEngine(queue_size=0)
+    source = engine.add_source('/dev/ttyUSB0', name='usb')
+    engine.add_source('/dev/ttyRADIO', name='radio')
+    engine.running = True
+    engine.loop = asyncio.new_event_loop()
+    source.open()
+    engine._watch(source)
+    return engine, source
+
+
+def run_reconnect(engine, source, usb, failures, rename_to='/dev/ttyUSB1'):
+    """Hace caer la fuente; el dispositivo vuelve con otro nombre tras `failures` intentos."""
+    attempts = [0]
+    open_source = engine._open_source
+
+    def counted(src):
+        attempts[0] += 1
+        if attempts[0] > failures:
+            usb.plug(rename_to)
+        open_source(src)
+    engine._open_source = counted
+    usb.unplug()
+    engine._source_failed(source, serial.SerialException('fin de datos'))
+    assert source.state == STATE_RECONNECTING
+    loop = engine.loop
+    loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop)))
+    loop.close()
+    return attempts[0]
+
+
+def test_backoff_doubles_up_to_the_cap(usb, delays):
+    engine, source = started_engine(usb)
+    packets = []
+    engine.listeners.append(packets.append)
+    attempts = run_reconnect(engine, source, usb, failures=7)
+    assert attempts == 8
+    assert delays == [RECONNECT_MIN_S, 0.5, 1.0, 2.0, 4.0, RECONNECT_MAX_S, RECONNECT_MAX_S, RECONNECT_MAX_S]
+    # Reencontrado por VID/PID y número de serie con su nombre nuevo
+    assert source.port == '/dev/ttyUSB1'
+    assert source.state == STATE_OPEN and source.is_open
+    assert source.counters['reconnects'] == 1
+    assert [p.kind for p in packets] == [PKT_GAP]
+    assert packets[0].data.source == 'usb'
+
+
+def test_long_lived_port_retries_at_once(usb, delays):
+    engine, source = started_engine(usb)
+    source.opened_at = time.monotonic() - RECONNECT_MAX_S - 1
+    assert run_reconnect(engine, source, usb, failures=1) == 2
+    # Primer intento sin esperar; recién después de fallar empieza la espera
+    assert delays == [RECONNECT_MIN_S]
+    assert source.backoff == RECONNECT_MIN_S
+
+
+def test_other_device_is_not_taken(usb, delays):
+    engine, source = started_engine(usb)
+    attempts = [0]
+    open_source = engine._open_source
+
+    def counted(src):
+        attempts[0] += 1
+        if attempts[0] == 2:
+            usb.plug('/dev/ttyUSB1', serial_number='OTRO')
+        if attempts[0] == 4:
+            usb.plug('/dev/ttyUSB2')
+        open_source(src)
+    engine._open_source = counted
+    usb.unplug()
+    engine._source_failed(source, serial.SerialException('fin de datos'))
+    engine.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(engine.loop)))
+    engine.loop.close()
+    assert source.port == '/dev/ttyUSB2'
+    assert attempts[0] == 4
+
+
+def test_dedup_window_survives_relocation(usb, delays):
+    engine, source = started_engine(usb)
+    accepted = []
+    engine.listeners.append(lambda p: p.kind == PKT_IMU and accepted.append(p.seq))
+    engine._dispatch(source, [(PKT_IMU, imu_line(seq)) for seq in range(10)])
+    run_reconnect(engine, source, usb, failures=2)
+    # El CanSat no se reinició: la otra radio o el buffer del USB repiten 5-9
+    engine._dispatch(source, [(PKT_IMU, imu_line(seq)) for seq in range(5, 15)])
+    assert accepted == list(range(15))
+    assert source.counters['duplicates'] == 5
+
+
+def test_first_open_failure_is_not_retried(usb, delays):
+    engine = IngestEngine(queue_size=0)
+    source = engine.add_source('/dev/ttyUSB0')
+    engine.running = True
+    engine.loop = asyncio.new_event_loop()
+    engine.loop.run_until_complete(engine._connect(source))
+    engine.loop.close()
+    assert source.state == STATE_FAILED
+    assert 'ttyUSB0' in source.error
+    assert delays == []
+
+
+def feed(dedup, lines):
+    """(seq, T:) por check_restart y is_new, como _dispatch; devuelve las secuencias aceptadas."""
+    accepted = []
+    for seq, t_ms in lines:
+        if dedup.is_stale(seq, t_ms):
+            continue
+        dedup.check_restart(seq, t_ms)
+        if dedup.is_new(('imu', seq)):
+            accepted.append(seq)
+    return accepted
+
+
+def test_dedup_within_the_window():
+    dedup = Deduplicator(window=4)
+    assert feed(dedup, [(s, 20 * s) for s in (1, 2, 3, 2, 1, 4)]) == [1, 2, 3, 4]
+    # Fuera de la ventana se olvida (y un retroceso corto no es reinicio)
+    assert feed(dedup, [(5, 100), (1, 20)]) == [5, 1]
+    assert dedup.last_seq == 5 and dedup.previous is None
+
+
+def test_counter_wraparound_is_not_a_restart():
+    dedup = Deduplicator()
+    top = COUNTER_MOD - 1
+    lines = [(top - 2, top - 40), (top - 1, top - 20), (top, top), (0, 19), (1, 39)]
+    assert feed(dedup, lines) == [top - 2, top - 1, top, 0, 1]
+    assert dedup.last_seq == 1 and dedup.last_t == 39
+    # La otra radio repite las de antes de la vuelta: siguen en la ventana
+    assert feed(dedup, lines[1:3]) == []
+    assert dedup.previous is None
+
+
+def test_real_restart_forgets_the_window():
+    dedup = Deduplicator()
+    assert feed(dedup, [(s, 100000 + 20 * s) for s in range(5000, 5010)]) == list(range(5000, 5010))
+    assert dedup.check_restart(0, 400)
+    assert dedup.previous == (5009, 200180)
+    # Tras el reinicio SEQ vuelve a empezar y no choca con lo anterior
+    assert feed(dedup, [(s, 400 + 20 * s) for s in range(0, 5)]) == [0, 1, 2, 3, 4]
+    # Un retroceso de T: solo (SEQ ausente) también es reinicio
+    dedup = Deduplicator()
+    feed(dedup, [(None, 50000), (None, 50020)])
+    assert dedup.check_restart(None, 50020 - RESTART_MS - 1)
+    assert not Deduplicator().check_restart(0, 0)
+
+
+def test_stale_line_after_restart_is_not_a_second_restart():
+    dedup = Deduplicator()
+    feed(dedup, [(s, 100000 + 20 * s) for s in range(5000, 5010)])
+    assert feed(dedup, [(s, 400 + 20 * s) for s in range(0, 4)]) == [0, 1, 2, 3]
+    # La radio lenta entrega una línea vieja: se descarta sin mover SEQ/T:
+    assert dedup.is_stale(5008, 200160)
+    assert feed(dedup, [(5008, 200160)]) == []
+    assert dedup.last_seq == 3
+    # y la siguiente nueva no parece otro reinicio (la ventana sigue con 0-3)
+    assert not dedup.check_restart(4, 480)
+    assert feed(dedup, [(2, 440), (5, 500)]) == [5]
+
+
+def test_forward_jump_after_the_window_is_not_stale():
+    dedup = Deduplicator(window=8)
+    feed(dedup, [(s, 20 * s) for s in range(100, 110)])
+    feed(dedup, [(s, 20 * s) for s in range(0, 20)])
+    assert dedup.previous is None
+    # Corte largo de radio: SEQ salta hacia adelante y se acepta
+    assert not dedup.is_stale(105, 2100)
+    assert feed(dedup, [(105 + RESTART_SEQ, 20 * (105 + RESTART_SEQ))]) == [105 + RESTART_SEQ]
+
+
+def test_engine_drops_stale_lines_from_the_slow_radio():
+    engine = IngestEngine(queue_size=0)
+    usb = engine.add_source('/dev/ttyUSB0', name='usb')
+    radio = engine.add_source('/dev/ttyRADIO', name='radio')
+    accepted = []
+    engine.listeners.append(lambda p: accepted.append((p.source, p.seq)))
+    engine._dispatch(usb, [(PKT_IMU, imu_line(seq)) for seq in range(300, 310)])
+    engine._dispatch(usb, [(PKT_IMU, imu_line(seq)) for seq in range(0, 3)])
+    engine._dispatch(radio, [(PKT_IMU, imu_line(seq)) for seq in (308, 309, 0, 1, 2, 3)])
+    assert [seq for _, seq in accepted] == list(range(300, 310)) + [0, 1, 2, 3]
+    assert accepted[-1] == ('radio', 3)
+    assert engine.stats.counters['dedup_restarts'] == 1
+    assert engine.stats.counters['stale_lines'] == 2
+    assert radio.counters['duplicates'] == 5
@@ -0,0 +1,320 @@
+"""Enlace tierra-aire: enumeración de puertos en segundo plano, control
+adaptativo de la cámara (LinkController) con medidas sintéticas y
+negociación de velocidad contra un firmware simulado."""
+import threading
+import time
+
+import pytest
+
+import cansat_link
+from cansat_link import (BOOT_BAUD, FRAME_SIZES, INTERVAL_MAX, INTERVAL_MIN, INTERVAL_STEP, QUALITY_BEST,
+                         QUALITY_STEP, QUALITY_WORST, LinkController, PortIdentity, PortScanner, find_port,
+                         format_command, negotiate_baud, port_identity, probe)
+from cansat_protocol import PKT_IMAGE, PKT_IMU, PKT_TEXT, JpegImage
+
+
+class FakePort:
+    def __init__(self, device, vid=None, pid=None, serial_number=None):
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_port_identity_and_relocation():
+    ports = [FakePort('/dev/ttyS0'),
+             FakePort('/dev/ttyUSB3', 0x10C4, 0xEA60, 'A'),
+             FakePort('/dev/ttyUSB4', 0x10C4, 0xEA60, 'B')]
+    assert port_identity('/dev/ttyS0', ports) is None
+    identity = port_identity('/dev/ttyUSB4', ports)
+    assert identity == PortIdentity(0x10C4, 0xEA60, 'B')
+    assert find_port(identity, ports=ports) == '/dev/ttyUSB4'
+    # Sin número de serie vale cualquiera del mismo VID/PID, mejor el de antes
+    anonymous = PortIdentity(0x10C4, 0xEA60, None)
+    assert find_port(anonymous, prefer='/dev/ttyUSB4', ports=ports) == '/dev/ttyUSB4'
+    assert find_port(anonymous, prefer='/dev/ttyUSB9', ports=ports) == '/dev/ttyUSB3'
+    assert find_port(PortIdentity(0x303A, 1, None), ports=ports) is None
+
+
+def test_port_scanner_tracks_changes(monkeypatch):
+    devices = [FakePort('/dev/ttyUSB1'), FakePort('/dev/ttyACM0')]
+    scans = threading.Semaphore(0)
+
+    def comports():
+        scans.release()
+        return list(devices)
+    monkeypatch.setattr(cansat_link.serial.tools.list_ports, 'comports', comports)
+    scanner = PortScanner(interval=60)
+    scanner.start()
+    try:
+        wait_for(lambda: scanner.version == 1)
+        assert scanner.ports == ['/dev/ttyACM0', '/dev/ttyUSB1']
+        # Misma lista: la versión no cambia
+        scanner.scan_now()
+        assert scans.acquire(timeout=2) and scans.acquire(timeout=2)
+        assert scanner.version == 1
+        devices.pop()
+        scanner.scan_now()
+        wait_for(lambda: scanner.version == 2)
+        assert scanner.ports == ['/dev/ttyUSB1']
+    finally:
+        scanner.stop()
+    assert scanner.thread is None
+
+
+# --------- LinkController ---------
+PERIOD = 2.0
+
+
+def controller():
+    sent = []
+    ctrl = LinkController(sent.append, link_bytes_per_s=100000, target_imu_hz=40.0,
+                          target_latency=0.5, period=PERIOD)
+    ctrl._period_start = 0.0
+    return ctrl, sent
+
+
+def run_period(ctrl, start, imu_hz=40.0, latency=0.1, image_bytes=2000):
+    """Un periodo de tráfico desde `start` (hora local = hora del CanSat) y su tick."""
+    for i in range(round(imu_hz * PERIOD)):
+        t = start + i / imu_hz
+        ctrl.on_packet(PKT_IMU, f'ACC:0,0,16384;GYRO:0,0,0;SEQ:{i};T:{round(t * 1000)};', t)
+    for capture in (start + 0.2, start + 1.2):
+        image = JpegImage(bytes(image_bytes))
+        image.capture_ms = round(capture * 1000)
+        ctrl.on_packet(PKT_IMAGE, image, capture + latency)
+    return ctrl.tick(start + PERIOD)
+
+
+def ack(ctrl, change, t):
+    ctrl.on_packet(PKT_TEXT, 'ACK:' + ''.join(f'{k}={v};' for k, v in change.items()), t)
+
+
+def drive(ctrl, start, count, **traffic):
+    """`count` periodos confirmando cada comando; devuelve los cambios en orden."""
+    changes = []
+    for k in range(count):
+        t = start + k * PERIOD
+        change = run_period(ctrl, t, **traffic)
+        if change:
+            changes.append(change)
+            ack(ctrl, change, t + PERIOD)
+    return changes
+
+
+def test_link_controller_degrades_quality_then_size_then_interval():
+    ctrl, sent = controller()
+    start_quality = ctrl.quality
+    changes = drive(ctrl, 0.0, 40, imu_hz=20.0)
+    quality = list(range(start_quality + QUALITY_STEP, QUALITY_WORST, QUALITY_STEP))
+    sizes = FRAME_SIZES[:FRAME_SIZES.index('QVGA')][::-1]
+    intervals = list(range(INTERVAL_MIN + INTERVAL_STEP, INTERVAL_MAX + 1, INTERVAL_STEP))
+    assert changes == ([{'Q': q} for q in quality + [QUALITY_WORST]] + [{'FS': fs} for fs in sizes]
+                       + [{'INT': i} for i in intervals])
+    assert sent == [format_command(**c) for c in changes]
+    # Ya no queda nada que degradar
+    assert (ctrl.quality, ctrl.frame_size, ctrl.interval) == (QUALITY_WORST, 'QQVGA', INTERVAL_MAX)
+    assert drive(ctrl, 80.0, 3, imu_hz=20.0) == []
+
+    # Con holgura se recupera en orden inverso: intervalo, tamaño, calidad
+    changes = drive(ctrl, 100.0, 40)
+    assert [next(iter(c)) for c in changes] == (['INT'] * len(intervals) + ['FS'] * len(sizes)
+                                                + ['Q'] * len(range(QUALITY_WORST, QUALITY_BEST, -QUALITY_STEP)))
+    assert changes[-1] == {'Q': QUALITY_BEST}
+    assert (ctrl.quality, ctrl.frame_size, ctrl.interval) == (QUALITY_BEST, 'QVGA', INTERVAL_MIN)
+
+
+def test_link_controller_latency_alone_degrades():
+    ctrl, sent = controller()
+    assert run_period(ctrl, 0.0, latency=0.8) == {'Q': 17}
+    assert ctrl.last_metrics['imu_hz'] == 40.0
+    assert abs(ctrl.last_metrics['frame_latency_s'] - 0.8) < 1e-6
+
+
+def test_link_controller_hysteresis_band_sends_nothing():
+    ctrl, sent = controller()
+    ctrl.quality = 22
+    # IMU entre el 90 % y el objetivo, latencia entre la mitad y el objetivo,
+    # o el enlace por encima del 60 %: ni degrada ni mejora
+    assert run_period(ctrl, 0.0, imu_hz=37.5) is None
+    assert run_period(ctrl, 2.0, latency=0.4) is None
+    assert run_period(ctrl, 4.0, image_bytes=60000) is None
+    assert ctrl.last_metrics['utilization'] > 0.6
+    assert sent == []
+    # Fuera de la banda sí actúa
+    assert run_period(ctrl, 6.0) == {'Q': 17}
+
+
+def test_link_controller_waits_for_ack_and_drops_lost_commands():
+    ctrl, sent = controller()
+    # Antes de completar el periodo no se mide ni se decide
+    assert ctrl.tick(1.0) is None
+    assert run_period(ctrl, 0.0, imu_hz=20.0) == {'Q': 17}
+    assert ctrl.pending == {'Q': 17} and ctrl.quality == 12
+    # Sin ACK no se manda otro comando...
+    assert run_period(ctrl, 2.0, imu_hz=20.0) is None
+    assert run_period(ctrl, 4.0, imu_hz=20.0) is None
+    # ...hasta que pasan dos periodos y se da por perdido: se repite el mismo cambio
+    assert run_period(ctrl, 6.0, imu_hz=20.0) == {'Q': 17}
+    assert len(sent) == 2
+    # El ACK actualiza el estado y libera el próximo cambio
+    ack(ctrl, {'Q': 17, 'FS': 'QVGA', 'INT': 100}, 8.5)
+    assert ctrl.pending is None and ctrl.quality == 17
+    assert run_period(ctrl, 8.0, imu_hz=20.0) == {'Q': 22}
+
+
+def test_link_controller_holds_a_period_after_each_command():
+    ctrl, sent = controller()
+    assert run_period(ctrl, 0.0, imu_hz=20.0) == {'Q': 17}
+    ack(ctrl, {'Q': 17}, 2.1)
+    assert ctrl._hold_until == 2.0 + PERIOD
+    # Un periodo medido que termina antes de la espera no decide
+    ctrl._period_start = 1.9
+    assert ctrl.tick(3.9) is None
+    assert run_period(ctrl, 4.0, imu_hz=20.0) == {'Q': 22}
+
+
+def test_link_controller_disabled_only_measures():
+    ctrl, sent = controller()
+    ctrl.enabled = False
+    assert run_period(ctrl, 0.0, imu_hz=20.0) is None
+    assert ctrl.last_metrics['imu_hz'] == 20.0
+    assert sent == [] and ctrl.pending is None
+
+
+# --------- negotiate_baud ---------
+class FakeFirmware:
+    """Puerto serie con el firmware del otro lado.
+
+    Solo entiende comandos a su velocidad actual y responde con el ACK a la
+    velocidad vieja, como handleCommand. `supported` son las velocidades que
+    acepta (las demás se ignoran y el ACK informa la actual); en `garbled` el
+    cable no pasa bytes legibles en ningún sentido. Sin un comando a la
+    velocidad nueva en `confirm_s` vuelve a la anterior.
+    """
+
+    def __init__(self, baud=BOOT_BAUD, supported=(), garbled=(), answers=True, confirm_s=0.2):
+        self.port = '/dev/ttyUSB0'
+        self.baudrate = BOOT_BAUD
+        self.timeout = 0
+        self._baud = baud
+        self.previous = baud
+        self.supported = set(supported)
+        self.garbled = set(garbled)
+        self.answers = answers
+        self.confirm_s = confirm_s
+        self.changed_at = None
+        self.output = []            # (velocidad, bytes) pendientes de leer
+        self.commands = []          # (velocidad del puerto, comando)
+
+    @property
+    def fw_baud(self):
+        """Velocidad actual del firmware."""
+        if self.changed_at is not None and time.monotonic() - self.changed_at > self.confirm_s:
+            self._baud = self.previous
+            self.changed_at = None
+        return self._baud
+
+    def _readable(self, baud):
+        return baud == self.fw_baud and baud not in self.garbled
+
+    def write(self, data):
+        self.commands.append((self.baudrate, data))
+        if not self.answers or not self._readable(self.baudrate):
+            return len(data)
+        self.changed_at = None
+        params = dict(item.split('=', 1) for item in data[4:].decode().strip().split(';') if '=' in item)
+        new_baud = int(params.get('BAUD', 0))
+        if new_baud not in self.supported or new_baud == self.fw_baud:
+            new_baud = 0
+        ack = f'ACK:Q=12;FS=QVGA;INT=100;BAUD={new_baud or self.fw_baud};DELTA=1;\r\n'
+        self.output.append((self.fw_baud, ack.encode()))
+        if new_baud:
+            self.previous, self._baud = self.fw_baud, new_baud
+            if new_baud != BOOT_BAUD:
+                self.changed_at = time.monotonic()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return sum(len(data) for _, data in self.output)
+
+    def read(self, n):
+        out = b''
+        while self.output:
+            baud, data = self.output.pop(0)
+            # A otra velocidad los bytes llegan como basura
+            out += data if baud == self.baudrate and baud not in self.garbled else b'\xfe' * len(data)
+        return out
+
+    def reset_input_buffer(self):
+        self.output.clear()
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def uart(monkeypatch):
+    monkeypatch.setattr(cansat_link.serial.tools.list_ports, 'comports', lambda: [])
+    monkeypatch.setattr(cansat_link, 'BAUD_CONFIRM_S', 0.25)
+
+
+def probed(fw):
+    return [baud for baud, cmd in fw.commands if cmd == format_command()]
+
+
+def test_negotiate_baud_falls_back_when_nothing_answers(uart):
+    fw = FakeFirmware(answers=False)
+    assert negotiate_baud(fw, 921600, timeout=0.05) == BOOT_BAUD
+    assert fw.baudrate == BOOT_BAUD
+    # Se prueba la velocidad de una conexión anterior y la de arranque, nada más
+    assert probed(fw) == [921600, BOOT_BAUD]
+    assert not any(b'BAUD=' in cmd for _, cmd in fw.commands)
+
+
+def test_negotiate_baud_keeps_boot_rate_when_target_is_refused(uart):
+    fw = FakeFirmware(supported=[BOOT_BAUD, 230400, 460800])
+    assert negotiate_baud(fw, 921600, timeout=0.05) == BOOT_BAUD
+    assert fw.baudrate == fw.fw_baud == BOOT_BAUD
+    assert probe(fw, BOOT_BAUD, 0.05) is not None
+
+
+def test_negotiate_baud_switches_to_a_supported_rate(uart):
+    fw = FakeFirmware(supported=[BOOT_BAUD, 230400, 460800])
+    assert negotiate_baud(fw, 460800, timeout=0.05) == 460800
+    assert fw.baudrate == fw.fw_baud == 460800
+    # El probe a la velocidad nueva confirmó el cambio: el firmware no vuelve atrás
+    time.sleep(fw.confirm_s * 2)
+    assert probe(fw, 460800, 0.05)['BAUD'] == '460800'
+    assert fw.fw_baud == 460800
+
+
+def test_negotiate_baud_reverts_when_new_rate_is_unreadable(uart):
+    # El firmware acepta 2 Mbaud pero el conversor USB no lo soporta
+    fw = FakeFirmware(supported=[BOOT_BAUD, 921600, 2000000], garbled=[2000000])
+    assert negotiate_baud(fw, 2000000, timeout=0.05) == BOOT_BAUD
+    assert fw.baudrate == fw.fw_baud == BOOT_BAUD
+    assert probe(fw, BOOT_BAUD, 0.05) is not None
+
+
+def test_negotiate_baud_reuses_the_previous_connection_rate(uart):
+    fw = FakeFirmware(baud=921600, supported=[BOOT_BAUD, 921600])
+    assert negotiate_baud(fw, 921600, timeout=0.05) == 921600
+    assert probed(fw) == [921600]
+    assert fw.baudrate == 921600
+
+
+def test_negotiate_baud_skips_usb_cdc(monkeypatch):
+    monkeypatch.setattr(cansat_link.serial.tools.list_ports, 'comports',
+                        lambda: [FakePort('/dev/ttyUSB0', 0x303A, 0x1001)])
+    fw = FakeFirmware()
+    assert negotiate_baud(fw, 921600) == 0
+    assert fw.commands == []
@@ -0,0 +1,110 @@
+"""Mosaico: cuadros recortados de una textura sintética con desplazamientos conocidos.
+
+Las capturas de ejemplo del repositorio dan muy pocos puntos ORB; una textura
+de ruido suavizado da cientos por cuadro.
+"""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import cansat_mosaic
+from cansat_mosaic import (Frame, build_mosaic, chain_segments, compose, extract_features, match_pair,
+                           select_frames)
+
+W, H = 320, 240
+STEP = (40, 25)         # px que avanza cada cuadro (x, y)
+
+
+@pytest.fixture(scope='module')
+def texture():
+    rng = np.random.default_rng(0)
+    noise = cv2.GaussianBlur(rng.integers(0, 256, (900, 1400), dtype=np.uint8), (0, 0), 2.0)
+    return cv2.cvtColor(cv2.normalize(noise, None, 0, 255, cv2.NORM_MINMAX), cv2.COLOR_GRAY2BGR)
+
+
+def crop(texture, k):
+    x, y = 100 + STEP[0] * k, 100 + STEP[1] * k
+    ok, data = cv2.imencode('.jpg', texture[y:y + H, x:x + W], [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return data.tobytes()
+
+
+def frames_along(texture, count):
+    return [Frame(100 * k, crop(texture, k), 0.0) for k in range(count)]
+
+
+def blank_frame(capture_ms):
+    ok, data = cv2.imencode('.jpg', np.full((H, W, 3), 128, np.uint8))
+    return Frame(capture_ms, data.tobytes(), 0.0)
+
+
+def test_chain_segments():
+    H1 = np.eye(3)
+    assert chain_segments([]) == [(0, 0)]
+    assert chain_segments([H1, H1, H1]) == [(0, 3)]
+    assert chain_segments([H1, None, H1, H1, None]) == [(0, 1), (2, 4), (5, 5)]
+
+
+def test_pair_homography_is_the_known_shift(texture):
+    a, b = (extract_features(crop(texture, k)) for k in (0, 1))
+    assert len(a[0]) > 500
+    Hab = match_pair(a, b)
+    # b se lleva a a sumando el paso
+    assert Hab[:2, 2] == pytest.approx(STEP, abs=1.0)
+    assert Hab[:2, :2] == pytest.approx(np.eye(2), abs=0.02)
+    assert match_pair(a, extract_features(blank_frame(0).jpeg)) is None
+
+
+def test_compose_canvas_size():
+    images = [np.full((H, W, 3), 50 * (k + 1), np.uint8) for k in range(3)]
+    shift = np.array([[1, 0, 30], [0, 1, 10], [0, 0, 1]], float)
+    mosaic = compose(images, [shift, shift])
+    assert mosaic.shape == (H + 20 + 1, W + 60 + 1, 3)
+    # Se promedia donde se superponen las tres
+    assert mosaic[H // 2, W // 2 + 60].tolist() == [100, 100, 100]
+    small = compose(images, [shift, shift], max_canvas=190)
+    assert max(small.shape[:2]) <= 191
+
+
+def test_mosaic_of_a_straight_pass(texture):
+    frames = frames_along(texture, 6)
+    mosaic, info = build_mosaic(frames, workers=2)
+    assert info == {'frames': 6, 'segments': 1, 'used': 6, 'first_ms': 0}
+    expected = (H + 5 * STEP[1], W + 5 * STEP[0])
+    assert mosaic.shape[:2] == pytest.approx(expected, rel=0.02)
+
+
+def test_mosaic_uses_the_longest_segment(texture):
+    # Un cuadro sin textura corta la cadena: tramos de 2, 1 (el vacío) y 4 cuadros
+    frames = frames_along(texture, 6)
+    frames.insert(2, blank_frame(150))
+    mosaic, info = build_mosaic(frames, workers=2)
+    assert info['segments'] == 3
+    assert info['used'] == 4 and info['first_ms'] == 200
+    assert mosaic.shape[:2] == pytest.approx((H + 3 * STEP[1], W + 3 * STEP[0]), rel=0.02)
+    none, info = build_mosaic([frames[0], blank_frame(50)], workers=1)
+    assert none is None and info['used'] == 1
+
+
+def test_feature_cache(texture, tmp_path, monkeypatch):
+    jpeg = crop(texture, 0)
+    points, descriptors = extract_features(jpeg, 500, str(tmp_path))
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].endswith('_orb500.npz')
+    # Segunda vez sale del caché sin decodificar ni describir
+    monkeypatch.setattr(cansat_mosaic.cv2, 'imdecode', lambda *a: pytest.fail('no usó el caché'))
+    cached_points, cached_descriptors = extract_features(jpeg, 500, str(tmp_path))
+    assert np.array_equal(cached_points, points) and np.array_equal(cached_descriptors, descriptors)
+    monkeypatch.undo()
+    # Otros parámetros de ORB son otra clave
+    extract_features(jpeg, 200, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+    assert not [name for name in os.listdir(tmp_path) if '.tmp' in name]
+
+
+def test_select_frames_by_window_and_tilt():
+    frames = [Frame(1000, b'', 3.0), Frame(2000, b'', 30.0), Frame(3000, b'', None), Frame(4000, b'', 1.0)]
+    assert [f.capture_ms for f in select_frames(frames)] == [1000, 4000]
+    assert [f.capture_ms for f in select_frames(frames, (1.5, 3.5), 180)] == [2000, 3000]
+    assert [f.capture_ms for f in select_frames(frames, (None, 2.0), 45)] == [1000, 2000]
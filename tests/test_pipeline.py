@@ -0,0 +1,132 @@
+"""Anillos de memoria compartida del modo multiproceso."""
+import os
+
+import numpy as np
+import pytest
+
+from cansat_pipeline import HEAD_SLOT, NO_STAMP, PINNED, BatchRing, FrameRing, _mp
+
+SHAPE = (8, 10, 3)
+
+
+def frame(value, shape=SHAPE):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+@pytest.fixture
+def frame_rings():
+    """Anillo del escritor (dueño) y el mismo anillo conectado como lector."""
+    writer = FrameRing(3, SHAPE)
+    reader = FrameRing.attach(*writer.spec)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_reader_gets_only_the_newest_frame(frame_rings):
+    writer, reader = frame_rings
+    assert reader.latest() is None
+    for value in range(1, 6):
+        writer.put(frame(value), stamp=100 * value)
+    seq, view, stamp = reader.latest()
+    assert seq == 5 and stamp == 500
+    assert view.shape == SHAPE and (view == 5).all()
+    assert reader.latest() is None
+    # Un cuadro más chico ocupa el comienzo de la ranura
+    writer.put(frame(9, (4, 5, 3)))
+    seq, view, stamp = reader.latest()
+    assert view.shape == (4, 5, 3) and (view == 9).all() and stamp == NO_STAMP
+
+
+def test_pinned_slot_is_never_overwritten(frame_rings):
+    writer, reader = frame_rings
+    writer.put(frame(1))
+    _, shown, _ = reader.latest()
+    # El lector sigue pintando la ranura fijada mientras el escritor da muchas vueltas
+    for value in range(2, 50):
+        writer.put(frame(value))
+        assert (shown == 1).all()
+    seq, view, _ = reader.latest()
+    assert seq == 49 and (view == 49).all()
+
+
+def test_writer_skips_a_slot_pinned_midway(frame_rings):
+    writer, reader = frame_rings
+    for value in (1, 2, 3):
+        writer.put(frame(value))
+    assert int(writer.header[HEAD_SLOT]) == 2
+    # El lector fijó la ranura 0 (la próxima del escritor) justo antes de que la marque
+    reader.header[PINNED] = 0
+    writer.put(frame(4))
+    assert int(writer.header[HEAD_SLOT]) == 1
+    assert (reader._slot_view(0) == 1).all()
+    assert (reader.latest()[1] == 4).all()
+
+
+def test_requests_and_fit(frame_rings):
+    writer, reader = frame_rings
+    assert writer.requested_size() is None and not writer.stabilized()
+    reader.request_size(320, 240)
+    reader.request_stabilized(True)
+    assert writer.requested_size() == (320, 240) and writer.stabilized()
+    reader.request_size(0, 240)
+    assert writer.requested_size() is None
+    assert writer.fits(frame(0, (8, 10, 3))) and not writer.fits(frame(0, (9, 10, 3)))
+
+
+def test_batch_ring_splits_and_wraps():
+    writer = BatchRing(4, (5, 2))
+    reader = BatchRing.attach(*writer.spec)
+    try:
+        rows = np.arange(24, dtype=float).reshape(12, 2)
+        writer.put(rows)                    # 3 ranuras: 5 + 5 + 2 filas
+        assert writer.head == 3
+        assert np.array_equal(reader.get_all(), rows)
+        assert reader.get_all().shape == (0, 2)
+        # Vuelta completa al anillo sin que el lector se atrase
+        more = np.arange(100, 140, dtype=float).reshape(20, 2)
+        writer.put(more[:10])
+        writer.put(more[10:])
+        assert np.array_equal(reader.get_all(), more) and reader.lost == 0
+        # Lector atrasado más de lo que cabe: se cuentan las ranuras perdidas
+        for i in range(7):
+            writer.put(np.full((5, 2), float(i)))
+        out = reader.get_all()
+        assert reader.lost == 3
+        assert np.array_equal(out[:, 0], np.repeat([3.0, 4.0, 5.0, 6.0], 5))
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_owner_unlinks_the_block():
+    ring = FrameRing(2, SHAPE)
+    name = ring.shm.name
+    ring.close()
+    with pytest.raises(FileNotFoundError):
+        FrameRing.attach(2, SHAPE, np.uint8, name)
+
+
+def _child_writer(frame_spec, batch_spec):
+    frames = FrameRing.attach(*frame_spec)
+    batches = BatchRing.attach(*batch_spec)
+    frames.put(frame(7), stamp=os.getpid())
+    batches.put(np.arange(30, dtype=float).reshape(15, 2))
+    frames.close()
+    batches.close()
+
+
+def test_spawned_process_writes_both_rings():
+    frames = FrameRing(3, SHAPE)
+    batches = BatchRing(4, (8, 2))
+    try:
+        child = _mp.Process(target=_child_writer, args=(frames.spec, batches.spec))
+        child.start()
+        child.join(30)
+        assert child.exitcode == 0
+        seq, view, stamp = frames.latest()
+        assert (view == 7).all() and stamp == child.pid
+        assert np.array_equal(batches.get_all(), np.arange(30, dtype=float).reshape(15, 2))
+    finally:
+        frames.close()
+        batches.close()
@@ -0,0 +1,261 @@
+"""Protocolo serie: campos de las líneas IMU, tramas y resincronización.
+
+Los casos aleatorios usan random.Random con semilla fija: una falla se
+reproduce con la misma semilla.
+"""
+import random
+
+import pytest
+
+import cansat_protocol
+from cansat_protocol import (FRAG_HEADER, FRAGMENT_SIZE, FRAME_HEADER, FRAME_JPEG, FRAME_JPEG_FRAG,
+                             FRAME_MAGIC, FRAME_REPEAT, FRAME_TEST, FRAME_THUMB, MAX_FRAGMENT, MAX_TEST,
+                             MAX_THUMB, PKT_IMAGE, PKT_IMU, PKT_REPEAT, PKT_TEST, PKT_TEXT, PKT_THUMB,
+                             REPEAT_HEADER, TEST_HEADER, FrameAssembler, JpegImage, StreamDecoder,
+                             build_fragments, build_frame, build_repeat, build_thumb, parse_device_time,
+                             parse_seq, sample_time)
+from cansat_stats import PerfStats
+
+SEEDS = range(4)
+
+
+def imu_line(seq):
+    return f'ACC:{seq % 1000},-2,16384;GYRO:3,-4,5;SEQ:{seq};T:{seq * 20};'
+
+
+def packet_key(packet):
+    """Forma comparable de un paquete (con la hora de captura de las imágenes)."""
+    kind, data = packet
+    if isinstance(data, JpegImage):
+        return kind, bytes(data), data.capture_ms
+    return kind, data, None
+
+
+def decode(data, cuts=()):
+    """Paquetes de alimentar `data` cortado en las posiciones `cuts`."""
+    decoder = StreamDecoder()
+    packets = []
+    start = 0
+    for end in list(cuts) + [len(data)]:
+        packets += decoder.feed(data[start:end])
+        start = end
+    return packets, decoder.stats.counters
+
+
+def random_cuts(rng, size, count):
+    return sorted(rng.sample(range(1, size), min(count, size - 1)))
+
+
+def make_stream(rng, jpegs, items=60):
+    """Flujo como el del firmware unificado: (bytes, piezas, paquetes esperados por pieza)."""
+    pieces = []
+    expected = []
+    frame_id = 0
+    for i in range(items):
+        r = rng.random()
+        if r < 0.6:
+            line = imu_line(i)
+            pieces.append(line.encode('ascii') + b'\r\n')
+            expected.append([(PKT_IMU, line, None)])
+        elif r < 0.75:
+            frame_id += 1
+            image = rng.choice(jpegs)
+            pieces.append(b''.join(build_fragments(image, frame_id, capture_ms=i * 20)))
+            expected.append([(PKT_IMAGE, image, i * 20)])
+        elif r < 0.85:
+            pieces.append(build_repeat(frame_id, i * 20))
+            expected.append([(PKT_REPEAT, (frame_id, i * 20), None)])
+        elif r < 0.92:
+            thumb = jpegs[0]
+            pieces.append(build_thumb(thumb, i * 20))
+            expected.append([(PKT_THUMB, thumb, i * 20)])
+        elif r < 0.96:
+            payload = TEST_HEADER.pack(i) + bytes(range(256)) * 3
+            pieces.append(build_frame(payload, FRAME_TEST))
+            expected.append([(PKT_TEST, payload, None)])
+        else:
+            pieces.append(b'MPU6050 listo\r\n')
+            expected.append([(PKT_TEXT, 'MPU6050 listo', None)])
+    return pieces, expected
+
+
+def flatten(expected):
+    return [p for group in expected for p in group]
+
+
+# --------- Campos SEQ y T ---------
+
+def test_seq_and_device_time_fields():
+    line = 'ACC:12,-34,16384;GYRO:5,-6,7;SEQ:42;T:123456;'
+    assert parse_seq(line) == 42
+    assert parse_device_time(line) == 123456
+    assert sample_time(line, 9.0) == pytest.approx(123.456)
+    # El valor termina en el ';' siguiente, no en el de la clave, o en el fin de línea
+    assert parse_device_time('ACC:1,2,3;GYRO:4,5,6;T:77') == 77
+
+
+def test_missing_device_time_falls_back_to_arrival():
+    line = 'ACC:12,-34,16384;GYRO:5,-6,7;SEQ:42;'
+    assert parse_device_time(line) is None
+    assert sample_time(line, 9.0) == 9.0
+    assert parse_seq('ACC:1,2,3;GYRO:4,5,6;') is None
+
+
+# --------- StreamDecoder ---------
+def test_packets_round_trip(jpegs):
+    pieces, expected = make_stream(random.Random(0), jpegs)
+    packets, counters = decode(b''.join(pieces))
+    assert [packet_key(p) for p in packets] == flatten(expected)
+    assert not counters.get('crc_errors') and not counters.get('resyncs')
+
+
+def test_large_batch_in_one_feed(jpegs):
+    # Un atraso de la ingesta: miles de líneas con tramas en medio, todo junto
+    lines = [imu_line(i) for i in range(20000)]
+    text = [line.encode('ascii') + b'\r\n' for line in lines]
+    image = b''.join(build_fragments(jpegs[0], 1, capture_ms=7))
+    data = b''.join(text[:10000]) + image + b''.join(text[10000:19999]) + build_repeat(1, 9) + text[19999]
+    packets, counters = decode(data)
+    expected = ([(PKT_IMU, line, None) for line in lines[:10000]] + [(PKT_IMAGE, jpegs[0], 7)]
+                + [(PKT_IMU, line, None) for line in lines[10000:19999]] + [(PKT_REPEAT, (1, 9), None)]
+                + [(PKT_IMU, lines[19999], None)])
+    assert [packet_key(p) for p in packets] == expected
+    assert not counters.get('resyncs')
+
+
+def test_image_keeps_firmware_frame_id(jpegs):
+    packets, _ = decode(b''.join(build_fragments(jpegs[1], 77, capture_ms=5)))
+    assert packets[0][1].frame_id == 77
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_split_anywhere(seed, jpegs):
+    rng = random.Random(seed)
+    pieces, expected = make_stream(rng, jpegs)
+    data = b''.join(pieces)
+    packets, _ = decode(data, random_cuts(rng, len(data), rng.randint(1, 400)))
+    assert [packet_key(p) for p in packets] == flatten(expected)
+
+
+def test_byte_by_byte(jpegs):
+    pieces, expected = make_stream(random.Random(1), jpegs, items=20)
+    data = b''.join(pieces)
+    packets, _ = decode(data, range(1, len(data)))
+    assert [packet_key(p) for p in packets] == flatten(expected)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_crc_corruption_drops_only_that_frame(seed, jpegs):
+    rng = random.Random(seed)
+    pieces, expected = make_stream(rng, jpegs)
+    frames = [i for i, p in enumerate(pieces) if p.startswith(FRAME_MAGIC)]
+    victim = rng.choice(frames)
+    corrupt = bytearray(pieces[victim])
+    # Un byte de los datos o del CRC (la cabecera se prueba aparte)
+    corrupt[rng.randrange(FRAME_HEADER.size, len(corrupt))] ^= 1 << rng.randrange(8)
+    pieces[victim] = bytes(corrupt)
+    data = b''.join(pieces)
+    packets, counters = decode(data, random_cuts(rng, len(data), 50))
+    # Se pierde solo ese paquete (un fragmento roto descarta su imagen entera)
+    expected[victim] = []
+    assert [packet_key(p) for p in packets] == flatten(expected)
+    assert counters.get('crc_errors', 0) >= 1
+
+
+def test_false_header_does_not_hold_imu_lines():
+    lines = [imu_line(i) for i in range(20)]
+    false = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_JPEG_FRAG, FRAG_HEADER.size + 900) + b'\x00' * 10
+    data = lines[0].encode() + b'\r\n' + false + b''.join(l.encode() + b'\r\n' for l in lines[1:])
+    decoder = StreamDecoder()
+    # Sin que pase el tiempo: las líneas salen porque quedan completas detrás de la cabecera
+    split = len(lines[0]) + 2 + len(false) + 3 * (len(lines[1]) + 2)
+    got = decoder.feed(data[:split])
+    assert len(got) >= 3
+    got += decoder.feed(data[split:])
+    assert [text for _, text in got] == lines
+    assert decoder.stats.counters['stale_headers'] == 1
+
+
+def test_false_header_times_out(monkeypatch, jpegs):
+    now = [100.0]
+    monkeypatch.setattr(cansat_protocol.time, 'monotonic', lambda: now[0])
+    decoder = StreamDecoder()
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_JPEG, 50000) + b'\xFF\xD8'
+    assert decoder.feed(header + b'basura sin fin de linea') == []
+    # Todavía podría ser una imagen real llegando a 115200
+    now[0] += 1.0
+    assert decoder.feed(b'x') == []
+    now[0] += 50000 / cansat_protocol.MIN_LINK_BYTES_PER_S
+    assert decoder.feed(b'\nMPU6050 listo\n') == [(PKT_TEXT, 'MPU6050 listo')]
+    assert decoder.stats.counters['stale_headers'] == 1
+    # Una trama real posterior se sigue decodificando
+    assert decoder.feed(build_frame(jpegs[0]))[0][0] == PKT_IMAGE
+
+
+def test_slow_large_frame_is_not_abandoned(monkeypatch, jpegs):
+    now = [0.0]
+    monkeypatch.setattr(cansat_protocol.time, 'monotonic', lambda: now[0])
+    frame = build_frame(jpegs[1] + b'\x00' * 8000 + jpegs[1])
+    decoder = StreamDecoder()
+    packets = []
+    # A 115200 baudios (11520 bytes/s), en lecturas de 256 bytes
+    for i in range(0, len(frame), 256):
+        packets += decoder.feed(frame[i:i + 256])
+        now[0] += 256 / cansat_protocol.MIN_LINK_BYTES_PER_S
+    assert len(packets) == 1
+    assert not decoder.stats.counters.get('stale_headers')
+
+
+def fragment_payloads(image, frame_id=1):
+    return [frame[FRAME_HEADER.size:-4] for frame in build_fragments(image, frame_id, capture_ms=3)]
+
+
+def test_duplicate_fragments_do_not_complete_an_image(jpegs):
+    payloads = fragment_payloads(jpegs[1])
+    assert len(payloads) >= 5
+    stats = PerfStats()
+    assembler = FrameAssembler(stats)
+    assert all(assembler.add(payloads[0]) is None for _ in range(len(payloads)))
+    assert stats.counters['duplicate_fragments'] == len(payloads) - 1
+    assert stats.counters['fragments'] == 1
+
+
+def test_duplicate_with_missing_fragment_waits_for_it(jpegs):
+    payloads = fragment_payloads(jpegs[1])
+    missing = len(payloads) // 2
+    # Cantidad correcta de fragmentos, pero uno repetido en lugar del del medio
+    arrived = payloads[:missing] + [payloads[0]] + payloads[missing + 1:]
+    assembler = FrameAssembler(PerfStats())
+    assert all(assembler.add(p) is None for p in arrived)
+    image = assembler.add(payloads[missing])
+    assert image == jpegs[1]
+    assert image.capture_ms == 3 and image.frame_id == 1
+
+
+def test_repeated_fragments_on_the_wire(jpegs):
+    frames = build_fragments(jpegs[1], 4, capture_ms=3)
+    data = b''.join(frames[:2] + frames[1:2] * 3 + frames[2:])
+    packets, counters = decode(data)
+    assert [packet_key(p) for p in packets] == [(PKT_IMAGE, jpegs[1], 3)]
+    assert counters['duplicate_fragments'] == 3
+    assert not counters.get('bad_jpeg')
+
+
+@pytest.mark.parametrize('frame_type, length, plausible', [
+    (FRAME_JPEG_FRAG, FRAG_HEADER.size, False),
+    (FRAME_JPEG_FRAG, MAX_FRAGMENT, True),
+    (FRAME_JPEG_FRAG, MAX_FRAGMENT + 1, False),
+    (FRAME_REPEAT, REPEAT_HEADER.size, True),
+    (FRAME_REPEAT, REPEAT_HEADER.size + 1, False),
+    (FRAME_TEST, FRAGMENT_SIZE, True),
+    (FRAME_TEST, MAX_TEST + 1, False),
+    (FRAME_THUMB, MAX_THUMB, True),
+    (FRAME_THUMB, MAX_THUMB + 1, False),
+    (0x7F, 10, False),
+])
+def test_header_length_bounds(frame_type, length, plausible):
+    decoder = StreamDecoder()
+    assert decoder.feed(FRAME_HEADER.pack(FRAME_MAGIC, frame_type, length)) == []
+    # Una cabecera imposible se descarta enseguida; una posible espera sus datos
+    assert bool(decoder.stats.counters.get('bad_header')) != plausible
+    assert decoder.buf.startswith(FRAME_MAGIC) == plausible
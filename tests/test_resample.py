@@ -0,0 +1,79 @@
+"""UniformResampler: grilla uniforme, huecos y resultado independiente de los lotes."""
+import numpy as np
+import pytest
+
+from cansat_resample import UniformResampler
+
+RATE = 50.0
+
+
+def irregular_stream(rng, n=3000):
+    """Horas con jitter, un hueco rellenable, un hueco largo y un reinicio del reloj."""
+    t = np.cumsum(rng.uniform(0.015, 0.025, n))
+    t[800:] += 0.3
+    t[1600:] += 3.0
+    t[2400:] -= 60.0
+    values = np.sin(t[:, None] * np.arange(1, 7)) + rng.normal(0, 0.01, (n, 6))
+    return t, values
+
+
+def run(method, t, values, cuts=()):
+    resampler = UniformResampler(6, RATE, method)
+    parts = [resampler.update(tt, vv) for tt, vv in zip(np.split(t, cuts), np.split(values, cuts))]
+    return tuple(np.concatenate(p) for p in zip(*parts))
+
+
+@pytest.mark.parametrize('method', ['linear', 'cubic'])
+@pytest.mark.parametrize('seed', range(4))
+def test_batch_invariance(method, seed):
+    rng = np.random.default_rng(seed)
+    t, values = irregular_stream(rng)
+    whole = run(method, t, values)
+    cuts = np.sort(rng.choice(np.arange(1, len(t)), int(rng.integers(1, 1500)), replace=False))
+    split = run(method, t, values, cuts)
+    for a, b in zip(whole, split):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize('method', ['linear', 'cubic'])
+def test_grid_is_uniform_within_segments(method):
+    t, values = irregular_stream(np.random.default_rng(0))
+    grid, out, filled = run(method, t, values)
+    steps = np.diff(grid)
+    regular = np.isclose(steps, 1 / RATE)
+    # Solo se corta en el hueco largo y en el reinicio
+    assert (~regular).sum() == 2
+    assert out.shape == (len(grid), 6)
+
+
+def test_gap_is_filled_and_flagged():
+    t = np.r_[np.arange(0, 1, 0.02), np.arange(1.2, 2, 0.02)]
+    values = np.tile(t[:, None], 6)
+    grid, out, filled = run('cubic', t, values)
+    inside = (grid > 0.98 + 1e-9) & (grid < 1.2 - 1e-9)
+    assert filled[inside].all()
+    assert not filled[~inside].any()
+    # El relleno es lineal entre las muestras de los bordes
+    assert np.allclose(out[inside, 0], grid[inside])
+
+
+def test_equal_arrival_times_are_spread():
+    # Tres líneas leídas juntas: comparten la hora de llegada
+    t = np.r_[np.arange(0, 1, 0.02), [1.04, 1.04, 1.04], np.arange(1.06, 2, 0.02)]
+    values = np.tile(np.arange(len(t), dtype=float)[:, None], 6)
+    grid, out, filled = run('linear', t, values)
+    assert not filled.any()
+    assert np.all(np.diff(out[:, 0]) > 0)
+
+
+def test_reset_forgets_carry():
+    resampler = UniformResampler(6, RATE)
+    resampler.update(np.arange(0, 1, 0.02), np.zeros((50, 6)))
+    resampler.reset()
+    grid, _, _ = resampler.update(np.arange(5, 6, 0.02), np.ones((50, 6)))
+    assert grid[0] == pytest.approx(5.0)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        UniformResampler(6, RATE, 'spline')
@@ -0,0 +1,80 @@
+"""Espectro de Welch incremental: pico y potencia de un seno, y lotes contra una sola pasada."""
+import numpy as np
+import pytest
+
+from cansat_spectrum import WelchSpectrum
+
+FS = 50.0
+NFFT = 128
+
+
+def welch(x, nfft=NFFT, hop=NFFT // 2, fs=FS):
+    """Welch de referencia de una sola pasada: media, Hann, un lado, unidades²/Hz."""
+    window = np.hanning(nfft)
+    starts = range(0, len(x) - nfft + 1, hop)
+    segments = np.array([x[s:s + nfft] - x[s:s + nfft].mean() for s in starts]) * window
+    psd = (np.abs(np.fft.rfft(segments, axis=-1)) ** 2).mean(axis=0) / (fs * (window ** 2).sum())
+    psd[1:-1] *= 2
+    return psd
+
+
+def test_sine_peak_and_power():
+    # 3 Hz de amplitud 0.5 g más ruido blanco de 0.05 g y un desvío de 1 g
+    rng = np.random.default_rng(0)
+    t = np.arange(4096) / FS
+    x = 1.0 + 0.5 * np.sin(2 * np.pi * 3.0 * t) + rng.normal(0, 0.05, len(t))
+    spectrum = WelchSpectrum(1, NFFT, average=64, max_segments=64)
+    spectrum.update(x[:, None])
+    freqs = spectrum.frequencies(FS)
+    psd = spectrum.density(FS)[0]
+    assert abs(freqs[np.argmax(psd)] - 3.0) <= FS / NFFT
+    # Parseval: el área de la PSD es la varianza (A²/2 del seno + la del ruido)
+    df = freqs[1] - freqs[0]
+    assert psd.sum() * df == pytest.approx(0.5 ** 2 / 2 + 0.05 ** 2, rel=0.05)
+    near = np.abs(freqs - 3.0) <= 2 * df
+    assert psd[near].sum() * df == pytest.approx(0.5 ** 2 / 2, rel=0.05)
+
+
+def test_first_batch_is_plain_welch():
+    rng = np.random.default_rng(1)
+    x = rng.normal(0, 1, (NFFT + 9 * NFFT // 2, 3))
+    spectrum = WelchSpectrum(3, NFFT, max_segments=16)
+    assert spectrum.update(x) == 10
+    for ch in range(3):
+        assert np.allclose(spectrum.density(FS)[ch], welch(x[:, ch]))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_streaming_matches_single_shot_for_a_steady_signal(seed):
+    # Tono en un bin par: cada salto de NFFT/2 tiene ciclos enteros y los segmentos son iguales
+    t = np.arange(3000) / FS
+    x = np.sin(2 * np.pi * 10 * FS / NFFT * t) + 0.3 * np.cos(2 * np.pi * 4 * FS / NFFT * t)
+    spectrum = WelchSpectrum(1, NFFT)
+    rng = np.random.default_rng(seed)
+    start = 0
+    while start < len(x):
+        end = start + int(rng.integers(1, 200))
+        spectrum.update(x[start:end, None])
+        start = end
+    assert spectrum.segments == (len(x) - NFFT) // (NFFT // 2) + 1
+    assert np.allclose(spectrum.density(FS)[0], welch(x), atol=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_exponential_average_does_not_depend_on_batch_size(seed):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 1, (2500, 2)) * np.linspace(0.5, 2.0, 2500)[:, None]
+    whole = WelchSpectrum(2, NFFT, max_segments=8)
+    whole.update(x[:NFFT])
+    whole.update(x[NFFT:])
+    pieces = WelchSpectrum(2, NFFT, max_segments=8)
+    pieces.update(x[:NFFT])
+    start = NFFT
+    while start < len(x):
+        end = start + int(rng.integers(1, 300))
+        pieces.update(x[start:end])
+        start = end
+    assert whole.segments == pieces.segments
+    assert np.allclose(whole.psd, pieces.psd)
+    whole.reset()
+    assert whole.segments == 0 and not whole.psd.any()
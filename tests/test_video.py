@@ -0,0 +1,164 @@
+"""Video: FrameReconstructor, etiquetas de actitud (FrameTagger) y la decodificación
+y enderezado en el hilo de VideoWorker."""
+import time
+
+import numpy as np
+import pytest
+
+from cansat_imu import AttitudeHistory
+from cansat_protocol import PKT_IMAGE, PKT_REPEAT, PKT_THUMB
+from cansat_video import TAG_WAIT_S, FrameReconstructor, FrameTagger, VideoWorker, decode_jpeg
+
+
+def wait_frame(worker, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not worker.ready():
+        assert time.monotonic() < deadline
+        time.sleep(0.002)
+    return worker.take()
+
+
+def shown_reduced(jpegs):
+    """Reconstructor con el panel a 1/4; la primera imagen da el tamaño original."""
+    video = FrameReconstructor()
+    video.display_size = (80, 60)
+    video.add(PKT_IMAGE, jpegs[1])
+    assert video.render().shape == (240, 320, 3)
+    video.add(PKT_IMAGE, jpegs[0])
+    assert video.render().shape == (60, 80, 3)
+    return video
+
+
+def test_reduced_image_is_decoded_again_when_the_panel_grows(jpegs):
+    video = shown_reduced(jpegs)
+    assert video.render() is None
+    # Panel más chico: alcanza la imagen guardada
+    video.display_size = (40, 30)
+    assert video.render() is None
+    video.display_size = (160, 120)
+    assert video.render().shape == (120, 160, 3)
+    video.display_size = (320, 240)
+    full = video.render()
+    assert np.array_equal(full, decode_jpeg(jpegs[0]))
+    assert video.render() is None
+
+
+def test_panel_growth_keeps_the_thumbnail(jpegs):
+    video = shown_reduced(jpegs)
+    video.add(PKT_THUMB, jpegs[1])
+    assert video.render().shape == (60, 80, 3)
+    video.display_size = (320, 240)
+    # Con la miniatura en pantalla no se decodifica nada hasta la próxima imagen
+    assert video.render() is None
+    video.add(PKT_REPEAT, b'')
+    assert video.render().shape == (240, 320, 3)
+
+
+def rolling_history(until_s):
+    """Roll de 0° subiendo 10°/s, una muestra cada 20 ms hasta `until_s`."""
+    history = AttitudeHistory()
+    for t in np.arange(0.0, until_s + 1e-9, 0.02):
+        history.add(t, 0.0, 10.0 * t, 0.0)
+    return history
+
+
+def test_tagger_waits_for_samples_after_the_capture():
+    history = rolling_history(1.0)
+    tagger = FrameTagger()
+    tagger.add(500, arrival=100.0)
+    tagger.add(1210, arrival=100.0)
+    tagger.add(900, arrival=100.0)
+    # 1210 ms todavía no tiene muestras después; el de 900 espera detrás (orden de llegada)
+    tags = tagger.resolve(history, now=100.1)
+    assert [tag.capture_ms for tag in tags] == [500]
+    assert tags[0].roll == pytest.approx(5.0)
+    assert np.isclose(np.linalg.norm([tags[0].w, tags[0].x, tags[0].y, tags[0].z]), 1.0)
+    for t in np.arange(1.02, 1.3, 0.02):
+        history.add(t, 0.0, 10.0 * t, 0.0)
+    tags = tagger.resolve(history, now=100.2)
+    assert [tag.capture_ms for tag in tags] == [1210, 900]
+    assert [tag.roll for tag in tags] == pytest.approx([12.1, 9.0])
+    assert tagger.resolve(history, now=100.3) == []
+
+
+def test_tagger_gives_up_after_tag_wait():
+    history = rolling_history(1.0)
+    tagger = FrameTagger()
+    tagger.add(3000, arrival=50.0)
+    assert tagger.resolve(history, now=50.0 + TAG_WAIT_S - 0.01) == []
+    # IMU cortada o reinicio: pasado TAG_WAIT_S se usa el extremo más cercano
+    tags = tagger.resolve(history, now=50.0 + TAG_WAIT_S)
+    assert [tag.capture_ms for tag in tags] == [3000]
+    assert tags[0].roll == pytest.approx(10.0)
+    assert not tagger.pending
+
+
+def test_tagger_without_history():
+    tagger = FrameTagger()
+    tagger.add(100, arrival=0.0)
+    assert tagger.resolve(AttitudeHistory(), now=0.1) == []
+    assert len(tagger.pending) == 1
+    # Vencida la espera sin ninguna muestra el cuadro queda sin etiqueta
+    assert tagger.resolve(AttitudeHistory(), now=TAG_WAIT_S) == []
+    assert not tagger.pending
+    tagger.add(200, arrival=1.0)
+    tagger.reset()
+    assert not tagger.pending
+
+
+@pytest.fixture
+def worker():
+    worker = VideoWorker()
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+def test_worker_decodes_only_the_latest(worker, jpegs):
+    worker.submit([(PKT_IMAGE, jpegs[0]), (PKT_IMAGE, jpegs[1])], None)
+    frame = wait_frame(worker)
+    assert np.array_equal(frame, decode_jpeg(jpegs[1]))
+    assert worker.stats.histograms['decode'].count == 1
+    # Repetición de la imagen en pantalla: no hay cuadro nuevo
+    worker.submit([(PKT_REPEAT, b'')], None)
+    time.sleep(0.05)
+    assert worker.take() is None
+
+
+def test_worker_waits_until_the_frame_is_taken(worker, jpegs):
+    worker.submit([(PKT_IMAGE, jpegs[0])], None, roll=10.0)
+    while not worker.ready():
+        time.sleep(0.002)
+    # Sin tomar el cuadro listo no se decodifica el siguiente (no pisa el búfer en pantalla)
+    worker.submit([(PKT_IMAGE, jpegs[1])], None, roll=10.0)
+    time.sleep(0.05)
+    assert worker.stats.histograms['stabilize'].count == 1
+    first = worker.take()
+    assert first.shape == decode_jpeg(jpegs[0]).shape
+    second = wait_frame(worker)
+    assert second is not first
+    assert worker.stats.histograms['stabilize'].count == 2
+    # Los dos búferes del estabilizador se alternan
+    worker.submit([(PKT_IMAGE, jpegs[0])], None, roll=20.0)
+    assert wait_frame(worker) is first
+
+
+def test_worker_redecodes_when_the_panel_grows(worker, jpegs):
+    worker.submit([(PKT_IMAGE, jpegs[1])], (80, 60))
+    wait_frame(worker)
+    worker.submit([(PKT_IMAGE, jpegs[0])], (80, 60))
+    assert wait_frame(worker).shape == (60, 80, 3)
+    worker.submit([], (320, 240))
+    assert wait_frame(worker).shape == (240, 320, 3)
+
+
+def test_reset_drops_the_pending_frame(worker, jpegs):
+    worker.submit([(PKT_IMAGE, jpegs[0])], None)
+    wait_frame(worker)
+    worker.submit([(PKT_IMAGE, jpegs[1])], None)
+    worker.reset()
+    worker.submit([(PKT_REPEAT, b'')], None)
+    time.sleep(0.05)
+    assert worker.take() is None
+    assert worker.video.full_jpeg is None
+    assert worker.stats.counters['repeat_without_ref'] == 1